@@ -0,0 +1,519 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Simulated WebHDFS cluster used by the benchmarks.
+
+A single HTTP server plays both the namenode and the datanodes: `CREATE`,
+`APPEND` and `OPEN` are redirected to the same server with a `datanode=true`
+parameter, like the two steps requests of a real cluster. Requests can be
+slowed down by a fixed latency, data streams capped to a bandwidth, and
+failures injected.
+
+File contents are not stored. Every file holds the bytes of a fixed periodic
+pattern, so that huge files cost no memory and written files can still be
+checked against their source: a written range is verified against the pattern
+and the checksum of a file only depends on its length when its whole content
+matches it.
+
+"""
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import logging as lg
+import multiprocessing
+import posixpath as psp
+import random
+import threading
+import time
+import urllib2
+import urlparse
+from collections import defaultdict
+
+_logger = lg.getLogger(__name__)
+
+# Period of the content of the files
+_PERIOD = 251
+_PATTERN = ''.join(chr(index % _PERIOD) for index in range(2 ** 16 + _PERIOD))
+_CHUNK_SIZE = 2 ** 16
+
+# Operations answered by the datanodes after a redirect
+_DATANODE_OPS = ('CREATE', 'APPEND', 'OPEN')
+
+def _pattern(offset, length):
+  """Content of a file between `offset` and `offset + length`."""
+  chunks = []
+  while length > 0:
+    size = min(length, _CHUNK_SIZE)
+    start = offset % _PERIOD
+    chunks.append(_PATTERN[start:start + size])
+    offset += size
+    length -= size
+  return ''.join(chunks)
+
+class FakeCluster(object):
+
+  """In-memory WebHDFS cluster.
+
+  :param latency: Seconds added to every request, namenode or datanode.
+  :param bandwidth: Maximum number of bytes per second of every data stream,
+    `0` for no limit.
+  :param fail_rate: Probability of a request to fail with a server error.
+  :param fail_ops: Operations the failures are injected into, all of them by
+    default.
+
+  """
+
+  def __init__(self, latency=0.0, bandwidth=0, fail_rate=0.0, fail_ops=None):
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.fail_rate = fail_rate
+    self.fail_ops = set(op.upper() for op in fail_ops) if fail_ops else None
+    self.url = None
+    self._lock = threading.RLock()
+    self._nodes = {}
+    self._children = defaultdict(set)
+    self._ids = 0
+    self._server = None
+    self.reset_stats()
+    self.add_dir('/')
+
+  def __repr__(self):
+    return '<%s(url=%r, latency=%r, bandwidth=%r, fail_rate=%r)>' % (
+      self.__class__.__name__, self.url, self.latency, self.bandwidth, self.fail_rate
+    )
+
+  # Content
+
+  def _add(self, path, node):
+    path = psp.normpath(path)
+    if path != '/':
+      self.add_dir(psp.dirname(path))
+      self._children[psp.dirname(path)].add(psp.basename(path))
+    self._ids += 1
+    # owned by the creating user, in the group of the parent directory
+    node.setdefault('owner', 'hdfs')
+    node.update(id=self._ids, access_time=0, modification_time=int(time.time() * 1000),
+                group=self._nodes[psp.dirname(path)]['group'] if path != '/' else 'supergroup')
+    self._nodes[path] = node
+    return node
+
+  def add_dir(self, path, owner='hdfs'):
+    """Create a directory and its missing parents, returns `False` if a file
+    is in the way."""
+    path = psp.normpath(path)
+    with self._lock:
+      node = self._nodes.get(path)
+      if node is not None:
+        return node['type'] == 'DIRECTORY'
+      if path != '/' and not self.add_dir(psp.dirname(path), owner):
+        return False
+      self._add(path, {'type': 'DIRECTORY', 'permission': '755', 'replication': 0, 'block_size': 0, 'length': 0, 'owner': owner})
+      return True
+
+  def add_file(self, path, length, block_size=2 ** 27, replication=3, permission='644'):
+    """Create a file holding `length` bytes of the pattern."""
+    with self._lock:
+      self._add(path, {
+        'type': 'FILE', 'permission': permission, 'replication': replication, 'block_size': block_size,
+        'length': length, 'phase': 0, 'intact': True,
+      })
+
+  def files(self, path='/'):
+    """Generate the `(path, length, intact)` tuples of the files below a
+    path, `intact` telling whether the content is the pattern."""
+    with self._lock:
+      paths = list(self._walk(psp.normpath(path)))
+    for file_path in paths:
+      node = self._nodes[file_path]
+      if node['type'] == 'FILE':
+        yield file_path, node['length'], node['intact'] and node['phase'] == 0
+
+  def _walk(self, path):
+    pending = [path]
+    while pending:
+      path = pending.pop()
+      if path not in self._nodes:
+        continue
+      yield path
+      pending.extend(psp.join(path, name) for name in self._children.get(path, ()))
+
+  def _remove(self, path):
+    paths = list(self._walk(path))
+    for removed in paths:
+      del self._nodes[removed]
+      self._children.pop(removed, None)
+    self._children[psp.dirname(path)].discard(psp.basename(path))
+    return paths
+
+  def _checksum(self, node):
+    if node['intact'] and node['phase'] == 0:
+      content = 'pattern:%s' % (node['length'], )
+    else:
+      content = 'file:%s' % (node['id'], )
+    return {'algorithm': 'MD5-of-0MD5-of-512CRC32C', 'bytes': hashlib.md5(content).hexdigest() + '00000000', 'length': 28}
+
+  def _status(self, path, suffix=''):
+    node = self._nodes[path]
+    return {
+      'pathSuffix': suffix, 'type': node['type'], 'length': node['length'],
+      'owner': node['owner'], 'group': node['group'], 'permission': node['permission'],
+      'accessTime': node['access_time'], 'modificationTime': node['modification_time'],
+      'blockSize': node['block_size'], 'replication': node['replication'],
+      'fileId': node['id'], 'childrenNum': len(self._children.get(path, ())),
+    }
+
+  # Statistics
+
+  def reset_stats(self):
+    """Reset the request counters."""
+    with self._lock:
+      self._stats = {'namenode': defaultdict(int), 'datanode': defaultdict(int), 'failures': 0,
+                     'bytes_read': 0, 'bytes_written': 0}
+
+  def stats(self):
+    """Number of requests per operation of the namenode and the datanodes,
+    injected failures, bytes transferred, and files stored."""
+    files = list(self.files())
+    with self._lock:
+      return {
+        'files'         : len(files),
+        'intact_files'  : sum(1 for _, _, intact in files if intact),
+        'namenode'      : dict(self._stats['namenode']),
+        'namenode_rpcs' : sum(self._stats['namenode'].values()),
+        'datanode'      : dict(self._stats['datanode']),
+        'failures'      : self._stats['failures'],
+        'bytes_read'    : self._stats['bytes_read'],
+        'bytes_written' : self._stats['bytes_written'],
+      }
+
+  # Server
+
+  def start(self, host='127.0.0.1', port=0):
+    """Start serving in a background thread, returns the cluster url."""
+    self._server = _Server((host, port), _handler(self))
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = 'http://%s:%s' % self._server.server_address
+    _logger.info('Started %r.', self)
+    return self.url
+
+  def stop(self):
+    """Stop serving."""
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  request_queue_size = 128
+
+def _handler(cluster):
+  """Request handler class of a cluster."""
+
+  class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # responses are sent at once, small writes would wait for delayed acks
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+      pass
+
+    def _throttle(self, start, nbytes):
+      if cluster.bandwidth:
+        delay = start + float(nbytes) / cluster.bandwidth - time.time()
+        if delay > 0:
+          time.sleep(delay)
+
+    def _body(self):
+      """Generate the chunks of the request body."""
+      if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        while True:
+          size = int(self.rfile.readline().strip().split(';')[0], 16)
+          if size == 0:
+            while self.rfile.readline().strip():
+              pass
+            return
+          yield self.rfile.read(size)
+          self.rfile.readline()
+      remaining = int(self.headers.get('Content-Length') or 0)
+      while remaining > 0:
+        chunk = self.rfile.read(min(remaining, _CHUNK_SIZE))
+        if not chunk:
+          return
+        remaining -= len(chunk)
+        yield chunk
+
+    def _receive(self, node, offset):
+      """Consume the request body written at `offset` of a file, checking
+      whether it continues the pattern. The first byte of a created file tells
+      which pattern offset its content starts from."""
+      start = time.time()
+      intact = True
+      nbytes = 0
+      for chunk in self._body():
+        if node['phase'] is None:
+          node['phase'] = ord(chunk[0])
+        intact = intact and chunk == _pattern(node['phase'] + offset + nbytes, len(chunk))
+        nbytes += len(chunk)
+        self._throttle(start, nbytes)
+      with cluster._lock:
+        if node['phase'] is None:
+          node['phase'] = 0
+        node['length'] = offset + nbytes
+        node['intact'] = node['intact'] and intact
+        cluster._stats['bytes_written'] += nbytes
+
+    def _send(self, code, obj=None, headers=None):
+      body = json.dumps(obj) if obj is not None else ''
+      self.send_response(code)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      for name, value in (headers or {}).items():
+        self.send_header(name, value)
+      self.end_headers()
+      self.wfile.write(body)
+
+    def _stream(self, node, offset, length):
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/octet-stream')
+      self.send_header('Content-Length', str(length))
+      self.end_headers()
+      start = time.time()
+      sent = 0
+      while sent < length:
+        size = min(length - sent, _CHUNK_SIZE)
+        self.wfile.write(_pattern(node['phase'] + offset + sent, size))
+        sent += size
+        self._throttle(start, sent)
+      with cluster._lock:
+        cluster._stats['bytes_read'] += length
+
+    def _error(self, code, exception, message):
+      self._send(code, {'RemoteException': {'exception': exception, 'javaClassName': exception, 'message': message}})
+
+    def _missing(self, path):
+      self._error(404, 'FileNotFoundException', 'File does not exist: %s' % (path, ))
+
+    def _redirect(self):
+      self._send(307, headers={'Location': 'http://%s:%s%s&datanode=true' % (
+        self.server.server_address[0], self.server.server_address[1], self.path
+      )})
+
+    def _handle(self):
+      url = urlparse.urlparse(self.path)
+      params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+      path = psp.normpath(url.path[len('/webhdfs/v1'):] or '/')
+      op = params.get('op', '').upper()
+      if op == 'BENCHMARKSTATS':
+        stats = cluster.stats()
+        if params.get('reset') == 'true':
+          cluster.reset_stats()
+        return self._send(200, stats)
+
+      datanode = params.get('datanode') == 'true'
+      with cluster._lock:
+        cluster._stats['datanode' if datanode else 'namenode'][op] += 1
+      if cluster.latency:
+        time.sleep(cluster.latency)
+      if cluster.fail_rate and (cluster.fail_ops is None or op in cluster.fail_ops) and random.random() < cluster.fail_rate:
+        with cluster._lock:
+          cluster._stats['failures'] += 1
+        for _ in self._body():
+          pass
+        return self._error(500, 'IOException', 'Injected failure of %s %s' % (op, path))
+      try:
+        self._dispatch(op, path, params, datanode)
+      except KeyError as err:
+        self._error(400, 'IllegalArgumentException', 'Missing parameter %s' % (err, ))
+
+    def _dispatch(self, op, path, params, datanode):
+      nodes = cluster._nodes
+      node = nodes.get(path)
+      if op == 'GETHOMEDIRECTORY':
+        return self._send(200, {'Path': '/user/%s' % (params.get('user.name', 'hdfs'), )})
+
+      if op in _DATANODE_OPS and not datanode:
+        # namenode step, the data is sent to a datanode
+        if op == 'CREATE' and node is not None and params.get('overwrite', 'false').lower() != 'true':
+          return self._error(403, 'FileAlreadyExistsException', '%s already exists' % (path, ))
+        if op != 'CREATE' and (node is None or node['type'] != 'FILE'):
+          return self._missing(path)
+        return self._redirect()
+
+      if op == 'CREATE':
+        with cluster._lock:
+          if node is not None:
+            cluster._remove(path)
+          if not cluster.add_dir(psp.dirname(path), params.get('user.name', 'hdfs')):
+            return self._error(400, 'ParentNotDirectoryException', 'Parent of %s is not a directory' % (path, ))
+          node = cluster._add(path, {
+            'type': 'FILE', 'permission': params.get('permission') or '644', 'length': 0, 'phase': None, 'intact': True,
+            'replication': int(params.get('replication') or 3), 'block_size': int(params.get('blocksize') or 2 ** 27),
+            'owner': params.get('user.name', 'hdfs'),
+          })
+        self._receive(node, 0)
+        return self._send(201)
+      if op == 'APPEND':
+        self._receive(node, node['length'])
+        return self._send(200)
+      if op == 'OPEN':
+        offset = int(params.get('offset') or 0)
+        length = params.get('length')
+        length = node['length'] - offset if length in (None, '', 'None') else min(int(length), node['length'] - offset)
+        return self._stream(node, offset, max(length, 0))
+
+      if op == 'GETFILESTATUS':
+        if node is None:
+          return self._missing(path)
+        with cluster._lock:
+          return self._send(200, {'FileStatus': cluster._status(path)})
+      if op == 'LISTSTATUS':
+        if node is None:
+          return self._missing(path)
+        with cluster._lock:
+          if node['type'] == 'FILE':
+            statuses = [cluster._status(path)]
+          else:
+            statuses = [cluster._status(psp.join(path, name), name) for name in sorted(cluster._children.get(path, ()))]
+        return self._send(200, {'FileStatuses': {'FileStatus': statuses}})
+      if op == 'GETCONTENTSUMMARY':
+        if node is None:
+          return self._missing(path)
+        with cluster._lock:
+          walked = [nodes[walked_path] for walked_path in cluster._walk(path)]
+        return self._send(200, {'ContentSummary': {
+          'length': sum(walked_node['length'] for walked_node in walked),
+          'fileCount': sum(1 for walked_node in walked if walked_node['type'] == 'FILE'),
+          'directoryCount': sum(1 for walked_node in walked if walked_node['type'] == 'DIRECTORY'),
+          'quota': -1, 'spaceConsumed': 0, 'spaceQuota': -1,
+        }})
+      if op == 'GETFILECHECKSUM':
+        if node is None or node['type'] != 'FILE':
+          return self._missing(path)
+        return self._send(200, {'FileChecksum': cluster._checksum(node)})
+      if op == 'MKDIRS':
+        return self._send(200, {'boolean': cluster.add_dir(path, params.get('user.name', 'hdfs'))})
+      if op == 'DELETE':
+        with cluster._lock:
+          if node is None:
+            return self._send(200, {'boolean': False})
+          if node['type'] == 'DIRECTORY' and cluster._children.get(path) and params.get('recursive', 'false').lower() != 'true':
+            return self._error(403, 'PathIsNotEmptyDirectoryException', '%s is non empty' % (path, ))
+          cluster._remove(path)
+        return self._send(200, {'boolean': True})
+      if op == 'RENAME':
+        destination = psp.normpath(params['destination'])
+        with cluster._lock:
+          parent = nodes.get(psp.dirname(destination))
+          if node is None or destination in nodes or parent is None or parent['type'] != 'DIRECTORY':
+            return self._send(200, {'boolean': False})
+          moved = dict((moved_path, nodes[moved_path]) for moved_path in cluster._walk(path))
+          children = dict((moved_path, cluster._children.get(moved_path)) for moved_path in moved)
+          cluster._remove(path)
+          for moved_path, moved_node in moved.items():
+            new_path = destination + moved_path[len(path):]
+            nodes[new_path] = moved_node
+            if children[moved_path]:
+              cluster._children[new_path] = children[moved_path]
+          cluster._children[psp.dirname(destination)].add(psp.basename(destination))
+        return self._send(200, {'boolean': True})
+      if op == 'CONCAT':
+        with cluster._lock:
+          if node is None:
+            return self._missing(path)
+          for source in params['sources'].split(','):
+            source_node = nodes.get(source)
+            if source_node is None:
+              return self._missing(source)
+            # the content stays the pattern if the source continues it
+            node['intact'] = node['intact'] and source_node['intact'] and (
+              (node['phase'] + node['length']) % _PERIOD == source_node['phase'] % _PERIOD
+            )
+            node['length'] += source_node['length']
+            cluster._remove(source)
+        return self._send(200)
+      if op in ('SETOWNER', 'SETPERMISSION', 'SETTIMES', 'SETREPLICATION'):
+        if node is None:
+          return self._missing(path)
+        with cluster._lock:
+          if op == 'SETOWNER':
+            node['owner'] = params.get('owner') or node['owner']
+            node['group'] = params.get('group') or node['group']
+          elif op == 'SETPERMISSION':
+            node['permission'] = params.get('permission') or '755'
+          elif op == 'SETTIMES':
+            if params.get('modificationtime') not in (None, '', '-1'):
+              node['modification_time'] = int(params['modificationtime'])
+            if params.get('accesstime') not in (None, '', '-1'):
+              node['access_time'] = int(params['accesstime'])
+          else:
+            if node['type'] != 'FILE':
+              return self._send(200, {'boolean': False})
+            node['replication'] = int(params['replication'])
+            return self._send(200, {'boolean': True})
+        return self._send(200)
+      return self._error(400, 'IllegalArgumentException', 'Invalid value for webhdfs parameter "op": %s' % (op, ))
+
+    def do_GET(self):
+      self._handle()
+
+    def do_PUT(self):
+      self._handle()
+
+    def do_POST(self):
+      self._handle()
+
+    def do_DELETE(self):
+      self._handle()
+
+  return _Handler
+
+# Separate process
+# ----------------
+
+def _serve(options, populate, conn):
+  cluster = FakeCluster(**options)
+  if populate is not None:
+    populate(cluster)
+  conn.send(cluster.start())
+  conn.recv()
+  cluster.stop()
+
+class ClusterProcess(object):
+
+  """Fake cluster served by another process, so that it does not compete with
+  the benchmarked client for the interpreter lock.
+
+  :param populate: Module level function called with the
+    :class:`FakeCluster` to create its files before it starts serving.
+  :param \*\*options: Keyword arguments passed to :class:`FakeCluster`.
+
+  """
+
+  def __init__(self, populate=None, **options):
+    self._conn, child_conn = multiprocessing.Pipe()
+    self._process = multiprocessing.Process(target=_serve, args=(options, populate, child_conn))
+    self._process.daemon = True
+    self._process.start()
+    self.url = self._conn.recv()
+
+  def stats(self, reset=False):
+    """Request counters of the cluster, see :meth:`FakeCluster.stats`."""
+    response = urllib2.urlopen('%s/webhdfs/v1/?op=BENCHMARKSTATS&reset=%s' % (self.url, 'true' if reset else 'false'))
+    return json.loads(response.read())
+
+  def stop(self):
+    """Stop the cluster process."""
+    self._conn.send(None)
+    self._process.join()
+
+def client(url, **kwargs):
+  """Insecure pywhdfs client of a fake cluster."""
+  from pywhdfs.client import create_client
+  return create_client('NONE', nameservices=[{'urls': [url], 'mounts': ['/']}], user='benchmark', **kwargs)
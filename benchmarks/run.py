@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Benchmark pydistcp copies between simulated WebHDFS clusters.
+
+Usage:
+  run.py [-v...] [--latency=SECONDS] [--bandwidth=BYTES] [--fail-rate=RATE] [--fail-ops=OPS] [--scale=SCALE] [--threads=THREADS] [--processes=PROCESSES] [--split-size=SPLIT_SIZE] [--buffer-depth=DEPTH] [--output=FILE] [SCENARIO...]
+  run.py (--list | -h)
+
+Options:
+  -h --help                     Show help and exit.
+  --list                        List the scenarios and exit.
+  -v --verbose                  Enable log output. Can be specified up to three
+                                times (increasing verbosity each time).
+  --latency=SECONDS             Latency added to every namenode and datanode request.
+                                [default: 0.002]
+  --bandwidth=BYTES             Maximum bytes per second of every data stream, 0 for
+                                no limit. [default: 0]
+  --fail-rate=RATE              Probability of a request to fail with a server error.
+                                [default: 0]
+  --fail-ops=OPS                Comma separated operations the failures are injected
+                                into, all of them by default.
+  --scale=SCALE                 Multiplier of the number of files (or of their size for
+                                the huge files scenario). [default: 1]
+  --threads=THREADS             Number of copy threads, 0 adapts them. [default: 16]
+  --processes=PROCESSES         Number of copy processes. [default: 1]
+  --split-size=SPLIT_SIZE       Split size of the copy, 0 disables splitting. [default: 0]
+  --buffer-depth=DEPTH          Read ahead buffers of every transfer. [default: 4]
+  --output=FILE                 Write the results to FILE rather than the standard output.
+
+Every scenario copies the `/data` directory of a fresh source cluster to a
+fresh destination cluster, both served by separate processes. The results are
+printed as a JSON list with one entry per scenario: files and megabytes copied
+per second, namenode requests (RPCs) and datanode requests of both clusters,
+and the job status.
+
+"""
+
+import functools
+import json
+import logging as lg
+import math
+import os.path as osp
+import random
+import sys
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from docopt import docopt
+from fakehdfs import ClusterProcess, client
+from pydistcp.distclient import WebHDFSDistClient
+
+# Scenarios
+# ---------
+
+def _small_files(cluster, scale):
+  """Many small files spread over a hundred directories."""
+  rng = random.Random(1)
+  for index in range(int(5000 * scale)):
+    cluster.add_file('/data/dir%02d/file%06d' % (index % 100, index), rng.randint(1, 16) * 1024)
+
+def _huge_files(cluster, scale):
+  """Few huge files of several blocks."""
+  for index in range(4):
+    cluster.add_file('/data/file%d' % (index, ), int(256 * 2 ** 20 * scale), block_size=2 ** 26)
+
+def _deep_tree(cluster, scale):
+  """Small files at every level of a deep binary tree of directories."""
+  pending = [('/data', 0)]
+  # doubling the scale adds a level
+  depth = max(int(round(10 + math.log(scale, 2))), 1)
+  while pending:
+    path, level = pending.pop()
+    cluster.add_file('%s/file' % (path, ), 4096)
+    if level < depth:
+      pending.extend(('%s/d%d' % (path, branch), level + 1) for branch in range(2))
+
+def _skewed_sizes(cluster, scale):
+  """Pareto distributed sizes, most files are small and a few are huge."""
+  rng = random.Random(2)
+  for index in range(int(2000 * scale)):
+    length = min(int(4096 * rng.paretovariate(1.1)), 2 ** 29)
+    cluster.add_file('/data/dir%02d/file%06d' % (index % 20, index), length, block_size=2 ** 26)
+
+SCENARIOS = [
+  ('small_files', _small_files),
+  ('huge_files', _huge_files),
+  ('deep_tree', _deep_tree),
+  ('skewed_sizes', _skewed_sizes),
+]
+
+# Runner
+# ------
+
+def run_scenario(name, populate, cluster_options, copy_options, scale=1):
+  """Copy the files of a scenario between two fresh clusters.
+
+  :param name: Scenario name.
+  :param populate: Function creating the source files, called with the
+    cluster and `scale`.
+  :param cluster_options: Keyword arguments of both clusters.
+  :param copy_options: Keyword arguments of :meth:`WebHDFSDistClient.copy`.
+  :param scale: Scale of the scenario.
+  """
+  src = ClusterProcess(populate=functools.partial(populate, scale=scale), **cluster_options)
+  dst = ClusterProcess(**cluster_options)
+  try:
+    dist_client = WebHDFSDistClient(client(src.url), client(dst.url))
+    src.stats(reset=True)
+    dst.stats(reset=True)
+    start = time.time()
+    status = dist_client.copy('/data', '/copy', **copy_options)
+    duration = time.time() - start
+    src_stats = src.stats()
+    dst_stats = dst.stats()
+  finally:
+    src.stop()
+    dst.stop()
+
+  nbytes = status['Size Copied'] + status['Size Skipped']
+  nfiles = status['Files Copied'] + status['Files Skipped']
+  return {
+    'scenario'           : name,
+    'files'              : nfiles,
+    'bytes'              : nbytes,
+    'duration'           : duration,
+    'files_per_second'   : nfiles / duration,
+    'mb_per_second'      : nbytes / duration / 2 ** 20,
+    'namenode_rpcs'      : {'source': src_stats['namenode_rpcs'], 'destination': dst_stats['namenode_rpcs']},
+    'intact_files'       : dst_stats['intact_files'],
+    'source'             : src_stats,
+    'destination'        : dst_stats,
+    'status'             : status,
+  }
+
+def main(argv=None):
+  """Entry point.
+  :param argv: Arguments list.
+  """
+  args = docopt(__doc__, argv=argv)
+  if args['--list']:
+    for name, populate in SCENARIOS:
+      print '%-15s %s' % (name, populate.__doc__)
+    return
+
+  levels = [lg.WARNING, lg.INFO, lg.DEBUG]
+  lg.basicConfig(level=levels[min(args['--verbose'], len(levels) - 1)])
+
+  names = args['SCENARIO'] or [name for name, _ in SCENARIOS]
+  scenarios = dict(SCENARIOS)
+  for name in names:
+    if name not in scenarios:
+      sys.exit('Unknown scenario %r, see --list.' % (name, ))
+
+  cluster_options = {
+    'latency'   : float(args['--latency']),
+    'bandwidth' : int(args['--bandwidth']),
+    'fail_rate' : float(args['--fail-rate']),
+    'fail_ops'  : args['--fail-ops'].split(',') if args['--fail-ops'] else None,
+  }
+  copy_options = {
+    'n_threads'    : int(args['--threads']),
+    'n_processes'  : int(args['--processes']),
+    'split_size'   : int(args['--split-size']),
+    'buffer_depth' : int(args['--buffer-depth']),
+    'retry_delay'  : 0.1,
+  }
+  results = [
+    run_scenario(name, scenarios[name], cluster_options, copy_options, scale=float(args['--scale']))
+    for name in names
+  ]
+
+  output = json.dumps({'clusters': cluster_options, 'copy': copy_options, 'results': results}, indent=2, sort_keys=True)
+  if args['--output']:
+    with open(args['--output'], 'w') as writer:
+      writer.write(output)
+  else:
+    print output
+
+if __name__ == '__main__':
+  main()
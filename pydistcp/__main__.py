@@ -4,7 +4,8 @@
 """pydistcp: A python Web HDFS based tool for inter/intra-cluster data copying.
 
 Usage:
-  pydistcp [-fp] [--files-only] [--no-checksum] [--silent] (-s CLUSTER -d CLUSTER) [-v...] [--conf=CONFIGURATION] [--part-size=PART_SIZE] [--buffer-size=BUFFER_SIZE] [--min-size=SIZE] [--include-pattern=PATTERN] [--threads=THREADS] SRC_PATH DEST_PATH
+  pydistcp [-fp] [--delete] [--preserve-attributes=ATTRS] [--preserve-threads=THREADS] [--umask=UMASK] [--files-only] [--no-checksum] [--compare=MODE] [--checksum-cache=CACHE [--checksum-cache-size=SIZE]] [--silent] (-s CLUSTER -d CLUSTER) [-v...] [--conf=CONFIGURATION] [--part-size=PART_SIZE] [--buffer-size=BUFFER_SIZE] [--buffer-depth=DEPTH] [--split-size=SPLIT_SIZE] [--schedule=SCHEDULE] [--queue-size=QUEUE_SIZE] [--journal=JOURNAL [--resume]] [--min-size=SIZE] [--include-pattern=PATTERN] [--threads=THREADS] [--min-threads=THREADS] [--max-threads=THREADS] [--processes=PROCESSES] [--retries=RETRIES] [--retry-delay=DELAY] [--metrics=MODE] [--metrics-file=FILE] [--pool-size=SIZE] [--host-spread=POLICY] [--no-warm-up] (--batch=FILE [--max-jobs=JOBS] | [--coordinator=ADDRESS [--lease-timeout=SECONDS]] SRC_PATH DEST_PATH)
+  pydistcp --worker=ADDRESS (-s CLUSTER -d CLUSTER) [-v...] [--conf=CONFIGURATION] [--threads=THREADS] [--min-threads=THREADS] [--max-threads=THREADS] [--checksum-cache=CACHE [--checksum-cache-size=SIZE]] [--preserve-threads=THREADS] [--pool-size=SIZE] [--host-spread=POLICY] [--no-warm-up]
   pydistcp (--version | -h)
 
 Options:
@@ -16,24 +17,97 @@ Options:
                                 times (increasing verbosity each time).
   --no-checksum                 Disable checksum check prior to file transfer. This will force
                                 overwrite.
+  --compare=MODE                How existing files of the same length are compared, checksum
+                                compares their checksums, tiered skips the files with the
+                                same modification time (see --preserve) and compares the
+                                checksums of the other ones. [default: checksum]
+  --checksum-cache=CACHE        Cache the file checksums across jobs in the CACHE SQLite file, unchanged
+                                files are not checksummed again.
+  --checksum-cache-size=SIZE    Maximum number of cached checksums, the least recently used
+                                ones are evicted. [default: 1000000]
   --files-only                  Do not create the same directory strecture at the destination and copy
                                 files only under DEST_PATH.
   --silent                      Don't display progress status.
   -f --force                    Allow overwriting any existing files.
+  --delete                      Delete the destination files and directories missing from the
+                                source, requires --force.
   -p --preserve                 Preserve file attributes.
+  --preserve-attributes=ATTRS   Attributes preserved between clusters, any of r (replication),
+                                b (block size), u (user), g (group), p (permission)
+                                and t (times). [default: rbugpt]
+  --preserve-threads=THREADS    Number of threads applying the preserved attributes. [default: 4]
+  --umask=UMASK                 Umask of the destination cluster (fs.permissions.umask-mode), the
+                                preserved permissions it would change are set again after
+                                creating the files. [default: 022]
   --threads=THREADS             Number of threads to use for parallelization.
-                                0 allocates a thread per file. [default: 0]
+                                0 adapts the number of threads to the measured throughput
+                                and failures. [default: 0]
+  --min-threads=THREADS         Initial and minimum number of threads when adapted. [default: 1]
+  --max-threads=THREADS         Maximum number of threads when adapted. [default: 32]
+  --processes=PROCESSES         Number of processes copying the files, each one using THREADS
+                                threads and its own cluster connections. [default: 1]
+  --retries=RETRIES             Number of retries of a cluster operation failing with a transient
+                                error, the files still failing are copied again at the end
+                                of the job. [default: 3]
+  --retry-delay=DELAY           Delay in seconds before the first retry, doubled before each of
+                                the next ones. [default: 1]
+  --metrics=MODE                Timing of the job phases and count of the cluster requests reported
+                                in the job status, basic keeps histograms, detailed also
+                                times every file, off disables them. [default: basic]
+  --metrics-file=FILE           Write the metrics to FILE in the Prometheus text format.
+  --pool-size=SIZE              Number of connections kept alive to every host of the clusters,
+                                0 sizes the pools to the number of threads. [default: 0]
+  --host-spread=POLICY          How the requests are spread across the hosts of a nameservice,
+                                first sends them to the active one, round-robin to every host
+                                in turn and least-outstanding to the least busy one, only
+                                for hosts which all serve requests like HttpFS
+                                gateways. [default: first]
+  --no-warm-up                  Do not open the connections of the threads before the copy starts.
   --include-pattern=PATTERN     Filter input files based on a pattern. [default: *]
   --min-size=SIZE               Filter input files based on minimum size. [default: 0]
   --part-size=PART_SIZE         Interval in bytes by which the files will be copied
                                 needs to be a Powers of 2. [default: 65536]
   --buffer-size=BUFFER_SIZE     The buffer size in bytes used for hdfs read and write operations
                                 needs to be a Powers of 2. [default: 65536]
+  --buffer-depth=DEPTH          Number of BUFFER_SIZE buffers read from the source ahead of the
+                                destination write, 0 streams the source directly into the
+                                write. [default: 4]
+  --split-size=SPLIT_SIZE       Copy files bigger than SPLIT_SIZE bytes as multiple parts in
+                                parallel, parts are rounded up to the source block size
+                                and concatenated at the destination. 0 disables
+                                splitting. [default: 0]
+  --schedule=SCHEDULE           Order in which the files are copied, size copies the largest
+                                files first and lets the small ones fill the gaps, walk
+                                keeps the listing order. [default: size]
+  --queue-size=QUEUE_SIZE       Maximum number of scanned files waiting to be copied, the copy
+                                starts while the source is still being scanned.
+                                [default: 10000]
+  --journal=JOURNAL             Record the outcome of every file in the JOURNAL SQLite file.
+  --resume                      Resume the copy recorded in JOURNAL, only the files not yet
+                                copied or skipped are copied again.
+  --batch=FILE                  Copy every SRC_PATH DEST_PATH pair listed on the lines of FILE,
+                                sharing the cluster connections and the threads budget
+                                (--threads or --max-threads) between the pairs, whose files
+                                are copied in turn. JOURNAL is suffixed by the index of
+                                every pair.
+  --max-jobs=JOBS               Number of pairs of a batch copied at the same time.
+                                [default: 4]
+  --coordinator=ADDRESS         Scan the source and hand its files to the workers connecting to
+                                the HOST:PORT address instead of copying them, port 0 picks a
+                                free one. The workers and the coordinator share the secret of
+                                the PYDISTCP_AUTHKEY environment variable.
+  --lease-timeout=SECONDS       Number of seconds without news from a worker after which its
+                                files are handed to the other workers. [default: 60]
+  --worker=ADDRESS              Copy the files handed by the coordinator listening on HOST:PORT,
+                                with the options of its job and THREADS threads.
   --conf=CONFIGURATION          pywhdfs configuration file to use. Defauls to ~/.webhdfs.cfg and could
                                 be set using the environement variable WEBHDFS_CONFIG.
 
 Examples:
   pydistcp -s prod -d preprod -v /tmp/src /tmp/dest
+  pydistcp -s prod -d preprod --batch=datasets.txt --threads=32
+  pydistcp -s prod -d preprod --coordinator=0.0.0.0:7650 /tmp/src /tmp/dest
+  pydistcp -s prod -d preprod --worker=edge1:7650 --threads=16
 
 """
 
@@ -42,10 +116,12 @@ from pywhdfs.config import WebHDFSConfig
 from pywhdfs.utils.utils import *
 from docopt import docopt
 from .distclient import WebHDFSDistClient
+from .local import LocalClient
 from .utils import _Progress
 import logging as lg
 import requests as rq
 import json
+import os
 import sys
 
 def configure(args, path=None):
@@ -92,6 +168,36 @@ def configure(args, path=None):
   logger.addHandler(handler)
   return config
 
+def _read_pairs(path):
+  """Source and destination paths of a batch, one pair per line. Empty lines
+  and lines starting with `#` are ignored."""
+  pairs = []
+  with open(path) as reader:
+    for line_number, line in enumerate(reader, 1):
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      fields = line.split()
+      if len(fields) != 2:
+        raise ValueError('Line %s of %r is not a SRC_PATH DEST_PATH pair.' % (line_number, path))
+      pairs.append(tuple(fields))
+  return pairs
+
+def _address(address):
+  """`(host, port)` tuple of a HOST:PORT address."""
+  host, _, port = address.rpartition(':')
+  if not port.isdigit():
+    raise ValueError('Invalid address %r, expected HOST:PORT.' % (address, ))
+  return host or 'localhost', int(port)
+
+def _authkey():
+  """Secret shared by a coordinator and its workers."""
+  authkey = os.environ.get('PYDISTCP_AUTHKEY')
+  if not authkey:
+    print('the PYDISTCP_AUTHKEY environment variable must be set to coordinate workers.')
+    sys.exit(1)
+  return authkey
+
 def main(argv=None):
   """Entry point.
   :param argv: Arguments list.
@@ -104,87 +210,127 @@ def main(argv=None):
   config = configure(args, conf_file)
 
   n_threads = int(args['--threads'])
+  min_threads = int(args['--min-threads'])
+  max_threads = int(args['--max-threads'])
+  n_processes = int(args['--processes'])
+  retries = int(args['--retries'])
+  retry_delay = float(args['--retry-delay'])
+  metrics = args['--metrics']
+  metrics_file = args['--metrics-file']
   part_size = int(args['--part-size'])
   buffer_size = int(args['--buffer-size'])
+  buffer_depth = int(args['--buffer-depth'])
+  split_size = int(args['--split-size'])
+  schedule = args['--schedule']
+  queue_size = int(args['--queue-size'])
+  journal = args['--journal']
+  resume = args['--resume']
   include_pattern = args['--include-pattern']
   min_size = int(args['--min-size'])
   force = args['--force']
+  delete = args['--delete']
   silent = args['--silent']
   checksum = False if args['--no-checksum'] else True
+  compare = args['--compare']
+  checksum_cache = args['--checksum-cache']
+  checksum_cache_size = int(args['--checksum-cache-size'])
   files_only = True if args['--files-only'] else False
+  preserve_attributes = args['--preserve-attributes'] if args['--preserve'] else ''
+  preserve_threads = int(args['--preserve-threads'])
+  umask = args['--umask']
+  pool_size = int(args['--pool-size'])
+  host_spread = args['--host-spread']
+  warm_up = not args['--no-warm-up']
   src_path = args['SRC_PATH']
   dest_path = args['DEST_PATH']
 
-  if args["--src"] != 'local' and args["--dest"] != 'local':
-    src_client = config.get_client(args["--src"])
-    dest_client = config.get_client(args["--dest"])
-    client = WebHDFSDistClient(src_client, dest_client)
-
-    if sys.stderr.isatty() and not silent:
-      progress = _Progress.from_hdfs(client.src,src_path)
+  if args["--src"] != 'local' or args["--dest"] != 'local':
+    # local files are read and written by the same engine
+    if args["--src"] == 'local':
+      src_client = LocalClient()
     else:
-      progress = None
-
-    status = client.copy(
-              src_path,
-              dest_path,
-              overwrite=force,
-              checksum=checksum,
-              chunk_size=part_size,
-              buffer_size=buffer_size,
-              n_threads=n_threads,
-              progress=progress,
-              preserve= True if args['--preserve'] else False,
-            )
+      src_client = config.get_client(args["--src"])
+    if args["--dest"] == 'local':
+      dest_client = LocalClient()
+    else:
+      dest_client = config.get_client(args["--dest"])
+    client = WebHDFSDistClient(src_client, dest_client)
 
-    # Finilize the progress bar before printing the final job status
-    if progress:
-      del(progress)
-    print "Job Status:"
-    print json.dumps(status, indent=2)
+    if args['--worker']:
+      # the other options are the ones of the coordinator job
+      status = client.work(
+        _address(args['--worker']),
+        _authkey(),
+        n_threads=n_threads,
+        min_threads=min_threads,
+        max_threads=max_threads,
+        checksum_cache=checksum_cache,
+        checksum_cache_size=checksum_cache_size,
+        preserve_threads=preserve_threads,
+        pool_size=pool_size,
+        host_spread=host_spread,
+        warm_up=warm_up,
+      )
+      print "Worker Status:"
+      print json.dumps(status, indent=2)
+      sys.exit(0)
 
-  elif args["--src"] == 'local' and args["--dest"] != 'local':
-    client = config.get_client(args["--dest"])
     if sys.stderr.isatty() and not silent:
-      progress = _Progress.from_local(src_path, include_pattern=include_pattern, min_size=min_size)
+      # the totals are found by the scan of the copy
+      progress = _Progress.from_scan()
     else:
       progress = None
 
-    status = client.upload(
-              dest_path,
-              src_path,
+    copy_kwargs = dict(
               overwrite=force,
+              delete=delete,
               checksum=checksum,
               chunk_size=part_size,
+              buffer_size=buffer_size,
+              buffer_depth=buffer_depth,
               n_threads=n_threads,
+              min_threads=min_threads,
+              max_threads=max_threads,
+              n_processes=n_processes,
               progress=progress,
+              scan_progress=progress.expand if progress else None,
+              preserve=preserve_attributes,
+              preserve_threads=preserve_threads,
+              umask=umask,
+              split_size=split_size,
+              schedule=schedule,
+              queue_size=queue_size,
+              journal=journal,
+              resume=resume,
+              compare=compare,
+              checksum_cache=checksum_cache,
+              checksum_cache_size=checksum_cache_size,
+              retries=retries,
+              retry_delay=retry_delay,
+              metrics=metrics,
+              metrics_file=metrics_file,
               include_pattern=include_pattern,
-              files_only=files_only,
               min_size=min_size,
-              preserve= True if args['--preserve'] else False,
+              files_only=files_only,
+              pool_size=pool_size,
+              host_spread=host_spread,
+              warm_up=warm_up,
             )
+    if args['--batch']:
+      status = client.copy_batch(_read_pairs(args['--batch']), max_jobs=int(args['--max-jobs']), **copy_kwargs)
+    elif args['--coordinator']:
+      status = client.copy(src_path, dest_path, coordinator=_address(args['--coordinator']), authkey=_authkey(),
+                           lease_timeout=float(args['--lease-timeout']), **copy_kwargs)
+    else:
+      status = client.copy(src_path, dest_path, **copy_kwargs)
 
-    # Finilize the progress bar before printing the final job status
+    # Finilize the progress bar before printing the final job status, the
+    # copy arguments still refer to it
     if progress:
-      del(progress)
+      progress.finish()
     print "Job Status:"
     print json.dumps(status, indent=2)
-  elif args["--src"] != 'local' and args["--dest"] == 'local':
-    client = config.get_client(args["--src"])
-    if sys.stderr.isatty() and not silent:
-      progress = _Progress.from_hdfs(client,src_path)
-    else:
-      progress = None
 
-    client.download(
-      src_path,
-      dest_path,
-      overwrite=force,
-      chunk_size=part_size,
-      n_threads=n_threads,
-      progress=progress,
-      preserve= True if args['--preserve'] else False,
-    )
   else:
     print('copy from local to local is not supported, use cp command.')
     sys.exit(1)
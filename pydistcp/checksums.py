@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from threading import Lock
+import logging as lg
+import sqlite3
+import time
+
+_logger = lg.getLogger(__name__)
+
+class ChecksumCache(object):
+
+  """Persistent cache of HDFS file checksums.
+
+  :param path: Path of the SQLite database file, created if it does not exist.
+  :param max_size: Maximum number of checksums kept, the least recently used
+    ones are evicted when the cache is closed.
+  :param flush_size: Number of pending updates triggering a write to disk.
+
+  Checksums are keyed by cluster and path, and only returned while the length
+  and modification time of the file are unchanged.
+
+  """
+
+  def __init__(self, path, max_size=1000000, flush_size=1000):
+    self.path = path
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._flush_size = flush_size
+    self._lock = Lock()
+    self._stored = []
+    self._used = []
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.execute(
+      'CREATE TABLE IF NOT EXISTS checksums (cluster TEXT, path TEXT, length INTEGER, '
+      'modification_time INTEGER, algorithm TEXT, bytes TEXT, checksum_length INTEGER, '
+      'last_used REAL, PRIMARY KEY (cluster, path))'
+    )
+    self._conn.execute('CREATE INDEX IF NOT EXISTS checksums_last_used ON checksums (last_used)')
+    self._conn.commit()
+    _logger.info('Instantiated %r.', self)
+
+  def __repr__(self):
+    return '<%s(path=%r, max_size=%r)>' % (self.__class__.__name__, self.path, self.max_size)
+
+  def reopen(self):
+    """Open a new connection to the database in a forked process, connections
+    can not be shared across processes. The pending updates are left to the
+    parent process."""
+    with self._lock:
+      self.hits = 0
+      self.misses = 0
+      self._stored = []
+      self._used = []
+      self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+  def checksum(self, client, hdfs_path, length, modification_time):
+    """Checksum of a file, requested from the cluster if it is not cached.
+
+    :param client: HDFS client of the cluster hosting the file.
+    :param hdfs_path: Path of the file.
+    :param length: Current length of the file.
+    :param modification_time: Current modification time of the file.
+    """
+    cluster = _cluster_id(client)
+    with self._lock:
+      row = self._conn.execute(
+        'SELECT algorithm, bytes, checksum_length FROM checksums '
+        'WHERE cluster = ? AND path = ? AND length = ? AND modification_time = ?',
+        (cluster, hdfs_path, length, modification_time)
+      ).fetchone()
+      if row is not None:
+        self.hits += 1
+        self._used.append((time.time(), cluster, hdfs_path))
+        self._maybe_flush()
+        return {'algorithm': row[0], 'bytes': row[1], 'length': row[2]}
+      self.misses += 1
+
+    checksum = client.checksum(hdfs_path)
+    with self._lock:
+      self._stored.append((
+        cluster, hdfs_path, length, modification_time,
+        checksum['algorithm'], checksum['bytes'], checksum.get('length'), time.time()
+      ))
+      self._maybe_flush()
+    return checksum
+
+  def _maybe_flush(self):
+    if len(self._stored) + len(self._used) >= self._flush_size:
+      self._flush()
+
+  def _flush(self):
+    if self._stored:
+      self._conn.executemany(
+        'INSERT OR REPLACE INTO checksums (cluster, path, length, modification_time, algorithm, '
+        'bytes, checksum_length, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._stored
+      )
+      self._stored = []
+    if self._used:
+      self._conn.executemany('UPDATE checksums SET last_used = ? WHERE cluster = ? AND path = ?', self._used)
+      self._used = []
+    self._conn.commit()
+
+  def close(self):
+    """Write the pending updates, evict the least recently used checksums
+    above `max_size` and close the cache."""
+    with self._lock:
+      self._flush()
+      self._conn.execute(
+        'DELETE FROM checksums WHERE rowid IN '
+        '(SELECT rowid FROM checksums ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_size, )
+      )
+      self._conn.commit()
+      self._conn.close()
+
+# Helpers
+# -------
+
+def _cluster_id(client):
+  """Identifier of the cluster of a client, independent of the active
+  namenode."""
+  return ','.join(sorted(
+    url for nameservice in client.host_list.nameservices for url in nameservice['urls']
+  ))
@@ -6,14 +6,29 @@ import os
 import sys
 import glob
 import re
+import heapq
+import struct
+import itertools
+import fnmatch
+import random
 import logging as lg
+import multiprocessing
 import os.path as osp
 from pywhdfs.client import WebHDFSClient
 from pywhdfs.utils import hglob
-from pywhdfs.utils.utils import HdfsError
-from multiprocessing.pool import ThreadPool
-from threading import Lock
+from pywhdfs.utils.utils import HdfsError, HdfsTimeoutError, StandbyError, HdfsIOError, \
+  RecoveryInProgressError, AlreadyBeingCreatedError, AuthenticationError, ForbiddenRequestError
+from threading import Lock, Event, Condition, Thread, current_thread
+from array import array
 from datetime import datetime
+from collections import namedtuple, deque
+from Queue import Queue, Empty, Full
+from .journal import CopyJournal
+from .checksums import ChecksumCache
+from .metrics import JobMetrics, NULL_TIMER, count_requests, count_difference, time_requests
+from .local import LocalClient
+from .leases import LeaseClient, LeaseQueue, LeaseServer
+from .pools import SPREAD_POLICIES, configure_pools, connections_difference, connections_report
 
 _logger = lg.getLogger(__name__)
 
@@ -34,8 +49,7 @@ class WebHDFSDistClient(object):
   def __repr__(self):
     return '<%s(urls=%r),%s(urls=%r)>' % (self.src.__class__.__name__, self.src.host_list, self.dst.__class__.__name__, self.dst.host_list)
 
-  def copy(self, src_path, dst_path, overwrite=False, n_threads=1, preserve=False,
-    chunk_size=2 ** 16, buffer_size=2 ** 16, checksum=True, progress=None, **kwargs):
+  def copy(self, src_path, dst_path, **kwargs):
     """Copy a file or directory to HDFS.
 
     :param dst_path: Target HDFS path. If it already exists and is a
@@ -45,274 +59,1309 @@ class WebHDFSDistClient(object):
       of files will not be created ), when pattern is used this will act
       as a root path.
     :param overwrite: Overwrite any existing file or directory.
+    :param delete: Mirror the source, deleting the destination files and
+      directories missing from the source. Each source directory listing is
+      merged with the destination one in name order, so the memory used does
+      not grow with the size of the trees, and the deletions are run by the
+      copy threads. Requires `overwrite`.
+    :param preserve: Source attributes applied to the copied files and the
+      created directories, `True` for all of them or a string of letters as
+      Hadoop distcp `-p`: `r` replication, `b` block size, `u` user, `g` group,
+      `p` permission, `t` times. Replication, block size and permission are
+      set when the files are created, the others by a separate pool of
+      `preserve_threads` threads, skipping the user and group when they are
+      already the right ones. The attributes of the directories are applied
+      at the end of the job, deepest directories first.
+    :param preserve_threads: Number of threads applying the attributes.
+    :param umask: Octal umask of the destination cluster
+      (`fs.permissions.umask-mode`), the permission of the files it leaves
+      unchanged is not set again.
     :param n_threads: Number of threads to use for parallelization. A value of
-      `0` (or negative) uses as many threads as there are files.
+      `0` (or negative) adapts the number of threads copying at the same time
+      to the measured throughput and failures.
+    :param min_threads: Minimum number of threads of the adaptive mode, it
+      starts with this number.
+    :param max_threads: Maximum number of threads of the adaptive mode.
     :param chunk_size: Interval in bytes by which the files will be copied.
+    :param buffer_depth: Number of `buffer_size` buffers a thread reads ahead
+      of the destination write, so that the latencies of both clusters
+      overlap. Up to `buffer_depth + 2` buffers are allocated per transfer.
+      `0` streams the source directly into the write request.
+    :param split_size: Files bigger than this size (in bytes) are copied in
+      parallel as several byte range parts which are then concatenated at the
+      destination. Parts are aligned on the source block size. `0` disables
+      splitting.
+    :param schedule: Order in which the files are handed to the threads,
+      `size` copies the largest files first so that the small ones fill the
+      gaps at the end of the job, `walk` keeps the listing order.
+    :param queue_size: Maximum number of scanned files waiting for a thread,
+      the copy starts while the source is still being scanned. The `size`
+      schedule applies to the queued files.
+    :param journal: Path of a SQLite file recording the outcome of every file,
+      so that an interrupted job can be resumed.
+    :param resume: Resume the job recorded in `journal`, only the files it
+      does not record as copied or skipped are copied. If the recorded job
+      completed its scan, the source is not scanned again.
+    :param compare: How existing destination files are compared to their
+      source, files of different lengths are always copied. `checksum`
+      compares the checksums of the other ones, `tiered` skips the files with
+      the same modification time (see `preserve`) and only compares the
+      checksums of the remaining ones.
+    :param checksum_cache: Path of a SQLite file caching the checksums across
+      jobs, a checksum is requested again only when the length or the
+      modification time of the file changed.
+    :param checksum_cache_size: Maximum number of cached checksums, the least
+      recently used ones are evicted.
+    :param retries: Number of times a failed cluster operation (status,
+      listing, checksum, transfer, rename...) is retried, waiting `retry_delay`
+      seconds before the first retry and twice as long before each of the
+      next ones, with a random jitter. The files which still fail are copied
+      again at the end of the job with half of the threads.
+    :param retry_delay: Delay before the first retry, in seconds.
+    :param n_processes: Number of processes copying the files, each one with
+      `n_threads` threads (or adapting its number of threads) and its own
+      connections to the clusters. The source is scanned by the calling
+      process which hands the files to the others, so that the transfers are
+      not serialized by the interpreter lock (SSL, Kerberos). The processes
+      are forked before any thread of the job is started.
+    :param metrics: Timing of the job phases (scan, destination status,
+      checksum, mkdirs, transfer, finalize, preserve...) reported in the job
+      status along with the number of requests sent to every cluster. `basic`
+      keeps aggregated histograms, cheap enough to be always on, `detailed`
+      also reports the time spent by every file in each phase, `off` disables
+      them.
+    :param metrics_file: Path of a file the metrics are written to at the end
+      of the job, in the Prometheus text format.
     :param progress: Callback function to track progress, called every
       `chunk_size` bytes. It will be passed two arguments, the path to the
       file being copied and the number of bytes transferred so far. On
       completion, it will be called once with `-1` as second argument.
+    :param include_pattern: Only copy the files whose name matches this
+      pattern when walking the source directories.
+    :param min_size: Only copy the files of at least this number of bytes
+      when walking the source directories.
+    :param files_only: Copy the files of the source directories directly
+      under the destination directory, without their directory structure.
+    :param scan_progress: Callback called with the length of every file to
+      copy and `1` as the scan finds it, so that a progress total can grow
+      while the source is scanned rather than walking it beforehand.
+    :param budget: Copy slots shared with the other jobs of a batch, see
+      :meth:`copy_batch`. The threads of the job only copy a file or part
+      when granted one of them.
+    :param coordinator: `(host, port)` address the files are served on to
+      workers, which copy them rather than this process, see :meth:`work`.
+      The coordinator scans the source, creates the directories, deletes the
+      extraneous files and accounts the results of the workers, keeping up to
+      `n_threads` files (or `max_threads` if adaptive) ready for them.
+    :param authkey: Secret shared by the coordinator and its workers.
+    :param lease_timeout: Number of seconds without news from a worker after
+      which the files it copies are handed to another worker, which first
+      deletes the partial files left at their destination.
+    :param pool_size: Number of connections kept alive to every host of the
+      clusters, `0` sizes the pools to the threads of the job. The pools of
+      clients shared by several jobs only grow.
+    :param host_spread: How the requests are spread across the hosts of a
+      nameservice, `first`, `round-robin` or `least-outstanding`, see
+      :class:`~pydistcp.pools.HostSpreader`. Only meant for nameservices
+      whose hosts all serve requests, like several HttpFS gateways.
+    :param warm_up: Open the connections of the first threads to every host
+      before the copy starts.
     :param \*\*kwargs: Keyword arguments forwarded to :meth:`write`.
 
     On success, this method returns the remote copyed path.
 
+    """
+    return self._copy_job(None, src_path, dst_path, **kwargs)
+
+  def _copy_job(self, worker_link, src_path, dst_path, overwrite=False, n_threads=1, min_threads=1, max_threads=32, preserve=False,
+    chunk_size=2 ** 16, buffer_size=2 ** 16, buffer_depth=4, checksum=True, progress=None, split_size=0,
+    schedule='size', queue_size=10000, journal=None, resume=False, compare='checksum',
+    checksum_cache=None, checksum_cache_size=1000000, retries=3, retry_delay=1.0, n_processes=1,
+    metrics='basic', metrics_file=None, preserve_threads=4, delete=False, scan_progress=None,
+    include_pattern=None, min_size=0, files_only=False, budget=None, coordinator=None, authkey=None,
+    lease_timeout=60.0, pool_size=0, host_spread='first', warm_up=True, umask='022', **kwargs):
+    """Run a copy job, see :meth:`copy` for its options.
+
+    :param worker_link: :class:`~pydistcp.leases.LeaseClient` of a worker,
+      which only copies the files leased from its coordinator, `None` to copy
+      the whole job.
+
+    Returns the job status, or the summary of the worker.
     """
     start_time = time.time()
     if not chunk_size:
       raise ValueError('Copy chunk size must be positive.')
+    if schedule not in ('size', 'walk'):
+      raise ValueError('Unknown schedule %r.' % (schedule, ))
+    if compare not in ('checksum', 'tiered'):
+      raise ValueError('Unknown comparison %r.' % (compare, ))
+    if metrics not in ('off', 'basic', 'detailed'):
+      raise ValueError('Unknown metrics mode %r.' % (metrics, ))
+    if metrics == 'off' and metrics_file:
+      raise ValueError('Exporting metrics requires them to be enabled.')
+    if host_spread not in SPREAD_POLICIES:
+      raise ValueError('Unknown host spread policy %r.' % (host_spread, ))
+    if delete and not overwrite:
+      raise ValueError('Deleting extraneous destination files requires overwrite.')
+    if delete and files_only:
+      raise ValueError('Deleting extraneous destination files requires the directory structure.')
+    if budget is not None and n_processes > 1:
+      raise ValueError('Sharing a copy budget requires a single process.')
+    if (coordinator is not None or worker_link is not None) and (n_processes > 1 or budget is not None):
+      raise ValueError('Workers and their coordinator copy in a single process, with their own threads.')
+    if coordinator is not None and not authkey:
+      raise ValueError('Serving files to workers requires an authentication key.')
+    if preserve is True:
+      preserve = 'rbugpt'
+    preserve = preserve or ''
+    if set(preserve) - set('rbugpt'):
+      raise ValueError('Unknown attributes to preserve %r.' % (preserve, ))
+    try:
+      int(umask, 8)
+    except ValueError:
+      raise ValueError('Invalid umask %r.' % (umask, ))
+
+    # Copy processes state, the progress of their files is sent to the parent
+    # process which calls the actual callback.
+    worker = {'results': None}
+    relay = None
+    job_progress = progress
+    if n_processes > 1 and progress or worker_link is not None:
+      # the coordinator of a worker may have a progress callback
+      relay = _ProgressRelay()
+      progress = relay
 
-    lock = Lock()
     stat_lock = Lock()
+    retry = _Retry(retries, retry_delay)
+    # the slots of the budget are granted to the jobs in turn
+    budget_job = object()
+    # local files written in place by the parts of the split files
+    local_dst = isinstance(self.dst, LocalClient)
+    pipe_memory = _Gauge()
+    job_metrics = None
+    request_counters = {}
+    if metrics != 'off':
+      job_metrics = JobMetrics(detailed=metrics == 'detailed')
+      if self.src is self.dst:
+        request_counters = {'Cluster': count_requests(self.src)}
+      elif isinstance(self.src, LocalClient):
+        request_counters = {'Destination': count_requests(self.dst)}
+      elif isinstance(self.dst, LocalClient):
+        request_counters = {'Source': count_requests(self.src)}
+      else:
+        request_counters = {'Source': count_requests(self.src), 'Destination': count_requests(self.dst)}
+    # requests sent by the clients during the job
+    requests = {}
+    requests_start = dict((cluster, counter.snapshot()) for cluster, counter in request_counters.items())
 
     _logger.info('Copying %r to %r.', src_path, dst_path)
 
-    def _preserve(_src_path, _dst_path):
-      # set the base path attributes
+    # Status of the source directories, used to preserve the attributes of the
+    # created destination directories.
+    src_dirs = {}
+    # Existing destination directories and the source directories of the ones
+    # that need to be created.
+    dst_dirs = _DirCache(self.dst)
+    new_dirs = {}
+    # Without the directory structure, the source directory of every file name
+    # and the listing of the destination directories receiving them.
+    flat_sources = {}
+    flat_listings = {}
+    # Group of the destination directories, inherited by the files and
+    # directories created inside, and the created directories whose
+    # attributes are preserved at the end of the job.
+    dir_groups = {}
+    created_dirs = set()
+    # Attributes requests sent and skipped
+    preserved = {
+      'Requests' : {'Owner': 0, 'Permission': 0, 'Times': 0, 'Replication': 0},
+      'Skipped'  : {'Owner': 0, 'Permission': 0, 'Times': 0, 'Replication': 0},
+      'Failures' : 0,
+    }
+
+    def _timed(_phase, _path=None):
+      if job_metrics is None:
+        return NULL_TIMER
+      return job_metrics.timed(_phase, _path)
+
+    def _preserved(_attribute, _sent):
+      with stat_lock:
+        preserved['Requests' if _sent else 'Skipped'][_attribute] += 1
+
+    def _preserve(_src_path, _src_st, _dst_path):
+      """Apply the selected source attributes to a file or directory created
+      by the job, skipping the ones it already has: its owner is the writing
+      user, its group the one of the directory it was created in, and files
+      were created with the source permission and replication."""
+
+      with _timed('Preserve', _src_path):
+        if _src_st is None:
+          _src_st = _file_status(retry('Status', self.src.status, _src_path))
+        _logger.debug("Preserving %r source attributes on %r" % (_src_path,_dst_path))
+        is_file = _src_st.type == 'FILE'
+
+        if 'u' in preserve or 'g' in preserve:
+          # local files get the group of the writing process instead
+          _group = None if local_dst else dir_groups.get(osp.dirname(_dst_path) if is_file else _dst_path)
+          _owner = _src_st.owner if 'u' in preserve and _src_st.owner != writer else None
+          _group = _src_st.group if 'g' in preserve and _src_st.group != _group else None
+          if _owner or _group:
+            retry('Preserve', self.dst.set_owner, _dst_path, owner=_owner, group=_group)
+          _preserved('Owner', _owner or _group)
+        if 'p' in preserve:
+          # local files are created with their exact permission
+          _set = not (is_file and _unmasked(_src_st.permission, '000' if local_dst else umask))
+          if _set:
+            retry('Preserve', self.dst.set_permission, _dst_path, permission=_src_st.permission)
+          _preserved('Permission', _set)
+        if 't' in preserve:
+          retry('Preserve', self.dst.set_times, _dst_path, access_time=_src_st.access_time, modification_time=_src_st.modification_time)
+          _preserved('Times', True)
+        if 'r' in preserve and is_file:
+          _preserved('Replication', False)
 
-      srcstats = self.src.status(_src_path)
-      _logger.debug("Preserving %r source attributes on %r" % (_src_path,_dst_path))
-      self.dst.set_owner(_dst_path, owner=srcstats['owner'], group=srcstats['group'])
-      self.dst.set_permission(_dst_path, permission=srcstats['permission'])
-      self.dst.set_times(_dst_path, access_time=srcstats['accessTime'], modification_time=srcstats['modificationTime'])
-      if srcstats['type'] == 'FILE':
-        self.dst.set_replication(_dst_path, replication=int(srcstats['replication']))
+    def _run(_work):
+      _start = time.time()
+      result = _copy_wrap(_work)
+      _end = time.time()
+      schedule_stats.record(_work_length(_work), _start, _end)
+      if job_metrics is not None:
+        job_metrics.observe('Copy', _end - _start, result['src_path'])
+      return result
 
-    def _copy_wrap(_path_tuple):
-      _src_path, _dst_path = _path_tuple
+    def _copy_wrap(_work):
+      if not isinstance(_work, _FileCopy):
+        return _copy_part(*_work)
       try:
-        status = _copy(_path_tuple)
+        status = _copy(_work)
         return status
       except Exception as exp:
-        _logger.exception('Error while copying %r to %r. %s' % (_src_path,_dst_path,exp))
-        return { 'status': 'failed', 'src_path': _src_path, 'dest_path' : _dst_path }
+        _logger.exception('Error while copying %r to %r. %s' % (_work.src_path,_work.dst_path,exp))
+        return { 'status': 'failed', 'src_path': _work.src_path, 'dest_path' : _work.dst_path, 'length': _work.status.length }
 
-    def _copy(_path_tuple):
-      """Copy a single file."""
-
-      _src_path, _dst_path = _path_tuple
-      _tmp_path = ""
+    def _compared(_tier):
+      with stat_lock:
+        compared[_tier] += 1
 
-      skip=False
+    def _checksum(_client, _path, _st):
+      if checksums is None:
+        return _client.checksum(_path)
+      return checksums.checksum(_client, _path, _st.length, _st.modification_time)
 
-      dst_st=self.dst.status(_dst_path,strict=False)
+    def _prepare(_src_path, _src_st, _dst_path, _dst_st):
+      """Check the destination of a file, returns the path the data should be
+      written to or `None` if the file can be skipped."""
 
-      if dst_st == None:
+      if _dst_st is None:
         # destination does not exist
-        _tmp_path=_dst_path
-      else:
-        # destination exist
-        if not overwrite:
-          raise HdfsError('Destination file exist and Missing overwrite parameter.')
-        _tmp_path = '%s.temp-%s' % (_dst_path, int(time.time()))
-
-        if checksum == True:
-          _src_path_checksum = self.src.checksum(_src_path)
-          _dst_path_checksum = self.dst.checksum(_dst_path)
-          if _src_path_checksum['algorithm'] != _dst_path_checksum['algorithm']:
-            _logger.info('source and destination files does not seems to have the same block size or crc chunk size.')
-          elif _src_path_checksum['bytes'] != _dst_path_checksum['bytes']:
-            _logger.info('source destination files does not seems to have the same checksum value.')
+        return _dst_path
+
+      # destination exist
+      if not overwrite:
+        raise HdfsError('Destination file exist and Missing overwrite parameter.')
+
+      # cheapest comparisons first, checksums are computed by the datanodes
+      if _src_st.length != _dst_st.length:
+        _compared('Length')
+        _logger.info('source %r and destination %r have different lengths.', _src_path, _dst_path)
+      elif compare == 'tiered' and _src_st.modification_time == _dst_st.modification_time:
+        _compared('Modification Time')
+        _logger.info('source %r and destination %r have the same length and modification time, skipping.', _src_path, _dst_path)
+        return None
+      elif checksum == True:
+        _compared('Checksum')
+        with _timed('Checksum', _src_path):
+          if isinstance(self.src, LocalClient):
+            # computed like the destination one
+            _dst_path_checksum = retry('Checksum', _checksum, self.dst, _dst_path, _dst_st)
+            _src_path_checksum = self.src.checksum(_src_path, _dst_path_checksum['algorithm'], _dst_st.block_size)
+          elif local_dst:
+            _src_path_checksum = retry('Checksum', _checksum, self.src, _src_path, _src_st)
+            _dst_path_checksum = self.dst.checksum(_dst_path, _src_path_checksum['algorithm'], _src_st.block_size)
           else:
-            _logger.info('source %r and destination %r seems to be identical, skipping.', _src_path, _dst_path)
-            skip=True
+            _src_path_checksum = retry('Checksum', _checksum, self.src, _src_path, _src_st)
+            _dst_path_checksum = retry('Checksum', _checksum, self.dst, _dst_path, _dst_st)
+        if _src_path_checksum is None or _dst_path_checksum is None:
+          _logger.info('source %r checksum can not be compared to the destination one.', _src_path)
+        elif _src_path_checksum['algorithm'] != _dst_path_checksum['algorithm']:
+          _logger.info('source and destination files does not seems to have the same block size or crc chunk size.')
+        elif _src_path_checksum['bytes'] != _dst_path_checksum['bytes']:
+          _logger.info('source destination files does not seems to have the same checksum value.')
         else:
-          _logger.info('no checksum check will be performed, forcing file copy source %r to destination %r.', _src_path, _dst_path)
-          #skip=True
-
-      if not skip:
-        # Prevent race condition when creating directories
-        with lock:
-          if self.dst.status(osp.dirname(_tmp_path), strict=False) is None:
-            _logger.debug('Parent directory %r does not exist, creating recursively.', osp.dirname(_tmp_path))
-            curpath = ''
-            root_dir = None
-            for dirname in osp.dirname(_tmp_path).strip('/').split('/'):
-              curpath = '/'.join([curpath, dirname])
-              if self.dst.status(curpath, strict=False) is None:
-                if root_dir is not None:
-                  root_dir = curpath
-                self.dst.makedirs(curpath)
-                if preserve:
-                  curr_src_path=osp.realpath( osp.join( _src_path,osp.relpath(curpath,_tmp_path)) )
-                  _preserve(curr_src_path,curpath)
-      
-        _logger.info('Copying %r to %r.', _src_path, _tmp_path)
+          _logger.info('source %r and destination %r seems to be identical, skipping.', _src_path, _dst_path)
+          return None
+      else:
+        _logger.info('no checksum check will be performed, forcing file copy source %r to destination %r.', _src_path, _dst_path)
+
+      return '%s.temp-%s' % (_dst_path, int(time.time()))
+
+    def _created_dir(_dir_path):
+      _logger.debug('Created destination directory %r.', _dir_path)
+      dir_groups[_dir_path] = dir_groups.get(osp.dirname(_dir_path))
+      if preserve and worker['results'] is not None:
+        # the source directories are only known to the parent process
+        worker['results'].put(('created', _dir_path))
+      elif preserve and _dir_path in new_dirs:
+        with stat_lock:
+          created_dirs.add(_dir_path)
+        if job_journal is not None:
+          job_journal.add_dir(new_dirs[_dir_path], _dir_path)
+
+    def _makedirs_wrap(_dir_path):
+      try:
+        if _dir_path not in dst_dirs:
+          with _timed('Mkdirs'):
+            retry('Mkdirs', dst_dirs.makedirs, _dir_path, _created_dir)
+      except Exception as exp:
+        _logger.exception('Error while creating directory %r. %s' % (_dir_path,exp))
 
-        if preserve:
-          srcstats = self.src.status(_src_path)
-          kwargs['replication'] = int(srcstats['replication'])
-          kwargs['blocksize'] = int(srcstats['blockSize'])
+    def _makedirs(_src_path, _tmp_path):
+      """Create the missing parent directories of a destination file."""
+      _dir_path = osp.dirname(_tmp_path)
+      if _dir_path not in dst_dirs:
+        with _timed('Mkdirs', _src_path):
+          retry('Mkdirs', dst_dirs.makedirs, _dir_path, _created_dir)
 
-        with self.src.read(_src_path, chunk_size=chunk_size, progress=progress, buffer_size=buffer_size) as _reader:
-          self.dst.write(_tmp_path, _reader, buffersize=buffer_size, **kwargs)
+    def _finalize(_src_path, _tmp_path, _dst_path):
+      """Move a completely written file in place."""
+      if _tmp_path != _dst_path:
+        _logger.info( 'Copy of %r complete. Moving from %r to %r.', _src_path, _tmp_path, _dst_path )
+        with _timed('Finalize', _src_path):
+          retry('Delete', self.dst.delete, _dst_path)
+          retry('Rename', self.dst.rename, _tmp_path, _dst_path)
+      else:
+        _logger.info(
+          'Copy of %r to %r complete.', _src_path, _dst_path
+        )
+
+    def _transfer(_src_path, _tmp_path, _write_kwargs, _progress, _offset=0, _length=None, _size=None):
+      """Stream a file or one of its byte ranges to the destination, a failed
+      transfer is retried from the start. Files of `_size` bytes fitting in a
+      single buffer are read at once and written from memory."""
+      attempts = [0]
 
-        if _tmp_path != _dst_path:
-          _logger.info( 'Copy of %r complete. Moving from %r to %r.', _src_path, _tmp_path, _dst_path )
-          self.dst.delete(_dst_path)
-          self.dst.rename(_tmp_path, _dst_path)
+      def _attempt():
+        attempts[0] += 1
+        _kwargs = dict(_write_kwargs)
+        if attempts[0] > 1:
+          # replace the data written by the failed attempt
+          _kwargs['overwrite'] = True
+        if _size is not None and _size <= buffer_size:
+          # no reading thread nor buffer ring for the small files, and a
+          # single request body rather than a chunked one
+          with self.src.read(_src_path, offset=_offset, length=_length, buffer_size=buffer_size) as _stream:
+            _data = _stream.read()
+          self.dst.write(_tmp_path, _data, buffersize=buffer_size, **_kwargs)
+          if _progress:
+            _progress(_src_path, len(_data))
+            _progress(_src_path, -1)
+        elif isinstance(self.src, LocalClient):
+          # the chunks are views of the mapped file, no read ahead is needed
+          with self.src.read(_src_path, offset=_offset, length=_length, chunk_size=buffer_size,
+                             progress=_progress) as _chunks:
+            self.dst.write(_tmp_path, _chunks, buffersize=buffer_size, **_kwargs)
+        elif buffer_depth > 0:
+          with self.src.read(_src_path, offset=_offset, length=_length, buffer_size=buffer_size) as _stream:
+            _data = _pipe(_stream, buffer_depth, buffer_size, _src_path, _progress, pipe_memory)
+            try:
+              self.dst.write(_tmp_path, _data, buffersize=buffer_size, **_kwargs)
+            finally:
+              _data.close()
         else:
-          _logger.info(
-            'Copy of %r to %r complete.', _src_path, _dst_path
-          )
-      
-        if preserve:
-          _preserve(_src_path,_dst_path)
+          with self.src.read(_src_path, offset=_offset, length=_length, chunk_size=chunk_size,
+                             progress=_progress, buffer_size=buffer_size) as _reader:
+            self.dst.write(_tmp_path, _reader, buffersize=buffer_size, **_kwargs)
+
+      with _timed('Transfer', _src_path):
+        retry('Transfer', _attempt)
+
+    def _reset_partial(_dst_path, _dst_existed):
+      """Current status of a destination file, deleting the partial file
+      written by a failed copy if it did not exist before."""
+      with _timed('Destination Status', _dst_path):
+        _dst_st = retry('Status', self.dst.status, _dst_path, strict=False)
+      if _dst_st is not None and not _dst_existed:
+        retry('Delete', self.dst.delete, _dst_path)
+        _dst_st = None
+      return _file_status(_dst_st) if _dst_st else None
+
+    def _delete(_work):
+      """Delete a destination file or directory missing from the source."""
+      _files, _length = 1, _work.status.length
+      try:
+        with _timed('Delete', _work.dst_path):
+          if _work.status.type == 'DIRECTORY':
+            summary = retry('Status', self.dst.content, _work.dst_path)
+            _files, _length = summary['fileCount'], summary['length']
+          retry('Delete', self.dst.delete, _work.dst_path, recursive=True)
+        _logger.info('Deleted %r.', _work.dst_path)
+        _status = 'deleted'
+      except Exception as err: # pylint: disable=broad-except
+        _logger.error('Failed to delete %r: %s', _work.dst_path, err)
+        _status = 'failed'
+      return { 'status': _status, 'deleted': True, 'dest_path': _work.dst_path, 'files': _files, 'length': _length }
+
+    def _copied(_src_path, _src_st, _dst_path):
+      result = { 'status': 'copied', 'src_path': _src_path, 'dest_path' : _dst_path, 'length': _src_st.length }
+      if preserve:
+        # applied by the preserve threads
+        result['preserve'] = (_src_path, _src_st, _dst_path)
+      return result
+
+    def _skipped(_src_path, _dst_path, _length):
+      if progress:
+        progress(_src_path, _length)
+        progress(_src_path, -1)
+      return { 'status': 'skipped', 'src_path': _src_path, 'dest_path' : _dst_path, 'length': _length }
+
+    def _copy(_work):
+      """Copy a single file."""
+
+      _src_path, _dst_path, _src_st, _dst_st = _work.src_path, _work.dst_path, _work.status, _work.dst_status
+
+      _tmp_path = _prepare(_src_path, _src_st, _dst_path, _dst_st)
 
-        return { 'status': 'copied', 'src_path': _src_path, 'dest_path' : _dst_path }
+      if _tmp_path is not None:
+        _makedirs(_src_path, _tmp_path)
+
+        _logger.info('Copying %r to %r.', _src_path, _tmp_path)
+
+        write_kwargs = dict(kwargs)
+        if 'r' in preserve and _src_st.replication:
+          write_kwargs['replication'] = _src_st.replication
+        if 'b' in preserve:
+          write_kwargs['blocksize'] = _src_st.block_size
+        if 'p' in preserve:
+          write_kwargs['permission'] = _src_st.permission
+
+        _transfer(_src_path, _tmp_path, write_kwargs, progress, _size=_src_st.length)
+
+        _finalize(_src_path, _tmp_path, _dst_path)
+
+        return _copied(_src_path, _src_st, _dst_path)
       else:
         # file was skipped
-        if progress:
-          src_st=self.src.status(_src_path,strict=False)
-          progress(_src_path, int(src_st['length']))
-          progress(_src_path, -1)
-        return { 'status': 'skipped', 'src_path': _src_path, 'dest_path' : _dst_path }
+        return _skipped(_src_path, _dst_path, _src_st.length)
+
+    def _copy_part(_split, _index):
+      """Copy a single byte range of a split file, the last part to complete
+      assembles the destination file."""
+
+      with _split.lock:
+        if not _split.prepared:
+          _split.prepared = True
+          try:
+            _split.tmp_path = _prepare(_split.src_path, _split.status, _split.dst_path, _split.dst_status)
+            if _split.tmp_path is not None:
+              _makedirs(_split.src_path, _split.tmp_path)
+              if local_dst:
+                # the parts are written in place rather than concatenated
+                _split.in_place = True
+                permission = _split.status.permission if 'p' in preserve else None
+                retry('Transfer', self.dst.allocate, _split.tmp_path, _split.length, overwrite=True, permission=permission)
+          except Exception as exp:
+            _logger.exception('Error while preparing copy of %r to %r. %s' % (_split.src_path,_split.dst_path,exp))
+            _split.failed = True
+
+      success = True
+      if _split.tmp_path is not None and not _split.failed:
+        offset, length = _split.parts[_index]
+        part_path = _split.part_path(_index)
+        _logger.debug('Copying range [%s, %s) of %r to %r.', offset, offset + length, _split.src_path, part_path)
+
+        write_kwargs = dict(kwargs)
+        write_kwargs['blocksize'] = _split.block_size
+        # replace the leftover part of an interrupted job
+        write_kwargs['overwrite'] = True
+        if 'r' in preserve and _split.status.replication:
+          write_kwargs['replication'] = _split.status.replication
+        if 'p' in preserve:
+          write_kwargs['permission'] = _split.status.permission
+        if local_dst:
+          write_kwargs['offset'] = offset
+
+        try:
+          _transfer(_split.src_path, part_path, write_kwargs, _split.progress(_index, progress), offset, length)
+        except Exception as exp:
+          _logger.exception('Error while copying part %s of %r to %r. %s' % (_index,_split.src_path,part_path,exp))
+          success = False
+
+      if not _split.part_done(success):
+        return { 'status': 'part', 'src_path': _split.src_path, 'dest_path' : _split.dst_path, 'length': 0 }
+
+      # This is the last part of the file
+      if _split.tmp_path is None:
+        if _split.failed:
+          return { 'status': 'failed', 'src_path': _split.src_path, 'dest_path' : _split.dst_path, 'length': _split.length }
+        return _skipped(_split.src_path, _split.dst_path, _split.length)
+
+      part_paths = [ _split.part_path(index) for index in range(len(_split.parts)) ]
+      if _split.in_place:
+        part_paths = part_paths[:1]
+      try:
+        if _split.failed:
+          raise HdfsError('Failed to copy one or more parts of %r.', _split.src_path)
+        if _split.in_place:
+          _logger.info('All %s parts of %r written to %r.', len(_split.parts), _split.src_path, part_paths[0])
+        else:
+          _logger.info('All %s parts of %r copied, concatenating into %r.', len(part_paths), _split.src_path, part_paths[0])
+          with _timed('Concat', _split.src_path):
+            _concat(self.dst, part_paths[0], part_paths[1:], chunk_size=chunk_size, buffer_size=buffer_size)
+        _finalize(_split.src_path, part_paths[0], _split.dst_path)
+      except Exception as exp:
+        _logger.exception('Error while copying %r to %r. %s' % (_split.src_path,_split.dst_path,exp))
+        for part_path in part_paths:
+          try:
+            self.dst.delete(part_path)
+          except HdfsError:
+            pass
+        return { 'status': 'failed', 'src_path': _split.src_path, 'dest_path' : _split.dst_path, 'length': _split.length }
+
+      if progress:
+        progress(_split.src_path, -1)
+      return _copied(_split.src_path, _split.status, _split.dst_path)
 
     # Normalise src and dst paths
     src_path = self.src.resolvepath(src_path)
     dst_path = self.dst.resolvepath(dst_path)
 
-    # First, resolve the list of src files/directories to be copied
-    copies = [ copy_file for copy_file in hglob.glob(self.src, src_path) ]
- 
-    # need to develop a propper pattern based access function
-    if len(copies) == 0:
-      raise HdfsError('Cloud not resolve source path %s, either it does not exist or can not access it.', src_path)
+    job_journal = None
+    if journal:
+      job_journal = CopyJournal(journal)
+      resume = job_journal.open(src_path, dst_path, resume)
+    elif resume:
+      raise ValueError('Resuming a copy requires a journal.')
+
+    checksums = None
+    if checksum_cache:
+      checksums = ChecksumCache(checksum_cache, max_size=checksum_cache_size)
+
+    # The user writing the destination files owns them once created
+    writer = _writing_user(self.dst) if 'u' in preserve else None
 
     tuples = []
-    for copy in copies:
-      copy_tuple = dict()
-      try:
-        #filename = osp.basename(copy)
-        #dst_base_path =  osp.join( dst_path, filename )
-        status = self.dst.status(dst_path,strict=True)
-        #statuses = [status for _, status in self.dst.list(dst_base_path)]
-      except HdfsError as err:
-        if 'File does not exist' in str(err):
-          # Remote path doesn't exist.
-          # check if parent exist
-          try:
-            pstatus = self.dst.status(osp.dirname(dst_path),strict=True)
-          except HdfsError, err:
-            raise HdfsError('Parent directory of %r does not exist.', dst_path)
-          else:
-            # Remote path does not exist, and parent exist
-            # so we want the source to be renamed as destination
-            # so do not add the basename
-            dst_base_path =  dst_path
-            copy_tuple = dict({ 'src_path' : copy, 'dst_path' : dst_base_path})
+    if worker_link is not None:
+      # the coordinator resolves and scans the source paths
+      pass
+    elif resume:
+      # The paths resolved by the interrupted job, its destination now exists.
+      for copy, dst_base_path in job_journal.roots():
+        dst_dirs.add(osp.dirname(dst_base_path))
+        dst_base_st = self.dst.status(dst_base_path, strict=False)
+        tuples.append(_CopyRoot(copy, dst_base_path, _file_status(dst_base_st) if dst_base_st else None))
+      if preserve:
+        # created by the interrupted job, whose files may not all be copied
+        for src_dir, dst_dir in job_journal.dirs():
+          new_dirs[dst_dir] = src_dir
+          created_dirs.add(dst_dir)
+    else:
+      # First, resolve the list of src files/directories to be copied
+      copies = [ copy_file for copy_file in hglob.glob(self.src, src_path) ]
+
+      # need to develop a propper pattern based access function
+      if len(copies) == 0:
+        raise HdfsError('Cloud not resolve source path %s, either it does not exist or can not access it.', src_path)
+
+      # The destination path status is the same for all the source matches
+      dst_st = self.dst.status(dst_path, strict=False)
+      if dst_st is None:
+        # Remote path doesn't exist.
+        # check if parent exist
+        dst_parent_st = self.dst.status(osp.dirname(dst_path), strict=False)
+        if dst_parent_st is None:
+          raise HdfsError('Parent directory of %r does not exist.', dst_path)
+        dst_dirs.add(osp.dirname(dst_path))
+        dir_groups[osp.dirname(dst_path)] = dst_parent_st['group']
+      elif dst_st['type'] == 'DIRECTORY':
+        dst_dirs.add(dst_path)
+        dir_groups[dst_path] = dst_st['group']
       else:
-        # Remote path exists.
-        if status['type'] == 'FILE':
+        dst_dirs.add(osp.dirname(dst_path))
+
+      # This is a workaround for a Bug when copying files using a pattern
+      # it may happen that files can have the same name:
+      # ex : /home/user/test/*/*.py may result in duplicate files
+      # The source of every destination path is indexed to find them.
+      dst_sources = {}
+      for copy in copies:
+        if dst_st is None:
+          # Remote path does not exist, and parent exist
+          # so we want the source to be renamed as destination
+          # so do not add the basename
+          dst_base_path = dst_path
+          dst_base_st = None
+        elif dst_st['type'] == 'FILE':
           # Remote path exists and is a normal file.
           if not overwrite:
             raise HdfsError('Destination path %r already exists.', dst_path)
           # the file is going to be deleted and the destination is going to be created with the same name
           dst_base_path = dst_path
+          dst_base_st = dst_st
+        elif files_only:
+          # Remote path exists and is a directory receiving the files themselves,
+          # their names are checked for conflicts when scanned.
+          tuples.append(_CopyRoot(copy, dst_path, _file_status(dst_st)))
+          continue
         else:
           # Remote path exists and is a directory.
-          try:
-            status = self.dst.status(osp.join( dst_path, osp.basename(copy) ),strict=True)
-          except HdfsError as err:
-            if 'File does not exist' in str(err):
-              # destination does not exist, great !
-              dst_base_path =  osp.join( dst_path, osp.basename(copy) )
-              pass
-          else:
-            # destination exists
-            dst_base_path = osp.join( dst_path, osp.basename(copy))
-            if not overwrite:
+          dst_base_path = osp.join( dst_path, osp.basename(copy) )
+          if dst_base_path not in dst_sources:
+            dst_base_st = self.dst.status(dst_base_path, strict=False)
+            if dst_base_st is not None and not overwrite:
               raise HdfsError('Destination path %r already exists.', dst_base_path)
 
-        copy_tuple = dict({ 'src_path' : copy, 'dst_path' : dst_base_path})
-      finally:
-        tuples.append(copy_tuple)
-
-    # This is a workaround for a Bug when copying files using a pattern
-    # it may happen that files can have the same name:
-    # ex : /home/user/test/*/*.py may result in duplicate files
-    for i in range(0, len(tuples)):
-        for x in range(i + 1, len(tuples)):
-          if tuples[i]['dst_path'] == tuples[x]['dst_path']:
-            raise HdfsError('Conflicting files %r and %r : can\'t copy both files to %r'
-                            % (tuples[i]['src_path'], tuples[x]['src_path'], tuples[i]['dst_path']) )
+        if dst_base_path in dst_sources:
+          raise HdfsError('Conflicting files %r and %r : can\'t copy both files to %r'
+                          % (dst_sources[dst_base_path], copy, dst_base_path) )
+        dst_sources[dst_base_path] = copy
+
+        tuples.append(_CopyRoot(copy, dst_base_path, _file_status(dst_base_st) if dst_base_st else None))
+      dst_sources = None
+
+      if job_journal is not None:
+        job_journal.set_roots([ (copy_tuple.src_path, copy_tuple.dst_path) for copy_tuple in tuples ])
 
-    fpath_tuples = []
-    for copy_tuple in tuples:
-      # Then we figure out which files we need to copy, and where.
-      src_paths = list(self.src.walk(copy_tuple['src_path']))
-      if not src_paths:
+    def _scan_files(_copy_tuple):
+      """Walk a source path along with its destination, listing each directory
+      once and keeping only the statuses of the directory being listed."""
+
+      _src_base, _dst_base, _dst_base_st = _copy_tuple
+
+      with _timed('Scan', _src_base):
+        src_st = retry('Status', self.src.status, _src_base)
+      if src_st['type'] != 'DIRECTORY':
         # This is a single file.
-        src_fpaths = [copy_tuple['src_path']]
-      else:
-        src_fpaths = [
-          osp.join(dpath, fname)
-          for dpath, _, fnames in src_paths
-          for fname in fnames
-        ]
+        if files_only and _dst_base_st is not None and _dst_base_st.type == 'DIRECTORY':
+          for fpath_tuple in _scan_flat(osp.dirname(_src_base), _dst_base, True, [(osp.basename(_src_base), src_st)]):
+            yield fpath_tuple
+          return
+        yield _file_copy(_src_base, _dst_base, _file_status(src_st), _dst_base_st)
+        return
 
-      offset = len(copy_tuple['src_path'].rstrip(os.sep)) + len(os.sep)
+      src_dirs[_src_base] = _file_status(src_st)
+      dst_exists = _dst_base_st is not None and _dst_base_st.type == 'DIRECTORY'
+      if dst_exists:
+        dir_groups[_dst_base] = _dst_base_st.group
+      if files_only:
+        for fpath_tuple in _scan_flat(_src_base, _dst_base, dst_exists):
+          yield fpath_tuple
+        return
+      pending_dirs = [(_src_base, _dst_base, dst_exists)]
+      while pending_dirs:
+        src_dir, dst_dir, dst_dir_exists = pending_dirs.pop()
 
-      fpath_tuples.extend([
-          (
-            fpath,
-            osp.join(copy_tuple['dst_path'], fpath[offset:].replace(os.sep, '/')).rstrip(os.sep)
+        # Existing destination files, listed at once rather than checked one by one
+        dst_fstatuses = []
+        if dst_dir_exists:
+          dst_dirs.add(dst_dir)
+          with _timed('Destination Status', dst_dir):
+            dst_fstatuses = retry('List', self.dst.list, dst_dir, status=True)
+        else:
+          # Missing destination directory, mapped to its source directory
+          new_dirs[dst_dir] = src_dir
+
+        fpaths = []
+        has_sub_dirs = False
+        # shared by the files of the directory rather than stored in their paths
+        dirs = _CopyDirs(src_dir, dst_dir)
+        with _timed('Scan', src_dir):
+          src_fstatuses = retry('List', self.src.list, src_dir, status=True)
+        for name, fstatus, dst_fstatus in _merge_listings(src_fstatuses, dst_fstatuses):
+          if fstatus is None:
+            if delete:
+              fpaths.append(_Delete(osp.join(dst_dir, name), _file_status(dst_fstatus)))
+            continue
+          if fstatus['type'] != 'DIRECTORY' and not _selected(name, fstatus):
+            # left out of the copy, and of the deletions
+            continue
+          if delete and dst_fstatus is not None and dst_fstatus['type'] != fstatus['type']:
+            # replaced by the source entry, deleted before it is copied
+            _account(_delete(_Delete(osp.join(dst_dir, name), _file_status(dst_fstatus))))
+            dst_fstatus = None
+          if fstatus['type'] == 'DIRECTORY':
+            has_sub_dirs = True
+            src_dirs[osp.join(src_dir, name)] = _file_status(fstatus)
+            if dst_fstatus is not None and dst_fstatus['type'] == 'DIRECTORY':
+              dir_groups[osp.join(dst_dir, name)] = dst_fstatus['group']
+            pending_dirs.append((
+              osp.join(src_dir, name),
+              osp.join(dst_dir, name),
+              dst_fstatus is not None and dst_fstatus['type'] == 'DIRECTORY',
+            ))
+          else:
+            fpaths.append(_FileCopy(
+              dirs,
+              name,
+              _file_status(fstatus),
+              _file_status(dst_fstatus) if dst_fstatus else None,
+            ))
+
+        if fpaths and not dst_dir_exists and not has_sub_dirs:
+          # Create the deepest missing directories ahead of their files,
+          # which also creates their parents.
+          yield _MakeDirs(dst_dir)
+        for fpath_tuple in fpaths:
+          yield fpath_tuple
+
+    def _selected(_name, _fstatus):
+      """Whether a file found in a source directory is copied."""
+      if include_pattern and not fnmatch.fnmatch(_name, include_pattern):
+        return False
+      return _fstatus['length'] >= min_size
+
+    def _scan_flat(_src_base, _dst_base, _dst_exists, _listing=None):
+      """Walk a source directory copying all its files directly under the
+      destination directory, which is listed once."""
+      dst_fstatuses = flat_listings.get(_dst_base, {})
+      if _dst_exists and _dst_base not in flat_listings:
+        dst_dirs.add(_dst_base)
+        with _timed('Destination Status', _dst_base):
+          dst_fstatuses = flat_listings[_dst_base] = dict(retry('List', self.dst.list, _dst_base, status=True))
+      elif not _dst_exists:
+        new_dirs[_dst_base] = _src_base
+      pending_dirs = [_src_base]
+      while pending_dirs:
+        src_dir = pending_dirs.pop()
+        dirs = _CopyDirs(src_dir, _dst_base)
+        if _listing is None:
+          with _timed('Scan', src_dir):
+            src_fstatuses = retry('List', self.src.list, src_dir, status=True)
+        else:
+          src_fstatuses, _listing = _listing, None
+        for name, fstatus in src_fstatuses:
+          if fstatus['type'] == 'DIRECTORY':
+            pending_dirs.append(osp.join(src_dir, name))
+            continue
+          if not _selected(name, fstatus):
+            continue
+          if name in flat_sources:
+            raise HdfsError('Conflicting files %r and %r : can\'t copy both files to %r'
+                            % (osp.join(flat_sources[name], name), osp.join(src_dir, name), osp.join(_dst_base, name)) )
+          flat_sources[name] = src_dir
+          if not _dst_exists:
+            _dst_exists = True
+            yield _MakeDirs(_dst_base)
+          dst_fstatus = dst_fstatuses.get(name)
+          yield _FileCopy(
+            dirs,
+            name,
+            _file_status(fstatus),
+            _file_status(dst_fstatus) if dst_fstatus else None,
           )
-          for fpath in src_fpaths
+
+    def _journaled(_copy):
+      """Record a scanned file in the journal, returns the file to copy or
+      `None` if the interrupted job already copied it."""
+      record = job_journal.get(_copy.src_path) if resume else None
+      if record is not None:
+        outcome, length, modification_time, dst_existed = record
+        if (outcome in ('copied', 'skipped') and length == _copy.status.length
+            and modification_time == _copy.status.modification_time):
+          previous['files'] += 1
+          previous['bytes'] += length
+          return None
+        if not dst_existed and _copy.dst_status is not None:
+          # partial file written by the interrupted job
+          retry('Delete', self.dst.delete, _copy.dst_path)
+          _copy = _copy._replace(dst_status=None)
+      job_journal.add(_copy.src_path, _copy.dst_path, _copy.status, _copy.dst_status is not None)
+      return _copy
+
+    def _files():
+      """Generate the files of the job, from the journal if the interrupted job
+      completed its scan, otherwise scanning the source."""
+      # the deletions are not journaled, a mirror scans the source again
+      if resume and job_journal.is_scanned() and not delete:
+        previous['files'], previous['bytes'] = job_journal.completed()
+        for _src_path, _dst_path, _src_st, _dst_existed in job_journal.unfinished():
+          # a partial file may have been written by the interrupted job
+          yield _file_copy(_src_path, _dst_path, _FileStatus(*_src_st), _reset_partial(_dst_path, _dst_existed))
+        return
+
+      for copy_tuple in tuples:
+        for fpath_tuple in _scan_files(copy_tuple):
+          if job_journal is not None and isinstance(fpath_tuple, _FileCopy):
+            fpath_tuple = _journaled(fpath_tuple)
+            if fpath_tuple is None:
+              continue
+          yield fpath_tuple
+      if job_journal is not None:
+        job_journal.set_scanned()
+
+    def _units(_work):
+      """Generate the work units copying a file."""
+      # Files bigger than the split size are copied as several parts sharing
+      # the same threads as the other files.
+      if isinstance(_work, _FileCopy) and split_size > 0 and _work.status.length > split_size:
+        split = _SplitFile(_work, split_size)
+        if len(split.parts) > 1:
+          _logger.debug('Splitting %r into %s parts.', _work.src_path, len(split.parts))
+          for index in range(len(split.parts)):
+            yield (split, index)
+          return
+      yield _work
+
+    def _scan():
+      """Generate the work units of the job, the copy processes and the
+      workers split the files themselves."""
+      for fpath_tuple in _files():
+        if isinstance(fpath_tuple, _FileCopy):
+          scanned['files'] += 1
+          scanned['bytes'] += fpath_tuple.status.length
+          if scan_progress:
+            scan_progress(fpath_tuple.status.length, 1)
+        if n_processes > 1 or coordinator is not None:
+          yield fpath_tuple
+          continue
+        for work in _units(fpath_tuple):
+          yield work
+      _logger.info("--- scan finished in %s seconds, found %s files (%s bytes) ---" % (time.time() - start_time, scanned['files'], scanned['bytes']))
+
+    def _produce():
+      try:
+        for work in _scan():
+          work_queue.put(work)
+      except Exception as exp:
+        _logger.exception('Error while scanning %r. %s' % (src_path,exp))
+        scan_errors.append(exp)
+      finally:
+        work_queue.close()
+
+    def _account(_result):
+      if _result['status'] == 'part':
+        # intermediate part of a split file, accounted with its last part
+        return
+      if 'deleted' in _result:
+        with stat_lock:
+          if _result['status'] == 'deleted':
+            status['Files Deleted']+=_result['files']
+            status['Size Deleted']+=_result['length']
+          else:
+            status['Outcome'] = 'Failed'
+        return
+      with stat_lock:
+        status['Files Expected']+=1
+        status['Size Expected']+=_result['length']
+        if _result['status'] == 'copied':
+          status['Files Copied']+=1
+          status['Size Copied']+=_result['length']
+        if _result['status'] == 'skipped':
+          status['Files Skipped']+=1
+          status['Size Skipped']+=_result['length']
+        if _result['status'] == 'failed':
+          status['Files Failed']+=1
+          status['Size Failed']+=_result['length']
+          status['Outcome'] = 'Failed'
+      if job_journal is not None:
+        job_journal.complete(_result['src_path'], _result['status'])
+
+    def _consume(_queue, _concurrency, _deferred, _report):
+      while True:
+        _concurrency.acquire()
+        try:
+          work = _queue.get()
+          if work is None:
+            break
+          if isinstance(work, _MakeDirs):
+            _makedirs_wrap(work.dst_path)
+            continue
+          if isinstance(work, _Delete):
+            _report(_delete(work))
+            continue
+          schedule_stats.dispatch(_work_length(work))
+          if budget is not None:
+            budget.acquire(budget_job)
+          try:
+            _start = time.time()
+            result = _run(work)
+          finally:
+            if budget is not None:
+              budget.release()
+          failed = result['status'] == 'failed'
+          _concurrency.record(_work_length(work), failed)
+          if failed and _deferred is not None:
+            # copied again at the end of the job
+            retry.lose(time.time() - _start)
+            if not isinstance(work, _FileCopy):
+              work = work[0].copy
+            _deferred.append(work)
+            continue
+          _report(result)
+        finally:
+          _concurrency.release()
+
+    def _apply(_queue, _report):
+      while True:
+        result = _queue.get()
+        if result is None:
+          break
+        try:
+          _preserve(*result.pop('preserve'))
+        except Exception as err: # pylint: disable=broad-except
+          _logger.error('Failed to preserve the attributes of %r: %s', result['dest_path'], err)
+          with stat_lock:
+            preserved['Failures'] += 1
+          result['status'] = 'failed'
+        _report(result)
+
+    def _execute(_queue, _concurrency, _report):
+      """Copy the work units of a queue, returns the number of files copied
+      again after failing."""
+      deferred = []
+      preserve_queue = None
+      _copied_report = _report
+      if preserve:
+        # The attributes of the copied files are applied by their own threads,
+        # the copy threads only wait for them when too many are pending.
+        preserve_queue = Queue(queue_size)
+        preservers = [
+          _start_thread(lambda: _apply(preserve_queue, _report))
+          for _ in range(preserve_threads)
+        ]
+        def _copied_report(_result):
+          if 'preserve' in _result:
+            preserve_queue.put(_result)
+          else:
+            _report(_result)
+
+      _logger.debug('Copying files using %s to %s thread(s).', _concurrency.floor, _concurrency.ceiling)
+      _join_threads([
+        _start_thread(lambda: _consume(_queue, _concurrency, deferred, _copied_report))
+        for _ in range(_concurrency.ceiling)
       ])
 
-    _logger.info("--- scan finished in %s seconds, copying %s files ---" % (time.time() - start_time, len(fpath_tuples)))
+      if deferred and not scan_errors:
+        # Files still failing after the operation retries, most likely during
+        # an outage, copied again with less threads.
+        n_retry_threads = max(_concurrency.peak // 2, 1)
+        _logger.warn('Copying %s failed files again using %s thread(s).', len(deferred), n_retry_threads)
+        retry_queue = _WorkQueue(len(deferred), _priority)
+        for work in deferred:
+          try:
+            retry_queue.put(work._replace(dst_status=_reset_partial(work.dst_path, work.dst_status is not None)))
+          except Exception as err: # pylint: disable=broad-except
+            # still unreachable, left unfinished in the journal
+            _logger.error('Failed to reset the destination of %r: %s', work.dst_path, err)
+            _copied_report({ 'status': 'failed', 'src_path': work.src_path, 'dest_path' : work.dst_path, 'length': work.status.length })
+        retry_queue.close()
+        retry_concurrency = _Concurrency(n_retry_threads, n_retry_threads)
+        _join_threads([
+          _start_thread(lambda: _consume(retry_queue, retry_concurrency, None, _copied_report))
+          for _ in range(n_retry_threads)
+        ])
 
-    if len(fpath_tuples) == 0:
-      end_time = time.time()
-      _logger.warn("could not find any file to copy.")
+      if preserve_queue is not None:
+        for _ in preservers:
+          preserve_queue.put(None)
+        _join_threads(preservers)
+      return len(deferred)
+
+    def _preserve_dirs():
+      """Apply the attributes of the created directories once all their files
+      are copied, since renaming a file into a directory changes its
+      modification time and a read only directory can not be written to."""
+      by_depth = {}
+      for dir_path in created_dirs:
+        by_depth.setdefault(dir_path.count('/'), []).append(dir_path)
+      _logger.debug('Preserving the attributes of %s directories.', len(created_dirs))
+
+      def _preserve_dir(_dirs):
+        while True:
+          try:
+            dir_path = _dirs.pop()
+          except IndexError:
+            return
+          src_dir = new_dirs[dir_path]
+          try:
+            _preserve(src_dir, src_dirs.get(src_dir), dir_path)
+          except Exception as err: # pylint: disable=broad-except
+            _logger.error('Failed to preserve the attributes of %r: %s', dir_path, err)
+            with stat_lock:
+              preserved['Failures'] += 1
+            status['Outcome'] = 'Failed'
+
+      # deepest first, a directory is changed once its children are done
+      for depth in sorted(by_depth, reverse=True):
+        dirs = by_depth[depth]
+        _join_threads([
+          _start_thread(lambda: _preserve_dir(dirs))
+          for _ in range(min(preserve_threads, len(dirs)))
+        ])
+
+    def _process(_index):
+      """Copy the files handed by the parent process, sending back their
+      results, then the statistics of the process."""
+      # the connections of the parent process can not be shared
+      for client in (self.src, self.dst):
+        if not isinstance(client, LocalClient):
+          client._session.close()
+      if checksums is not None:
+        checksums.reopen()
+      # the requests sent before the fork are counted by the parent process
+      for cluster, counter in request_counters.items():
+        requests_start[cluster] = counter.snapshot()
+      for cluster, pools in connections.items():
+        connections_start[cluster] = pools.snapshot()
+      _warm_up()
+      try:
+        _copy_handed(dispatch_queue.get, results, _index, lambda _result: results.put(('result', _result)))
+      finally:
+        if checksums is not None:
+          checksums.close()
+
+    def _lease_work():
+      """Copy the files leased from the coordinator, sending back their
+      results, then the statistics of the worker."""
+      leased = {}
+      completed = {'Files': 0, 'Rejected': 0}
+      renewing = Event()
+      def _renew():
+        while not renewing.wait(lease_timeout / 3.0):
+          worker_link.renew()
+      _start_thread(_renew)
+
+      def _report(_result):
+        if _result['status'] == 'part':
+          return
+        if worker_link.complete(leased.pop(_result['src_path']), _result):
+          completed['Files'] += 1
+        else:
+          # handed to another worker while it was copied
+          completed['Rejected'] += 1
+
+      def _take():
+        while True:
+          lease = worker_link.take()
+          if lease is False:
+            return None
+          if lease is None:
+            continue
+          lease_id, work, reassigned = lease
+          leased[work.src_path] = lease_id
+          if not reassigned:
+            return work
+          # its previous worker may have left a partial file
+          try:
+            return work._replace(dst_status=_reset_partial(work.dst_path, work.dst_status is not None))
+          except Exception as err: # pylint: disable=broad-except
+            _logger.error('Failed to reset the destination of %r: %s', work.dst_path, err)
+            _report({ 'status': 'failed', 'src_path': work.src_path, 'dest_path' : work.dst_path, 'length': work.status.length })
+
+      try:
+        _copy_handed(_take, worker_link, worker_link.worker, _report)
+      finally:
+        for timer in timers:
+          timer.remove_listener(concurrency.latency)
+        renewing.set()
+        worker_link.close()
+        if checksums is not None:
+          checksums.close()
       return {
+        'Coordinator'      : '%s:%s' % tuple(worker_link.address),
+        'Worker'           : worker_link.worker,
         'Source Path'      : src_path,
         'Destination Path' : dst_path,
-        'Start Time'       : datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S'),
-        'End Time'         : datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S'),
-        'Duration'         : end_time - start_time,
-        'Outcome'          : 'Successful',
-        'Files Expected'   : 0,
-        'Size Expected'    : 0,
-        'Files Copied'     : 0,
-        'Size Copied'      : 0,
-        'Files Failed'     : 0,
-        'Size Failed'      : 0,
-        'Files Deleted'    : 0,
-        'Size Deleted'     : 0,
-        'Files Skipped'    : 0,
-        'Size Skipped'     : 0,
+        'Files'            : completed['Files'],
+        'Rejected'         : completed['Rejected'],
+        'Concurrency'      : concurrency.report(),
+        'Retries'          : retry.report(),
+        'Connections'      : dict(
+          (cluster, connections_report(connections[cluster], counts, warmed.get(cluster, 0)))
+          for cluster, counts in _connections().items()
+        ),
       }
 
-    # Finally, we copy all files (optionally, in parallel).
-    if n_threads <= 0:
-      n_threads = len(fpath_tuples)
-    else:
-      n_threads = min(n_threads, len(fpath_tuples))
-    _logger.debug(
-      'Copying %s files using %s thread(s).', len(fpath_tuples), n_threads
-    )
+    def _copy_handed(_take, _sink, _sender, _report):
+      """Copy the files returned by `_take` until it returns `None`, sending
+      their progress then the statistics of the copy to `_sink`, the results
+      queue of a copy process or the link of a worker."""
+      worker['results'] = _sink
+      if relay is not None:
+        relay.start(lambda _events: _sink.put(('progress', _events)))
+      handed_queue = _WorkQueue(concurrency.ceiling, _priority)
+      def _feed():
+        for work in iter(_take, None):
+          for unit in _units(work):
+            handed_queue.put(unit)
+        handed_queue.close()
+      _start_thread(_feed)
+      n_deferred = _execute(handed_queue, concurrency, _report)
+      if relay is not None:
+        relay.stop()
+      _sink.put(('done', _sender, _stats(n_deferred)))
 
-    try:
-      if n_threads == 1:
-        results = []
-        for path_tuple in fpath_tuples:
-          results.append( _copy_wrap(path_tuple) )
-      else:
-        results = _map_async(n_threads, _copy_wrap, fpath_tuples)
-    except Exception as err: # pylint: disable=broad-except
-      _logger.exception('Error while copying.')
-      raise err
+    def _stats(_n_deferred):
+      """Statistics of a copy process or worker, merged in the job status."""
+      return {
+        'Comparison'    : compared,
+        'Cache'         : (checksums.hits, checksums.misses) if checksums is not None else (0, 0),
+        'Schedule'      : schedule_stats,
+        'Concurrency'   : concurrency.report(),
+        'Peak Threads'  : concurrency.peak,
+        'Peak Memory'   : pipe_memory.peak,
+        'Retries'       : retry.report(),
+        'Deferred'      : _n_deferred,
+        'Metrics'       : job_metrics.state() if job_metrics is not None else None,
+        'Requests'      : _requests(),
+        'Connections'   : _connections(),
+        'Warmed Up'     : warmed,
+        'Preserve'      : preserved,
+      }
 
-    end_time = time.time()
+    def _requests():
+      """Requests sent by the clients of this process since the job started."""
+      return dict(
+        (cluster, count_difference(counter.snapshot(), requests_start[cluster]))
+        for cluster, counter in request_counters.items()
+      )
+
+    def _add_requests(_requests_by_cluster):
+      for cluster, counts in _requests_by_cluster.items():
+        for operation, count in counts.items():
+          requests.setdefault(cluster, {})
+          requests[cluster][operation] = requests[cluster].get(operation, 0) + count
+
+    def _connections():
+      """Requests and connections of the pools of this process since the job
+      started."""
+      return dict(
+        (cluster, connections_difference(pools.snapshot(), connections_start[cluster]))
+        for cluster, pools in connections.items()
+      )
+
+    def _add_connections(_counts_by_cluster, _warmed):
+      for cluster, counts in _counts_by_cluster.items():
+        total = connection_counts.setdefault(cluster, {'Requests': 0, 'Connections': 0, 'Hosts': {}})
+        total['Requests'] += counts['Requests']
+        total['Connections'] += counts['Connections']
+        for host, count in counts['Hosts'].items():
+          total['Hosts'][host] = total['Hosts'].get(host, 0) + count
+      for cluster, count in _warmed.items():
+        warmed_total[cluster] = warmed_total.get(cluster, 0) + count
+
+    def _warm_up():
+      """Open the connections of the first threads before the copy starts."""
+      if warm_up:
+        for cluster, pools in connections.items():
+          warmed[cluster] = pools.warm_up(concurrency.floor)
+          _logger.debug('Opened %s connections to the %s hosts.', warmed[cluster], cluster.lower())
 
-    # Transfer summary
+    def _dispatch():
+      """Hand the queued files to the copy processes."""
+      works = iter(work_queue.get, None)
+      for work in itertools.chain(works, [None] * n_processes):
+        while not dispatch_stopped.is_set():
+          try:
+            dispatch_queue.put(work, timeout=1)
+            break
+          except Full:
+            pass
+
+    def _collect():
+      """Account the results of the copy processes until they are all done,
+      returns the number of files they copied again after failing."""
+      n_deferred = 0
+      done = set()
+      while len(done) < n_processes:
+        try:
+          message = results.get(timeout=1)
+        except Empty:
+          for index, process in enumerate(processes):
+            if index not in done and process.exitcode not in (None, 0):
+              _logger.error('Copy process %s exited with code %s.', process.pid, process.exitcode)
+              status['Outcome'] = 'Failed'
+              done.add(index)
+          if len(done) == n_processes:
+            # nobody is left to copy the remaining files
+            dispatch_stopped.set()
+          continue
+        if message[0] == 'done':
+          done.add(message[1])
+          n_deferred += _merge(message[2])
+        else:
+          _receive(message)
+      return n_deferred
+
+    def _coordinate():
+      """Account the results of the workers until all the files are copied
+      and the remaining workers sent their statistics, returns the number of
+      files they copied again after failing."""
+      n_deferred = 0
+      done = set()
+      while True:
+        for worker_id in leases.expire():
+          _logger.warn('Worker %s stopped renewing its leases, its files are handed to the other workers.', worker_id)
+        try:
+          message = results.get(timeout=1)
+        except Empty:
+          if leases.finished() and leases.workers() <= done:
+            return n_deferred
+          continue
+        if message[0] == 'done':
+          done.add(message[1])
+          n_deferred += _merge(message[2])
+        else:
+          _receive(message)
+
+    def _lease_dispatch():
+      """Hand the queued files to the workers, the directories and deletions
+      are handled by the coordinator itself and in order."""
+      for work in iter(work_queue.get, None):
+        if isinstance(work, _MakeDirs):
+          _makedirs_wrap(work.dst_path)
+        elif isinstance(work, _Delete):
+          _account(_delete(work))
+        else:
+          leases.put(work)
+      leases.close()
+
+    def _receive(_message):
+      """Handle a message of a copy process or worker."""
+      if _message[0] == 'result':
+        _account(_message[1])
+      elif _message[0] == 'progress':
+        if job_progress:
+          for _path, _nbytes in _message[1]:
+            job_progress(_path, _nbytes)
+      elif _message[0] == 'created':
+        _created_dir(_message[1])
+
+    def _merge(stats):
+      """Merge the statistics of a copy process or worker, returns the number
+      of files it copied again after failing."""
+      for tier, count in stats['Comparison'].items():
+        compared[tier] += count
+      if checksums is not None:
+        checksums.hits += stats['Cache'][0]
+        checksums.misses += stats['Cache'][1]
+      schedule_stats.merge(stats['Schedule'])
+      retry.merge(stats['Retries'])
+      process_reports.append(stats['Concurrency'])
+      peaks['threads'] += stats['Peak Threads']
+      pipe_memory.peak += stats['Peak Memory']
+      if job_metrics is not None:
+        job_metrics.merge(stats['Metrics'])
+      _add_requests(stats['Requests'])
+      _add_connections(stats['Connections'], stats['Warmed Up'])
+      for key in ('Requests', 'Skipped'):
+        for attribute, count in stats['Preserve'][key].items():
+          preserved[key][attribute] += count
+      preserved['Failures'] += stats['Preserve']['Failures']
+      return stats['Deferred']
+
+    def _priority(_work):
+      # directories and deletions first, then the largest files first or the
+      # walk order
+      if isinstance(_work, (_MakeDirs, _Delete)):
+        return 0
+      if schedule == 'size':
+        return 1 - _work_length(_work)
+      return 1
+
+    # Transfer summary, filled in as the files are copied
     status = {
       'Source Path'      : src_path,
       'Destination Path' : dst_path,
-      'Start Time'       : datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S'),
-      'End Time'         : datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S'),
-      'Duration'         : end_time - start_time,
       'Outcome'          : 'Successful',
       'Files Expected'   : 0,
       'Size Expected'    : 0,
@@ -325,37 +1374,1387 @@ class WebHDFSDistClient(object):
       'Files Skipped'    : 0,
       'Size Skipped'     : 0,
     }
+    scanned = {'files': 0, 'bytes': 0}
+    # number of existing destination files decided by each comparison
+    compared = {'Length': 0, 'Modification Time': 0, 'Checksum': 0}
+    # files copied or skipped by the interrupted job being resumed
+    previous = {'files': 0, 'bytes': 0}
+    scan_errors = []
+    schedule_stats = _ScheduleStats()
+
+    if n_threads <= 0:
+      concurrency = _Concurrency(min_threads, max_threads, adaptive=True)
+    else:
+      concurrency = _Concurrency(n_threads, n_threads)
+    # the retried failures are throttling signals
+    retry.listener = concurrency.retried
+
+    # Connection pools of the clusters, sized to the threads sending requests
+    # through them: every copy thread may read the source and write the
+    # destination, the scan and the preserve threads send requests too.
+    if self.src is self.dst:
+      pool_clients = {'Cluster': self.src}
+    else:
+      pool_clients = dict(
+        (cluster, client)
+        for cluster, client in (('Source', self.src), ('Destination', self.dst))
+        if not isinstance(client, LocalClient)
+      )
+    job_pool_size = pool_size or concurrency.ceiling * (2 if self.src is self.dst else 1) + preserve_threads + 2
+    connections = dict(
+      (cluster, configure_pools(client, job_pool_size, host_spread))
+      for cluster, client in pool_clients.items()
+    )
+    connections_start = dict((cluster, pools.snapshot()) for cluster, pools in connections.items())
+    # the latency of the requests drives the adaptive threads
+    timers = []
+    if concurrency.adaptive:
+      timers = [time_requests(client) for client in pool_clients.values()]
+      for timer in timers:
+        timer.add_listener(concurrency.latency)
+    # connections opened before the copy started, and the requests and
+    # connections of the job
+    warmed = {}
+    warmed_total = {}
+    connection_counts = {}
+
+    # Statistics of the copy processes
+    process_reports = []
+    peaks = {'threads': 0}
+    processes = []
+    if n_processes > 1:
+      # Forked before any thread is started, the files are handed over a small
+      # queue so that the scheduling order mostly applies across processes.
+      dispatch_queue = multiprocessing.Queue(n_processes)
+      dispatch_stopped = Event()
+      results = multiprocessing.Queue()
+      for index in range(n_processes):
+        process = multiprocessing.Process(target=_process, args=(index, ))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+      _logger.debug('Copying files using %s processes.', n_processes)
+
+    if n_processes == 1 and coordinator is None:
+      # the workers copy the files of a coordinator
+      _warm_up()
+
+    if worker_link is not None:
+      return _lease_work()
+
+    leases = None
+    if coordinator is not None:
+      # Whole files are leased, the workers split them themselves.
+      results = Queue()
+      leases = LeaseQueue(lease_timeout, concurrency.ceiling)
+      job = {
+        'src_path'      : src_path,
+        'dst_path'      : dst_path,
+        'lease_timeout' : lease_timeout,
+        'options'       : dict(kwargs,
+          overwrite=overwrite, checksum=checksum, compare=compare, preserve=preserve,
+          chunk_size=chunk_size, buffer_size=buffer_size, buffer_depth=buffer_depth,
+          split_size=split_size, schedule=schedule, retries=retries, retry_delay=retry_delay,
+          metrics=metrics, umask=umask,
+        ),
+      }
+      server = LeaseServer(coordinator, authkey, job, leases, results.put)
+      server.start()
+
+    # The files are copied while the scan goes on, at most `queue_size` work
+    # units are waiting for a thread.
+    work_queue = _WorkQueue(queue_size, _priority)
+    _start_thread(_produce)
+
+    try:
+      if leases is not None:
+        dispatcher = _start_thread(_lease_dispatch)
+        try:
+          n_deferred = _coordinate()
+        finally:
+          server.stop()
+        _join_threads([dispatcher])
+      elif processes:
+        dispatcher = _start_thread(_dispatch)
+        n_deferred = _collect()
+        dispatch_stopped.set()
+        _join_threads([dispatcher])
+        for process in processes:
+          process.join()
+      else:
+        n_deferred = _execute(work_queue, concurrency, _account)
+        peaks['threads'] = concurrency.peak
+      if created_dirs and not scan_errors:
+        _preserve_dirs()
+    except Exception as err: # pylint: disable=broad-except
+      _logger.exception('Error while copying.')
+      raise err
+    finally:
+      for timer in timers:
+        timer.remove_listener(concurrency.latency)
+      if job_journal is not None:
+        job_journal.close()
+      if checksums is not None:
+        checksums.close()
+
+    if scan_errors:
+      raise scan_errors[0]
+
+    if status['Files Expected'] == 0:
+      _logger.warn("could not find any file to copy.")
+
+    end_time = time.time()
+    status['Start Time'] = datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S')
+    status['End Time'] = datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S')
+    status['Duration'] = end_time - start_time
+
+    status['Schedule'] = schedule_stats.report(schedule, peaks['threads'])
+    if leases is not None:
+      status['Concurrency'] = {
+        'Mode'    : 'adaptive' if concurrency.adaptive else 'fixed',
+        'Threads' : peaks['threads'],
+        'Workers' : process_reports,
+      }
+      status['Leases'] = {
+        'Address' : '%s:%s' % tuple(server.address),
+        'Timeout' : lease_timeout,
+        'Expired' : leases.expired,
+        'Workers' : len(process_reports),
+      }
+    elif processes:
+      status['Concurrency'] = {
+        'Mode'      : 'adaptive' if concurrency.adaptive else 'fixed',
+        'Threads'   : peaks['threads'],
+        'Processes' : process_reports,
+      }
+    else:
+      status['Concurrency'] = concurrency.report()
+    status['Pipeline'] = {
+      'Buffer Depth'        : buffer_depth,
+      'Buffer Size'         : buffer_size,
+      'Memory Per Transfer' : (buffer_depth + 2) * buffer_size if buffer_depth > 0 else 0,
+      'Peak Memory'         : pipe_memory.peak,
+    }
+    status['Retries'] = retry.report()
+    status['Retries']['Deferred Files'] = n_deferred
+    status['Retries']['Deferred Recovered'] = n_deferred - status['Files Failed']
+    status['Comparison'] = dict(compared, Mode=compare)
+    if preserve:
+      status['Preserve'] = {
+        'Attributes'  : preserve,
+        'Directories' : len(created_dirs),
+        'Requests'    : preserved['Requests'],
+        'Skipped'     : preserved['Skipped'],
+        'Failures'    : preserved['Failures'],
+      }
+    if checksums is not None:
+      status['Comparison']['Cache Hits'] = checksums.hits
+      status['Comparison']['Cache Misses'] = checksums.misses
 
-    for result in results:
-      file_st = self.src.status(result['src_path'],strict=True)
-      status['Files Expected']+=1
-      status['Size Expected']+=int(file_st['length'])
-      if result['status'] == 'copied':
-        status['Files Copied']+=1
-        status['Size Copied']+=int(file_st['length'])
-      if result['status'] == 'skipped':
-        status['Files Skipped']+=1
-        status['Size Skipped']+=int(file_st['length'])
-      if result['status'] == 'failed':
-        status['Files Failed']+=1
-        status['Size Failed']+=int(file_st['length'])
-        status['Outcome'] = 'Failed'
+    if job_journal is not None:
+      status['Journal'] = job_journal.path
+      status['Files Previously Completed'] = previous['files']
+      status['Size Previously Completed'] = previous['bytes']
+
+    _add_requests(_requests())
+    _add_connections(_connections(), warmed)
+    status['Connections'] = dict(
+      (cluster, connections_report(pools, connection_counts[cluster], warmed_total.get(cluster, 0)))
+      for cluster, pools in connections.items()
+    )
+    if job_metrics is not None:
+      status['Metrics'] = {
+        'Mode'     : metrics,
+        'Phases'   : job_metrics.report(),
+        'Requests' : requests,
+      }
+      if job_metrics.detailed:
+        status['Metrics']['Files'] = job_metrics.files()
+      if metrics_file:
+        totals = dict((key, status[key]) for key in status if key.startswith(('Files ', 'Size ')) and isinstance(status[key], (int, long)))
+        totals['Duration'] = status['Duration']
+        job_metrics.write_prometheus(metrics_file, requests, totals, labels={'source': src_path, 'destination': dst_path})
 
     return status
 
+  def copy_batch(self, pairs, n_threads=1, max_threads=32, max_jobs=4, journal=None, **kwargs):
+    """Copy several files or directories, sharing the clients and a budget of
+    concurrent copies.
+
+    :param pairs: List of `(src_path, dst_path)` tuples, each one copied by a
+      job like :meth:`copy` would.
+    :param n_threads: Number of files or parts copied at the same time by all
+      the jobs together, zero adapts the threads of every job within a budget
+      of `max_threads`.
+    :param max_threads: Maximum number of threads of every job.
+    :param max_jobs: Number of jobs run at the same time, the next ones start
+      as they complete.
+    :param journal: Path prefix of the journals of the jobs, suffixed by the
+      index of their pair.
+    :param \*\*kwargs: Keyword arguments forwarded to :meth:`copy`.
+
+    Every job scans its source with its own threads, which only copy when the
+    budget grants them a slot. The slots are granted to the jobs in turn, so
+    that their files are interleaved rather than copied one job after the
+    other. Returns the status of every job and their aggregate, a job that
+    could not start reports its error.
+
+    The jobs share the clients, so the requests and connections of each one
+    would include the ones of the others: they are only reported for the
+    whole batch, in the aggregate.
+
+    """
+    pairs = list(pairs)
+    if kwargs.get('metrics_file'):
+      raise ValueError('Exporting the metrics of a batch is not supported.')
+    start_time = time.time()
+    budget = _Budget(n_threads if n_threads > 0 else max_threads)
+    if self.src is self.dst:
+      clients = {'Cluster': self.src}
+    else:
+      clients = dict(
+        (cluster, client)
+        for cluster, client in (('Source', self.src), ('Destination', self.dst))
+        if not isinstance(client, LocalClient)
+      )
+    counters = {}
+    if kwargs.get('metrics', 'basic') != 'off':
+      counters = dict((cluster, count_requests(client)) for cluster, client in clients.items())
+    requests_start = dict((cluster, counter.snapshot()) for cluster, counter in counters.items())
+    # sized by the jobs
+    connections = dict(
+      (cluster, configure_pools(client, 0, kwargs.get('host_spread', 'first')))
+      for cluster, client in clients.items()
+    )
+    connections_start = dict((cluster, pools.snapshot()) for cluster, pools in connections.items())
+
+    statuses = [None] * len(pairs)
+    pending = deque(enumerate(pairs))
+
+    def _run_jobs():
+      while True:
+        try:
+          index, (src_path, dst_path) = pending.popleft()
+        except IndexError:
+          return
+        job_kwargs = dict(kwargs)
+        if journal:
+          job_kwargs['journal'] = '%s.%s' % (journal, index)
+        try:
+          statuses[index] = self.copy(src_path, dst_path, n_threads=n_threads, max_threads=max_threads,
+                                      budget=budget, **job_kwargs)
+        except Exception as err: # pylint: disable=broad-except
+          _logger.exception('Error while copying %r to %r. %s' % (src_path,dst_path,err))
+          statuses[index] = {
+            'Source Path'      : src_path,
+            'Destination Path' : dst_path,
+            'Outcome'          : 'Failed',
+            'Error'            : str(err),
+          }
+
+    _logger.info('Copying %s paths using %s job(s) and %s slot(s).', len(pairs), min(max_jobs, len(pairs)), budget.slots)
+    _join_threads([ _start_thread(_run_jobs) for _ in range(min(max_jobs, len(pairs))) ])
+
+    end_time = time.time()
+    aggregate = {
+      'Jobs'       : len(pairs),
+      'Outcome'    : 'Successful',
+      'Start Time' : datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S'),
+      'End Time'   : datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S'),
+      'Duration'   : end_time - start_time,
+      'Budget'     : budget.report(),
+    }
+    warmed = {}
+    for job_status in statuses:
+      if job_status['Outcome'] != 'Successful':
+        aggregate['Outcome'] = 'Failed'
+      for key, value in job_status.items():
+        if key.startswith(('Files ', 'Size ')) and isinstance(value, (int, long)):
+          aggregate[key] = aggregate.get(key, 0) + value
+      if 'Metrics' in job_status:
+        del job_status['Metrics']['Requests']
+      for cluster, report in job_status.pop('Connections', {}).items():
+        warmed[cluster] = warmed.get(cluster, 0) + report['Warmed Up']
+    aggregate['Connections'] = dict(
+      (cluster, connections_report(pools, connections_difference(pools.snapshot(), connections_start[cluster]), warmed.get(cluster, 0)))
+      for cluster, pools in connections.items()
+    )
+    if counters:
+      aggregate['Requests'] = dict(
+        (cluster, count_difference(counter.snapshot(), requests_start[cluster]))
+        for cluster, counter in counters.items()
+      )
+    return {'Jobs': statuses, 'Aggregate': aggregate}
+
+  def work(self, address, authkey, **kwargs):
+    """Copy the files leased by the coordinator of a job, see the
+    `coordinator` option of :meth:`copy`.
+
+    :param address: `(host, port)` address of the coordinator.
+    :param authkey: Secret shared with the coordinator.
+    :param \*\*kwargs: Options of :meth:`copy` overriding the ones of the job,
+      typically its threads and checksum cache.
+
+    Returns a summary of the files copied by this worker, the job status is
+    reported by the coordinator.
+    """
+    link = LeaseClient(address, authkey)
+    job = link.hello()
+    _logger.info('Joined the job copying %r to %r as worker %s.', job['src_path'], job['dst_path'], link.worker)
+    options = dict(job['options'], **kwargs)
+    return self._copy_job(link, job['src_path'], job['dst_path'], lease_timeout=job['lease_timeout'], **options)
+
 # Helpers
 # -------
 
-def _map_async(pool_size, func, args):
-  """Async map (threading), handling python 2.6 edge case.
+_FileStatus = namedtuple('_FileStatus', [
+  'type', 'length', 'block_size', 'replication', 'permission',
+  'owner', 'group', 'access_time', 'modification_time'
+])
+
+def _writing_user(client):
+  """Name of the user the client writes files as, `None` if it can not be
+  confirmed: the proxied user, or the user of an insecure client. The name of
+  a Kerberos or token user may differ from its principal and home directory,
+  its files always get their owner set."""
+  if isinstance(client, LocalClient):
+    return client.user
+  if getattr(client, 'proxy', None):
+    return client.proxy
+  return (client._session.params or {}).get('user.name')
+
+def _unmasked(permission, umask='022'):
+  """Whether a permission set on creation is left unchanged by the umask of
+  the cluster."""
+  return int(permission, 8) & int(umask, 8) == 0
+
+_CopyRoot = namedtuple('_CopyRoot', ['src_path', 'dst_path', 'dst_status'])
+
+_CopyDirs = namedtuple('_CopyDirs', ['src_dir', 'dst_dir'])
+
+class _FileCopy(object):
+
+  """A file to copy.
+
+  :param dirs: :class:`_CopyDirs` of the file, shared with the other files
+    of the same directory.
+  :param name: Name of the source file.
+  :param status: :class:`_FileStatus` of the source file.
+  :param dst_status: :class:`_FileStatus` of the existing destination file.
+  :param dst_name: Name of the destination file, if it is not the source one.
+
+  They do not hold the full paths of the files, and are packed in a byte
+  string while waiting in the work queue.
+
+  """
+
+  __slots__ = ('dirs', 'name', 'dst_name', 'status', 'dst_status')
+
+  def __init__(self, dirs, name, status, dst_status, dst_name=None):
+    self.dirs = dirs
+    self.name = _compact_name(name)
+    self.dst_name = dst_name
+    self.status = status
+    self.dst_status = dst_status
+
+  def __repr__(self):
+    return '<%s(src_path=%r, dst_path=%r)>' % (self.__class__.__name__, self.src_path, self.dst_path)
+
+  def __getstate__(self):
+    return (self.dirs, self.name, self.dst_name, self.status, self.dst_status)
+
+  def __setstate__(self, state):
+    self.dirs, self.name, self.dst_name, self.status, self.dst_status = state
+
+  @property
+  def src_path(self):
+    return osp.join(self.dirs.src_dir, self.name)
+
+  @property
+  def dst_path(self):
+    return osp.join(self.dirs.dst_dir, self.dst_name or self.name)
+
+  def _replace(self, **kwargs):
+    """Copy with some attributes replaced, as namedtuples."""
+    state = dict((attr, getattr(self, attr)) for attr in self.__slots__)
+    state.update(kwargs)
+    return _FileCopy(**state)
+
+def _file_copy(src_path, dst_path, status, dst_status):
+  """A :class:`_FileCopy` from full paths, with its own directories."""
+  src_dir, name = osp.split(src_path)
+  dst_dir, dst_name = osp.split(dst_path)
+  return _FileCopy(_CopyDirs(src_dir, dst_dir), name, status, dst_status, dst_name if dst_name != name else None)
+
+_MakeDirs = namedtuple('_MakeDirs', ['dst_path'])
+
+_Delete = namedtuple('_Delete', ['dst_path', 'status'])
+
+def _merge_listings(src_listing, dst_listing):
+  """Pair the entries of a source and a destination directory listings by
+  name, with `None` for the status missing on one side.
+
+  Both listings are walked once in name order, the order HDFS lists them in
+  (sorting them again is then linear).
+  """
+  src_entries = sorted(src_listing, key=lambda entry: entry[0])
+  dst_entries = sorted(dst_listing, key=lambda entry: entry[0])
+  src_index = dst_index = 0
+  while src_index < len(src_entries) or dst_index < len(dst_entries):
+    if dst_index == len(dst_entries) or (
+      src_index < len(src_entries) and src_entries[src_index][0] < dst_entries[dst_index][0]
+    ):
+      yield src_entries[src_index][0], src_entries[src_index][1], None
+      src_index += 1
+    elif src_index == len(src_entries) or dst_entries[dst_index][0] < src_entries[src_index][0]:
+      yield dst_entries[dst_index][0], None, dst_entries[dst_index][1]
+      dst_index += 1
+    else:
+      yield src_entries[src_index][0], src_entries[src_index][1], dst_entries[dst_index][1]
+      src_index += 1
+      dst_index += 1
+
+def _file_status(status):
+  """Compact record of the FileStatus attributes used during a copy.
+
+  :param status: FileStatus dictionary as returned by GETFILESTATUS or
+    LISTSTATUS.
+  """
+  return _FileStatus(
+    _shared(status['type']),
+    int(status['length']),
+    _shared(int(status['blockSize'])),
+    int(status['replication']),
+    _shared(status['permission']),
+    _shared(status['owner']),
+    _shared(status['group']),
+    status['accessTime'],
+    status['modificationTime'],
+  )
+
+# Distinct values of the status strings and block sizes, few of them are
+# repeated in the statuses of all the files.
+_SHARED = {}
+
+def _shared(value):
+  """Single instance of a status value."""
+  return _SHARED.setdefault(value, value)
+
+def _compact_name(name):
+  """File name stored as a byte string when it is ASCII, a quarter of the
+  size of its unicode string."""
+  try:
+    return name.encode('ascii')
+  except UnicodeError:
+    return name
+
+class _DirCache(object):
+
+  """Thread safe cache of the existing directories of a cluster.
+
+  :param client: HDFS client used to create the missing directories.
+
+  A directory is created by a single thread, the other threads needing it wait
+  for the creation to complete rather than checking the namenode again.
+
+  """
+
+  def __init__(self, client):
+    self._client = client
+    self._lock = Lock()
+    self._known = set()
+    self._pending = {}
+
+  def __contains__(self, path):
+    return path in self._known
+
+  def _add(self, path):
+    """Mark a directory and its parents as existing, returns the newly known
+    directories deepest first. Must be called holding the lock."""
+    added = []
+    while path not in self._known:
+      self._known.add(path)
+      added.append(path)
+      parent = osp.dirname(path)
+      if parent == path:
+        break
+      path = parent
+    return added
+
+  def add(self, path):
+    """Mark an existing directory and its parents as existing.
+
+    :param path: Directory path.
+    """
+    with self._lock:
+      self._add(path)
+
+  def makedirs(self, path, on_create=None):
+    """Make sure a directory exists, creating it with its parents if needed.
+
+    :param path: Directory path.
+    :param on_create: Callback called with the path of every directory
+      created, parents first.
+    """
+    while path not in self._known:
+      with self._lock:
+        event = self._pending.get(path)
+        owner = event is None and path not in self._known
+        if owner:
+          event = self._pending[path] = Event()
+      if not owner:
+        if event is not None:
+          event.wait()
+        continue
+
+      try:
+        self._client.makedirs(path)
+        with self._lock:
+          created = self._add(path)
+      finally:
+        with self._lock:
+          del self._pending[path]
+        event.set()
+
+      if on_create:
+        for created_path in reversed(created):
+          on_create(created_path)
+
+class _SplitFile(object):
+
+  """Shared state of a file copied as several byte range parts.
+
+  :param copy: :class:`_FileCopy` of the file.
+  :param split_size: Requested part size, rounded up to a multiple of the
+    source block size so that the parts can be concatenated.
+
+  """
+
+  def __init__(self, copy, split_size):
+    self.copy = copy
+    self.src_path = copy.src_path
+    self.dst_path = copy.dst_path
+    self.status = copy.status
+    self.dst_status = copy.dst_status
+    self.length = copy.status.length
+    self.block_size = copy.status.block_size
+    part_size = split_size
+    if self.block_size > 0:
+      part_size = ((split_size + self.block_size - 1) // self.block_size) * self.block_size
+    self.parts = [
+      (offset, min(part_size, self.length - offset))
+      for offset in range(0, self.length, part_size)
+    ]
+    self.lock = Lock()
+    self.prepared = False
+    self.failed = False
+    self.tmp_path = None
+    self.in_place = False
+    self._pending = len(self.parts)
+    self._nbytes = [0] * len(self.parts)
+    self._total = 0
+
+  def part_path(self, index):
+    """Destination path of a part, the first part is the concat target.
+    The parts written in place all share the temporary file."""
+    if self.in_place:
+      return self.tmp_path
+    return '%s.part-%05d' % (self.tmp_path, index)
+
+  def part_done(self, success):
+    """Record the completion of a part, returns `True` for the last one."""
+    with self.lock:
+      if not success:
+        self.failed = True
+      self._pending -= 1
+      return self._pending == 0
+
+  def progress(self, index, progress):
+    """Progress callback of a part reporting the bytes of the whole file."""
+    if not progress:
+      return None
+
+    def _progress(_path, nbytes):
+      if nbytes == -1:
+        # the file completion is reported once all parts are assembled
+        return
+      # the file is reported by a single thread at a time
+      with self.lock:
+        self._total += nbytes - self._nbytes[index]
+        self._nbytes[index] = nbytes
+        progress(self.src_path, self._total)
+
+    return _progress
+
+def _work_length(work):
+  """Number of bytes copied by a work unit, a file or a split file part."""
+  if isinstance(work, (_MakeDirs, _Delete)):
+    return 0
+  if isinstance(work, _FileCopy):
+    return work.status.length
+  return work[0].parts[work[1]][1]
+
+class _ScheduleStats(object):
+
+  """Measured execution of the copy work units.
+
+  The duration of every work unit is fitted to a `overhead + length / rate`
+  cost model, which is used to predict the makespan of the schedule and
+  compare it to the actual one. Only the work units lengths are kept, in a
+  compact array.
+
+  """
+
+  def __init__(self):
+    self._lock = Lock()
+    self._count = 0
+    self._sum_x = 0.0
+    self._sum_y = 0.0
+    self._sum_xx = 0.0
+    self._sum_xy = 0.0
+    self._start = None
+    self._end = None
+    self._thread_ends = {}
+    self._lengths = array('d')
+
+  def dispatch(self, length):
+    """Record the length of the next work unit handed to a thread."""
+    with self._lock:
+      self._lengths.append(length)
+
+  def record(self, length, start, end):
+    """Record the execution of a work unit.
+
+    :param length: Number of bytes of the work unit.
+    :param start: Start timestamp.
+    :param end: End timestamp.
+    """
+    duration = end - start
+    with self._lock:
+      self._count += 1
+      self._sum_x += length
+      self._sum_y += duration
+      self._sum_xx += length * length
+      self._sum_xy += length * duration
+      if self._start is None or start < self._start:
+        self._start = start
+      if self._end is None or end > self._end:
+        self._end = end
+      self._thread_ends[(os.getpid(), current_thread().ident)] = end
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = Lock()
+
+  def merge(self, other):
+    """Add the work units recorded by another process.
+
+    :param other: :class:`_ScheduleStats` of the other process.
+    """
+    with self._lock:
+      self._count += other._count
+      self._sum_x += other._sum_x
+      self._sum_y += other._sum_y
+      self._sum_xx += other._sum_xx
+      self._sum_xy += other._sum_xy
+      if other._start is not None and (self._start is None or other._start < self._start):
+        self._start = other._start
+      if other._end is not None and (self._end is None or other._end > self._end):
+        self._end = other._end
+      self._thread_ends.update(other._thread_ends)
+      self._lengths.extend(other._lengths)
+
+  def _model(self):
+    """Least squares fit of the per work unit overhead and per byte cost."""
+    if not self._count:
+      return 0.0, 0.0
+    denominator = self._count * self._sum_xx - self._sum_x ** 2
+    if denominator <= 0:
+      # all the work units have the same size
+      return self._sum_y / self._count, 0.0
+    per_byte = (self._count * self._sum_xy - self._sum_x * self._sum_y) / denominator
+    per_byte = max(per_byte, 0.0)
+    overhead = max((self._sum_y - per_byte * self._sum_x) / self._count, 0.0)
+    return overhead, per_byte
+
+  def report(self, policy, n_threads):
+    """Schedule section of the job status.
+
+    :param policy: Schedule policy used.
+    :param n_threads: Number of threads the work units were spread on.
+    """
+    overhead, per_byte = self._model()
+    loads = [0.0] * max(n_threads, 1)
+    for length in self._lengths:
+      heapq.heapreplace(loads, loads[0] + overhead + per_byte * length)
+    actual = (self._end - self._start) if self._count else 0.0
+    # time during which some threads were idle waiting for the last ones
+    tail = (self._end - min(self._thread_ends.values())) if self._count else 0.0
+    return {
+      'Policy'             : policy,
+      'Threads'            : n_threads,
+      'Work Units'         : len(self._lengths),
+      'Predicted Makespan' : max(loads),
+      'Ideal Makespan'     : sum(loads) / len(loads),
+      'Actual Makespan'    : actual,
+      'Idle Tail'          : tail,
+    }
+
+class _Retry(object):
+
+  """Retry policy of the cluster operations.
+
+  :param retries: Number of retries of a failed operation.
+  :param delay: Delay before the first retry in seconds, doubled before each
+    of the next ones. The actual delay is drawn uniformly below it (full
+    jitter) so that the threads hitting the same outage spread their retries.
+  :param max_delay: Maximum delay between two attempts.
+
+  Only the errors which may not happen again are retried: timeouts, standby
+  namenodes, server and connection errors, but not missing or existing files
+  and permission errors. The `listener` attribute, if set, is called with the
+  name of the operation after every failed attempt about to be retried.
+
+  """
+
+  def __init__(self, retries=3, delay=1.0, max_delay=60.0):
+    self.retries = max(retries, 0)
+    self.delay = delay
+    self.max_delay = max_delay
+    self.listener = None
+    self._lock = Lock()
+    self._attempts = {}
+    self._retried = 0
+    self._lost = 0.0
+
+  def __call__(self, operation, func, *args, **kwargs):
+    """Call `func` with the remaining arguments, retrying it on transient
+    errors.
+
+    :param operation: Name of the operation, used to count the attempts.
+    :param func: Function performing the operation.
+    """
+    start = time.time()
+    attempt = 0
+    while True:
+      attempt += 1
+      attempt_start = time.time()
+      try:
+        result = func(*args, **kwargs)
+      except Exception as err: # pylint: disable=broad-except
+        if attempt > self.retries or not _is_transient(err):
+          self._record(operation, attempt, time.time() - start)
+          raise
+        if self.listener:
+          self.listener(operation)
+        delay = random.uniform(0, min(self.max_delay, self.delay * 2 ** (attempt - 1)))
+        _logger.warn('%s attempt %s of %s failed (%s), retrying in %.1f seconds.',
+                     operation, attempt, self.retries + 1, err, delay)
+        time.sleep(delay)
+      else:
+        self._record(operation, attempt, attempt_start - start)
+        return result
+
+  def _record(self, operation, attempts, lost):
+    with self._lock:
+      self._attempts[operation] = self._attempts.get(operation, 0) + attempts
+      if attempts > 1:
+        self._retried += 1
+        self._lost += lost
+
+  def lose(self, duration):
+    """Record time spent on a failed copy which is going to be retried."""
+    with self._lock:
+      self._lost += duration
+
+  def merge(self, report):
+    """Add the attempts of another process.
 
-  :param pool_size: Maximum number of threads.
-  :param func: Function to run.
-  :param args: Iterable of arguments (one per thread).
+    :param report: :meth:`report` of the other process.
+    """
+    with self._lock:
+      for operation, attempts in report['Attempts'].items():
+        self._attempts[operation] = self._attempts.get(operation, 0) + attempts
+      self._retried += report['Retried Operations']
+      self._lost += report['Time Lost']
+
+  def report(self):
+    """Retries section of the job status."""
+    with self._lock:
+      return {
+        'Attempts'             : dict(self._attempts),
+        'Retried Operations'   : self._retried,
+        'Time Lost'            : self._lost,
+      }
+
+# Messages of the errors which happen again whatever the number of retries,
+# and of the errors pywhdfs already retried `max_fail_retries` times
+_PERMANENT_ERRORS = (
+  'does not exist', 'already exists', 'is not a file', 'is not a directory',
+  'Permission denied', 'Unable to rename', 'Missing overwrite',
+  'AccessControlException', 'FileNotFoundException', 'FileAlreadyExistsException',
+  'ParentNotDirectoryException', 'IllegalArgumentException', 'UnsupportedOperationException',
+  'Exceeded maximum number of retries',
+)
+
+def _is_transient(err):
+  """Whether an error may not happen again when retrying the operation."""
+  if isinstance(err, (HdfsTimeoutError, StandbyError, HdfsIOError, RecoveryInProgressError, AlreadyBeingCreatedError)):
+    return True
+  if isinstance(err, (AuthenticationError, ForbiddenRequestError)):
+    return False
+  if isinstance(err, HdfsError):
+    # server errors and failovers, pywhdfs does not tell them apart
+    message = str(err)
+    return not any(marker in message for marker in _PERMANENT_ERRORS)
+  # connection errors, requests exceptions are IO errors
+  return isinstance(err, EnvironmentError)
+
+class _Concurrency(object):
+
+  """Limit of the number of threads copying at the same time.
+
+  :param floor: Minimum limit, the initial one.
+  :param ceiling: Maximum limit, the number of threads to start.
+  :param adaptive: Adapt the limit to the throughput measured over windows of
+    at least `interval` seconds, otherwise the limit stays at `floor`.
+  :param interval: Minimum duration of a measurement window, in seconds.
+
+  The adaptive limit follows an AIMD scheme: it doubles after every window
+  until the first back off (slow start), then grows by one thread per window.
+  A window with failed copies or retried operations halves it, a window whose
+  mean request latency rose above twice the lowest one seen so far, or whose
+  bytes and files rates both dropped by more than 10%, removes one thread.
+
+  """
+
+  def __init__(self, floor, ceiling, adaptive=False, interval=1.0):
+    self.floor = max(floor, 1)
+    self.ceiling = max(ceiling, self.floor)
+    self.adaptive = adaptive
+    self.limit = self.floor
+    self.peak = self.limit
+    self.timeline = []
+    self._interval = interval
+    self._cond = Condition()
+    self._active = 0
+    self._slow_start = True
+    self._rates = None
+    self._start = time.time()
+    self._window_start = self._start
+    # lowest mean request latency of a window
+    self._base_latency = None
+    # bytes, files, failed copies, retried operations, and the total duration
+    # and number of the requests of the window
+    self._window = [0, 0, 0, 0, 0.0, 0]
+    self._change(self._start, (0.0, 0.0), 0, None)
+
+  def acquire(self):
+    """Wait until the current thread is allowed to copy."""
+    with self._cond:
+      while self._active >= self.limit:
+        self._cond.wait(1)
+      self._active += 1
+
+  def release(self):
+    """Signal that the current thread stopped copying."""
+    with self._cond:
+      self._active -= 1
+      self._cond.notify_all()
+
+  def record(self, length, failed):
+    """Record a completed work unit, adapting the limit at the end of a
+    measurement window.
+
+    :param length: Number of bytes of the work unit.
+    :param failed: Whether the copy failed.
+    """
+    if not self.adaptive:
+      return
+    with self._cond:
+      self._window[0] += length
+      self._window[1] += 1
+      self._window[2] += int(failed)
+      now = time.time()
+      if now - self._window_start >= self._interval:
+        self._adapt(now)
+
+  def retried(self, operation):
+    """Record an operation failing and retried, most likely throttled by the
+    cluster.
+
+    :param operation: Name of the operation.
+    """
+    if not self.adaptive:
+      return
+    with self._cond:
+      self._window[3] += 1
+
+  def latency(self, duration):
+    """Record the duration of a request to a cluster.
+
+    :param duration: Duration in seconds.
+    """
+    if not self.adaptive:
+      return
+    with self._cond:
+      self._window[4] += duration
+      self._window[5] += 1
+
+  def _adapt(self, now):
+    """Compute the limit of the next window. Must be called holding the
+    lock."""
+    elapsed = now - self._window_start
+    nbytes, nfiles, failures, retried, duration, n_requests = self._window
+    rates = (nbytes / elapsed, nfiles / elapsed)
+    latency = duration / n_requests if n_requests else None
+    limit = self.limit
+    failures += retried
+    if failures:
+      limit = max(self.floor, limit // 2)
+      self._slow_start = False
+    elif latency is not None and self._base_latency is not None and latency > 2 * self._base_latency:
+      # the requests queue up in the cluster
+      limit = max(self.floor, limit - 1)
+      self._slow_start = False
+    elif self._rates and rates[0] < 0.9 * self._rates[0] and rates[1] < 0.9 * self._rates[1]:
+      limit = max(self.floor, limit - 1)
+      self._slow_start = False
+    elif self._slow_start:
+      limit = min(self.ceiling, limit * 2)
+    else:
+      limit = min(self.ceiling, limit + 1)
+    self._rates = rates
+    if latency is not None and (self._base_latency is None or latency < self._base_latency):
+      self._base_latency = latency
+    self._window = [0, 0, 0, 0, 0.0, 0]
+    self._window_start = now
+    if limit != self.limit:
+      _logger.debug('Copying with %s threads instead of %s.', limit, self.limit)
+      self.limit = limit
+      self.peak = max(self.peak, limit)
+      self._change(now, rates, failures, latency)
+      self._cond.notify_all()
+
+  def _change(self, now, rates, failures, latency):
+    self.timeline.append({
+      'Time'             : now - self._start,
+      'Threads'          : self.limit,
+      'Bytes Per Second' : rates[0],
+      'Files Per Second' : rates[1],
+      'Failures'         : failures,
+      'Latency'          : latency,
+    })
+
+  def report(self):
+    """Concurrency section of the job status."""
+    if not self.adaptive:
+      return { 'Mode': 'fixed', 'Threads': self.limit }
+    return {
+      'Mode'     : 'adaptive',
+      'Floor'    : self.floor,
+      'Ceiling'  : self.ceiling,
+      'Peak'     : self.peak,
+      'Timeline' : self.timeline,
+    }
+
+class _WorkQueue(object):
+
+  """Bounded priority queue connecting the scan to the copy threads.
+
+  :param maxsize: Maximum number of queued work units, :meth:`put` blocks
+    until a thread takes one when it is reached.
+  :param priority: Function returning the integer priority of a work unit,
+    lower values are handed first, ties in insertion order.
+
+  The queued units are byte strings starting with their priority and
+  insertion order, compared by the heap without any other object. The files
+  are packed along with their status, their directories and status strings
+  being shared in tables, which takes about 120 bytes per queued file rather
+  than 500 for a :class:`_FileCopy` in a tuple. The other work units are
+  kept aside.
+
+  """
+
+  def __init__(self, maxsize, priority):
+    self._maxsize = max(maxsize, 1)
+    self._priority = priority
+    self._cond = Condition()
+    self._heap = []
+    self._count = 0
+    self._closed = False
+    self._units = {}
+    self._dirs = _SharedTable()
+    self._attrs = _SharedTable()
+
+  def put(self, work):
+    """Queue a work unit, waiting for room if the queue is full."""
+    priority = self._priority(work)
+    with self._cond:
+      while len(self._heap) >= self._maxsize:
+        self._cond.wait(1)
+      key = _QUEUE_KEY.pack(priority + _PRIORITY_OFFSET, self._count)
+      if isinstance(work, _FileCopy):
+        heapq.heappush(self._heap, key + self._pack(work))
+      else:
+        self._units[self._count] = work
+        heapq.heappush(self._heap, key)
+      self._count += 1
+      self._cond.notify_all()
+
+  def close(self):
+    """Signal that no more work units will be queued."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def get(self):
+    """Next work unit, `None` once the queue is closed and drained."""
+    with self._cond:
+      while not self._heap and not self._closed:
+        self._cond.wait(1)
+      if not self._heap:
+        return None
+      packed = heapq.heappop(self._heap)
+      if len(packed) == _QUEUE_KEY.size:
+        work = self._units.pop(_QUEUE_KEY.unpack(packed)[1])
+      else:
+        work = self._unpack(packed)
+      self._cond.notify_all()
+      return work
+
+  def _pack(self, copy):
+    flags = 0
+    name, dst_name = copy.name, copy.dst_name or ''
+    if isinstance(name, unicode):
+      name = name.encode('utf-8')
+      flags |= _UNICODE_NAME
+    if isinstance(dst_name, unicode):
+      dst_name = dst_name.encode('utf-8')
+      flags |= _UNICODE_DST_NAME
+    statuses = [copy.status]
+    if copy.dst_status is not None:
+      statuses.append(copy.dst_status)
+      flags |= _DST_STATUS
+    packed = [_QUEUED_FILE.pack(self._dirs.ref(copy.dirs), flags, len(name))]
+    for status in statuses:
+      packed.append(_QUEUED_STATUS.pack(
+        self._attrs.ref((status.type, status.block_size, status.permission, status.owner, status.group)),
+        status.length, status.replication, status.access_time, status.modification_time,
+      ))
+    packed.append(name)
+    packed.append(dst_name)
+    return ''.join(packed)
+
+  def _unpack(self, packed):
+    offset = _QUEUE_KEY.size
+    dirs_index, flags, name_size = _QUEUED_FILE.unpack_from(packed, offset)
+    offset += _QUEUED_FILE.size
+    statuses = []
+    for _ in range(2 if flags & _DST_STATUS else 1):
+      attrs_index, length, replication, access_time, modification_time = _QUEUED_STATUS.unpack_from(packed, offset)
+      offset += _QUEUED_STATUS.size
+      _type, block_size, permission, owner, group = self._attrs.unref(attrs_index)
+      statuses.append(_FileStatus(
+        _type, length, block_size, replication, permission, owner, group, access_time, modification_time,
+      ))
+    name = packed[offset:offset + name_size]
+    dst_name = packed[offset + name_size:] or None
+    if flags & _UNICODE_NAME:
+      name = name.decode('utf-8')
+    if dst_name and flags & _UNICODE_DST_NAME:
+      dst_name = dst_name.decode('utf-8')
+    return _FileCopy(
+      self._dirs.unref(dirs_index), name, statuses[0], statuses[1] if len(statuses) > 1 else None, dst_name,
+    )
+
+# Layout of the queued work units: priority and insertion order, then for a
+# file its directories, flags and name size, its status and the status of
+# its destination if it exists, its name and its destination name.
+_QUEUE_KEY = struct.Struct('>QQ')
+_QUEUED_FILE = struct.Struct('>IBH')
+_QUEUED_STATUS = struct.Struct('>IqHqq')
+_PRIORITY_OFFSET = 2 ** 63
+_UNICODE_NAME = 1
+_UNICODE_DST_NAME = 2
+_DST_STATUS = 4
+
+class _SharedTable(object):
+
+  """Values shared by queued work units, which reference them by index.
+
+  A value is dropped once the last unit referencing it is taken, its index
+  being reused.
+
+  """
+
+  def __init__(self):
+    self._values = []
+    self._refs = []
+    self._indices = {}
+    self._free = []
+
+  def ref(self, value):
+    """Index of a value, referenced once more."""
+    index = self._indices.get(value)
+    if index is None:
+      if self._free:
+        index = self._free.pop()
+        self._values[index] = value
+      else:
+        index = len(self._values)
+        self._values.append(value)
+        self._refs.append(0)
+      self._indices[value] = index
+    self._refs[index] += 1
+    return index
+
+  def unref(self, index):
+    """Value of an index, referenced once less."""
+    value = self._values[index]
+    self._refs[index] -= 1
+    if not self._refs[index]:
+      del self._indices[value]
+      self._values[index] = None
+      self._free.append(index)
+    return value
+
+class _Gauge(object):
+
+  """Thread safe current and peak values of a quantity."""
+
+  def __init__(self):
+    self._lock = Lock()
+    self.value = 0
+    self.peak = 0
+
+  def add(self, amount):
+    """Add to the current value, which may be negative."""
+    with self._lock:
+      self.value += amount
+      self.peak = max(self.peak, self.value)
+
+class _ProgressRelay(object):
+
+  """Progress callback of a copy process, forwarding the progress of its
+  files to the parent process.
+
+  :param interval: Number of seconds between two sends.
+
+  Only the last number of bytes of every file is sent, followed by the
+  completion of the files complete since the previous send.
+
+  """
+
+  def __init__(self, interval=0.2):
+    self._interval = interval
+    self._lock = Lock()
+    self._nbytes = {}
+    self._complete = []
+    self._stopped = Event()
+    self._thread = None
+
+  def __call__(self, hdfs_path, nbytes):
+    with self._lock:
+      if nbytes == -1:
+        self._complete.append(hdfs_path)
+      else:
+        self._nbytes[hdfs_path] = nbytes
+
+  def _events(self):
+    with self._lock:
+      events = list(self._nbytes.items()) + [(hdfs_path, -1) for hdfs_path in self._complete]
+      self._nbytes = {}
+      self._complete = []
+    return events
+
+  def start(self, send):
+    """Start sending the progress events in the background.
+
+    :param send: Function called with lists of `(path, nbytes)` events.
+    """
+    def _run():
+      while not self._stopped.wait(self._interval):
+        events = self._events()
+        if events:
+          send(events)
+    self._send = send
+    self._thread = _start_thread(_run)
+
+  def stop(self):
+    """Stop the background sends and send the remaining events."""
+    self._stopped.set()
+    _join_threads([self._thread])
+    events = self._events()
+    if events:
+      self._send(events)
+
+def _pipe(stream, depth, buffer_size, path=None, progress=None, gauge=None):
+  """Generator yielding the content of a stream read ahead by another thread.
+
+  :param stream: File-like object supporting `readinto`.
+  :param depth: Number of buffers read ahead of the consumer.
+  :param buffer_size: Size of the buffers.
+  :param path: Path passed to the progress callback.
+  :param progress: Progress callback, called with the bytes consumed like the
+    one of :meth:`read`. It is called by the consuming thread, which outlives
+    the transfer, rather than by the reading one.
+  :param gauge: :class:`_Gauge` of the memory allocated to buffers.
+
+  The `depth + 2` buffers (read ahead, being read and being consumed) are
+  reused, a yielded buffer is only valid until the next one is requested.
+  The generator must be closed if it is not exhausted.
   """
-  pool = ThreadPool(pool_size)
-  if sys.version_info <= (2, 6):
-    return pool.map(func, args)
-  else:
-    return pool.map_async(func, args).get(1 << 31)
+  buffers = [ bytearray(buffer_size) for _ in range(depth + 2) ]
+  memory = len(buffers) * buffer_size
+  free = Queue()
+  full = Queue()
+  stopped = Event()
+  for index in range(len(buffers)):
+    free.put(index)
+
+  def _read():
+    try:
+      while True:
+        index = free.get()
+        if stopped.is_set():
+          return
+        count = stream.readinto(buffers[index])
+        if not count:
+          break
+        full.put((index, count, None))
+      full.put((None, 0, None))
+    except Exception as err: # pylint: disable=broad-except
+      full.put((None, 0, err))
+
+  if gauge:
+    gauge.add(memory)
+  _start_thread(_read)
+  try:
+    nbytes = 0
+    while True:
+      index, count, error = full.get()
+      if index is None:
+        if error is not None:
+          raise error
+        if progress:
+          progress(path, -1)
+        return
+      yield memoryview(buffers[index])[:count]
+      free.put(index)
+      nbytes += count
+      if progress:
+        progress(path, nbytes)
+  finally:
+    # unblock the reading thread if it waits for a buffer
+    stopped.set()
+    free.put(None)
+    if gauge:
+      gauge.add(-memory)
+
+def _concat(client, target, sources, chunk_size=2 ** 16, buffer_size=2 ** 16):
+  """Concatenate HDFS files into `target`, removing the sources.
+
+  :param client: Destination HDFS client.
+  :param target: Path of the file the sources will be appended to.
+  :param sources: Ordered list of paths to append.
+
+  pywhdfs does not expose the CONCAT operation, if the cluster does not
+  support it (HttpFS, partial blocks) the parts are appended sequentially.
+  """
+  if not sources:
+    return
+  try:
+    client._api_request(method='POST', hdfs_path=target, params={'op': 'CONCAT', 'sources': ','.join(sources)})
+  except HdfsError as err:
+    _logger.warn('Concat of %r failed (%s), appending parts sequentially.', target, err)
+    for source in sources:
+      with client.read(source, chunk_size=chunk_size, buffer_size=buffer_size) as _reader:
+        client.write(target, _reader, append=True, buffersize=buffer_size)
+      client.delete(source)
+
+class _Budget(object):
+
+  """Slots of a batch of jobs copying at the same time, granted to the jobs in
+  turn and to the threads of a job in arrival order.
+
+  :param slots: Number of slots.
+
+  """
+
+  def __init__(self, slots):
+    self.slots = max(slots, 1)
+    self._lock = Lock()
+    self._active = 0
+    self._peak = 0
+    self._granted = 0
+    self._waited = 0.0
+    self._waiters = {}
+    self._turns = deque()
+
+  def acquire(self, job):
+    """Wait for a slot.
+
+    :param job: Key of the job the calling thread belongs to.
+    """
+    start = time.time()
+    granted = Event()
+    with self._lock:
+      waiters = self._waiters.get(job)
+      if waiters is None:
+        waiters = self._waiters[job] = deque()
+        self._turns.append(job)
+      waiters.append(granted)
+      self._grant()
+    granted.wait()
+    with self._lock:
+      self._waited += time.time() - start
+
+  def release(self):
+    """Give a slot back."""
+    with self._lock:
+      self._active -= 1
+      self._grant()
+
+  def _grant(self):
+    """Grant the free slots to the next jobs waiting. Must be called holding
+    the lock."""
+    while self._active < self.slots and self._turns:
+      job = self._turns.popleft()
+      waiters = self._waiters[job]
+      waiters.popleft().set()
+      if waiters:
+        self._turns.append(job)
+      else:
+        del self._waiters[job]
+      self._active += 1
+      self._granted += 1
+      self._peak = max(self._peak, self._active)
+
+  def report(self):
+    """Budget section of the batch status."""
+    with self._lock:
+      return {
+        'Slots'      : self.slots,
+        'Peak Slots' : self._peak,
+        'Granted'    : self._granted,
+        'Wait Time'  : self._waited,
+      }
+
+def _start_thread(target):
+  """Start a daemon thread running `target`."""
+  thread = Thread(target=target)
+  thread.daemon = True
+  thread.start()
+  return thread
 
+def _join_threads(threads):
+  """Wait for threads to complete, without blocking interrupts."""
+  for thread in threads:
+    while thread.is_alive():
+      thread.join(1)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from pywhdfs.utils.utils import HdfsError
+from threading import Lock
+import logging as lg
+import sqlite3
+import json
+
+_logger = lg.getLogger(__name__)
+
+class CopyJournal(object):
+
+  """Persistent journal of the files handled by a copy job.
+
+  :param path: Path of the SQLite database file, created if it does not exist.
+  :param flush_size: Number of pending updates triggering a write to disk.
+
+  Every scanned file is recorded with its source status before being copied,
+  then updated with its outcome. Updates are written to disk in batches, a
+  crash loses at most the last `flush_size` outcomes, those files being
+  copied again on resume. The directories created by the job are recorded
+  too, so that their attributes are preserved by the job resuming it.
+
+  """
+
+  def __init__(self, path, flush_size=1000):
+    self.path = path
+    self._flush_size = flush_size
+    self._lock = Lock()
+    self._added = []
+    self._completed = []
+    self._dirs = []
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.execute('CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)')
+    self._conn.execute('CREATE TABLE IF NOT EXISTS roots (src_path TEXT PRIMARY KEY, dst_path TEXT)')
+    self._conn.execute(
+      'CREATE TABLE IF NOT EXISTS files (src_path TEXT PRIMARY KEY, dst_path TEXT, outcome TEXT, '
+      'length INTEGER, modification_time INTEGER, dst_existed INTEGER, status TEXT)'
+    )
+    self._conn.execute('CREATE TABLE IF NOT EXISTS dirs (dst_path TEXT PRIMARY KEY, src_path TEXT)')
+    self._conn.commit()
+    _logger.info('Instantiated %r.', self)
+
+  def __repr__(self):
+    return '<%s(path=%r)>' % (self.__class__.__name__, self.path)
+
+  def _get_job(self, key):
+    row = self._conn.execute('SELECT value FROM job WHERE key = ?', (key, )).fetchone()
+    return row[0] if row else None
+
+  def _set_job(self, key, value):
+    self._conn.execute('INSERT OR REPLACE INTO job (key, value) VALUES (?, ?)', (key, value))
+
+  def open(self, src_path, dst_path, resume=False):
+    """Start or resume recording a job.
+
+    :param src_path: Source path of the job.
+    :param dst_path: Destination path of the job.
+    :param resume: Resume the job recorded in the journal rather than starting
+      a new one, an :class:`HdfsError` is raised if the journal records
+      another job.
+
+    Returns `True` if a recorded job is resumed.
+    """
+    with self._lock:
+      if resume:
+        if self._get_job('src_path') != src_path or self._get_job('dst_path') != dst_path:
+          raise HdfsError('Journal %r does not record a copy of %r to %r.', self.path, src_path, dst_path)
+        _logger.info('Resuming copy of %r to %r from journal %r.', src_path, dst_path, self.path)
+        return True
+      for table in ('job', 'roots', 'files', 'dirs'):
+        self._conn.execute('DELETE FROM %s' % table)
+      self._set_job('src_path', src_path)
+      self._set_job('dst_path', dst_path)
+      self._conn.commit()
+      return False
+
+  def set_roots(self, roots):
+    """Record the source and destination paths the job copies.
+
+    :param roots: List of `(src_path, dst_path)` tuples.
+    """
+    with self._lock:
+      self._conn.executemany('INSERT OR REPLACE INTO roots (src_path, dst_path) VALUES (?, ?)', roots)
+      self._conn.commit()
+
+  def roots(self):
+    """Source and destination paths of the recorded job."""
+    with self._lock:
+      return self._conn.execute('SELECT src_path, dst_path FROM roots ORDER BY src_path').fetchall()
+
+  def is_scanned(self):
+    """Whether the scan of the recorded job completed."""
+    with self._lock:
+      return self._get_job('scanned') == '1'
+
+  def set_scanned(self):
+    """Mark the scan of the job as complete."""
+    with self._lock:
+      self._flush()
+      self._set_job('scanned', '1')
+      self._conn.commit()
+
+  def add(self, src_path, dst_path, status, dst_existed):
+    """Record a scanned file, to be copied.
+
+    :param src_path: Source file path.
+    :param dst_path: Destination file path.
+    :param status: Sequence of the source file status attributes, the second
+      and last ones being the length and modification time.
+    :param dst_existed: Whether the destination file existed when scanned.
+    """
+    with self._lock:
+      self._added.append((src_path, dst_path, 'pending', status[1], status[-1], int(dst_existed), json.dumps(list(status))))
+      if len(self._added) + len(self._completed) + len(self._dirs) >= self._flush_size:
+        self._flush()
+
+  def complete(self, src_path, outcome):
+    """Record the outcome of a file.
+
+    :param src_path: Source file path.
+    :param outcome: One of `copied`, `skipped` or `failed`.
+    """
+    with self._lock:
+      self._completed.append((outcome, src_path))
+      if len(self._added) + len(self._completed) + len(self._dirs) >= self._flush_size:
+        self._flush()
+
+  def add_dir(self, src_path, dst_path):
+    """Record a destination directory created by the job.
+
+    :param src_path: Source directory path.
+    :param dst_path: Destination directory path.
+    """
+    with self._lock:
+      self._dirs.append((dst_path, src_path))
+      if len(self._added) + len(self._completed) + len(self._dirs) >= self._flush_size:
+        self._flush()
+
+  def dirs(self):
+    """Recorded `(src_path, dst_path)` tuples of the created directories."""
+    with self._lock:
+      self._flush()
+      return self._conn.execute('SELECT src_path, dst_path FROM dirs ORDER BY dst_path').fetchall()
+
+  def get(self, src_path):
+    """Recorded `(outcome, length, modification_time, dst_existed)` of a file,
+    `None` if the file is not recorded. Updates not written to disk yet are
+    not visible."""
+    with self._lock:
+      return self._conn.execute(
+        'SELECT outcome, length, modification_time, dst_existed FROM files WHERE src_path = ?', (src_path, )
+      ).fetchone()
+
+  def unfinished(self, batch_size=1000):
+    """Generate the recorded files not copied yet.
+
+    This generator yields `(src_path, dst_path, status, dst_existed)` tuples,
+    reading the journal in batches.
+    """
+    rowid = 0
+    while True:
+      with self._lock:
+        self._flush()
+        rows = self._conn.execute(
+          'SELECT rowid, src_path, dst_path, status, dst_existed FROM files '
+          'WHERE outcome IN (\'pending\', \'failed\') AND rowid > ? ORDER BY rowid LIMIT ?',
+          (rowid, batch_size)
+        ).fetchall()
+      if not rows:
+        return
+      for rowid, src_path, dst_path, status, dst_existed in rows:
+        yield src_path, dst_path, json.loads(status), bool(dst_existed)
+
+  def completed(self):
+    """Number and size of the files recorded as copied or skipped."""
+    with self._lock:
+      self._flush()
+      count, size = self._conn.execute(
+        'SELECT COUNT(*), SUM(length) FROM files WHERE outcome IN (\'copied\', \'skipped\')'
+      ).fetchone()
+      return count, size or 0
+
+  def _flush(self):
+    # files must be added before their outcome is recorded
+    if self._added:
+      self._conn.executemany(
+        'INSERT OR REPLACE INTO files (src_path, dst_path, outcome, length, modification_time, dst_existed, status) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', self._added
+      )
+      self._added = []
+    if self._completed:
+      self._conn.executemany('UPDATE files SET outcome = ? WHERE src_path = ?', self._completed)
+      self._completed = []
+    # written with the outcomes of the files copied into them
+    if self._dirs:
+      self._conn.executemany('INSERT OR REPLACE INTO dirs (dst_path, src_path) VALUES (?, ?)', self._dirs)
+      self._dirs = []
+    self._conn.commit()
+
+  def flush(self):
+    """Write the pending updates to disk."""
+    with self._lock:
+      self._flush()
+
+  def close(self):
+    """Flush the pending updates and close the journal."""
+    with self._lock:
+      self._flush()
+      self._conn.close()
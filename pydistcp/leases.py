@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from threading import Condition, Lock, Thread, local
+import itertools
+import logging as lg
+import time
+
+_logger = lg.getLogger(__name__)
+
+class LeaseQueue(object):
+
+  """Work units handed to workers under leases, a unit whose worker stops
+  renewing its leases is handed to another worker.
+
+  :param timeout: Number of seconds without news from a worker after which
+    its leases expire.
+  :param maxsize: Maximum number of work units waiting for a worker, :meth:`put`
+    blocks until one is leased when it is reached.
+
+  Every request of a worker renews its leases. The expired work units are
+  handed again before the new ones, flagged as reassigned since their previous
+  worker may have partially copied them, and its results are then rejected.
+
+  """
+
+  def __init__(self, timeout=60.0, maxsize=1):
+    self.timeout = timeout
+    self._maxsize = max(maxsize, 1)
+    self._cond = Condition()
+    self._pending = deque()
+    self._leased = {}
+    self._seen = {}
+    self._lease_ids = itertools.count()
+    self._closed = False
+    self.expired = 0
+
+  def __repr__(self):
+    return '<%s(timeout=%r)>' % (self.__class__.__name__, self.timeout)
+
+  def put(self, work):
+    """Queue a work unit, waiting for room if the queue is full."""
+    with self._cond:
+      while len(self._pending) >= self._maxsize:
+        self._cond.wait(1)
+      self._pending.append((work, False))
+      self._cond.notify_all()
+
+  def close(self):
+    """Signal that no more work units will be queued."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def take(self, worker, timeout=1.0):
+    """Lease the next work unit to a worker.
+
+    :param worker: Worker identifier.
+    :param timeout: Number of seconds to wait for a work unit.
+
+    Returns a `(lease, work, reassigned)` tuple, `None` if no work unit is
+    available yet or `False` once none can be handed to the worker anymore:
+    all of them were queued and the ones not complete are its own, whose
+    failed files it copies again before completing them.
+    """
+    deadline = time.time() + timeout
+    with self._cond:
+      self._seen[worker] = time.time()
+      while not self._pending and not self._drained(worker):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return None
+        self._cond.wait(remaining)
+      if not self._pending:
+        return False
+      lease = next(self._lease_ids)
+      work, reassigned = self._pending.popleft()
+      self._leased[lease] = (worker, work)
+      self._cond.notify_all()
+      return lease, work, reassigned
+
+  def complete(self, worker, lease, accepted=None):
+    """Release the lease of a complete work unit, returns whether the worker
+    still held it.
+
+    :param worker: Worker identifier.
+    :param lease: Lease of the work unit.
+    :param accepted: Function called before the lease is released if the
+      worker held it, so that the result is handled before the job completes.
+    """
+    with self._cond:
+      self._seen[worker] = time.time()
+      if self._leased.get(lease, (None, ))[0] != worker:
+        return False
+      if accepted:
+        accepted()
+      del self._leased[lease]
+      self._cond.notify_all()
+      return True
+
+  def renew(self, worker):
+    """Renew the leases of a worker."""
+    with self._cond:
+      self._seen[worker] = time.time()
+
+  def expire(self):
+    """Hand again the work units of the workers without news for `timeout`
+    seconds, returns these workers."""
+    now = time.time()
+    with self._cond:
+      stale = set(worker for worker, seen in self._seen.items() if now - seen > self.timeout)
+      for worker in stale:
+        del self._seen[worker]
+      expired = sorted(lease for lease, (worker, _) in self._leased.items() if worker in stale)
+      for lease in reversed(expired):
+        self._pending.appendleft((self._leased.pop(lease)[1], True))
+      self.expired += len(expired)
+      if expired:
+        self._cond.notify_all()
+      return stale
+
+  def workers(self):
+    """Workers whose leases did not expire."""
+    with self._cond:
+      return set(self._seen)
+
+  def finished(self):
+    """Whether all the work units were queued and completed."""
+    with self._cond:
+      return self._closed and not self._pending and not self._leased
+
+  def _drained(self, worker):
+    # the leases of the other workers may still expire and be handed again
+    return self._closed and not self._pending and all(
+      holder == worker for holder, _ in self._leased.values()
+    )
+
+class LeaseServer(object):
+
+  """Serve a lease queue to remote workers over authenticated connections,
+  each request being a pickled tuple answered on the same connection.
+
+  :param address: `(host, port)` address to listen on, port `0` picks a free
+    one.
+  :param authkey: Secret shared with the workers.
+  :param job: Description of the job sent to every worker.
+  :param leases: :class:`LeaseQueue` of the job.
+  :param report: Function called with the messages of the workers: the
+    results of the work units whose lease they held, and any other message
+    they send (progress, statistics...).
+
+  """
+
+  def __init__(self, address, authkey, job, leases, report):
+    self.job = job
+    self.leases = leases
+    self._report = report
+    self._authkey = authkey
+    self._listener = Listener(address, authkey=authkey)
+    self.address = self._listener.address
+    self._worker_ids = itertools.count()
+    self._stopped = False
+
+  def __repr__(self):
+    return '<%s(address=%r)>' % (self.__class__.__name__, self.address)
+
+  def start(self):
+    """Accept the workers in the background."""
+    _logger.info('Waiting for workers on %s:%s.', *self.address)
+    _daemon(self._accept)
+
+  def stop(self):
+    """Stop accepting workers."""
+    self._stopped = True
+    try:
+      # wakes up the pending accept
+      Client(self.address, authkey=self._authkey).close()
+    except Exception: # pylint: disable=broad-except
+      pass
+
+  def _accept(self):
+    while not self._stopped:
+      try:
+        conn = self._listener.accept()
+      except Exception as err: # pylint: disable=broad-except
+        _logger.warn('Rejected a worker connection: %s', err)
+        continue
+      _daemon(self._serve, conn)
+    self._listener.close()
+
+  def _serve(self, conn):
+    try:
+      while True:
+        request = conn.recv()
+        conn.send(self._handle(request))
+    except EOFError:
+      pass
+    except Exception as err: # pylint: disable=broad-except
+      _logger.warn('Worker connection failed: %s', err)
+    finally:
+      conn.close()
+
+  def _handle(self, request):
+    operation = request[0]
+    if operation == 'hello':
+      worker = next(self._worker_ids)
+      self.leases.renew(worker)
+      _logger.info('Worker %s joined the job.', worker)
+      return worker, self.job
+    worker = request[1]
+    if operation == 'take':
+      return self.leases.take(worker)
+    if operation == 'complete':
+      lease, result = request[2:]
+      return self.leases.complete(worker, lease, lambda: self._report(('result', result)))
+    if operation == 'put':
+      self.leases.renew(worker)
+      self._report(request[2])
+      return None
+    if operation == 'renew':
+      self.leases.renew(worker)
+      return None
+    raise ValueError('Unknown request %r.' % (operation, ))
+
+class LeaseClient(object):
+
+  """Connections of a worker to the :class:`LeaseServer` of a coordinator,
+  one per thread so that a thread waiting for work does not delay the
+  results sent by the other ones.
+
+  :param address: `(host, port)` address of the coordinator.
+  :param authkey: Secret shared with the coordinator.
+
+  """
+
+  def __init__(self, address, authkey):
+    self.address = address
+    self.worker = None
+    self._authkey = authkey
+    self._local = local()
+    self._lock = Lock()
+    self._conns = []
+
+  def __repr__(self):
+    return '<%s(address=%r, worker=%r)>' % (self.__class__.__name__, self.address, self.worker)
+
+  def _call(self, *request):
+    conn = getattr(self._local, 'conn', None)
+    if conn is None:
+      conn = self._local.conn = Client(self.address, authkey=self._authkey)
+      with self._lock:
+        self._conns.append(conn)
+    conn.send(request)
+    return conn.recv()
+
+  def hello(self):
+    """Join the job, returns its description."""
+    self.worker, job = self._call('hello')
+    return job
+
+  def take(self):
+    """Lease the next work unit, see :meth:`LeaseQueue.take`."""
+    return self._call('take', self.worker)
+
+  def complete(self, lease, result):
+    """Send the result of a leased work unit, returns whether it was
+    accepted."""
+    return self._call('complete', self.worker, lease, result)
+
+  def put(self, message):
+    """Send a message to the coordinator, like to the results queue of a copy
+    process."""
+    self._call('put', self.worker, message)
+
+  def renew(self):
+    """Renew the leases of the worker."""
+    self._call('renew', self.worker)
+
+  def close(self):
+    """Close the connections."""
+    with self._lock:
+      for conn in self._conns:
+        conn.close()
+      self._conns = []
+
+# Helpers
+# -------
+
+def _daemon(target, *args):
+  thread = Thread(target=target, args=args)
+  thread.daemon = True
+  thread.start()
+  return thread
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from contextlib import contextmanager
+from pywhdfs.utils.utils import HdfsError
+import errno
+import grp
+import hashlib
+import logging as lg
+import mmap
+import os
+import os.path as osp
+import pwd
+import re
+import shutil
+import stat
+import struct
+import zlib
+
+try:
+  import crc32c as _crc32c
+except ImportError:
+  _crc32c = None
+
+_logger = lg.getLogger(__name__)
+
+# whether the missing crc32c module was reported
+_crc32c_warned = []
+
+class LocalClient(object):
+
+  """Client of the local file system, implementing the subset of the pywhdfs
+  client API used by :class:`~pydistcp.distclient.WebHDFSDistClient`, so that
+  local files are copied by the same engine, from or to a cluster.
+
+  :param block_size: Block size of the local files, their split parts are
+    rounded up to it. Defaults to the HDFS default block size.
+
+  Files are read through memory maps, the data handed to the destination
+  writes are views of the mapped pages rather than copies. Files can be
+  allocated at once then written by several threads at distinct offsets.
+
+  """
+
+  host_list = None
+
+  def __init__(self, block_size=2 ** 27):
+    self.block_size = block_size
+
+  def __repr__(self):
+    return '<%s(block_size=%r)>' % (self.__class__.__name__, self.block_size)
+
+  @property
+  def user(self):
+    """Name of the user the files are written as."""
+    return _user_name(os.geteuid())
+
+  def resolvepath(self, path):
+    """Return absolute, normalized path.
+
+    :param path: Local path.
+    """
+    return osp.abspath(osp.expanduser(path))
+
+  def status(self, path, strict=True):
+    """FileStatus of a local file or directory, as returned by WebHDFS.
+
+    :param path: Local path.
+    :param strict: If `False`, return `None` rather than raise an exception if
+      the path doesn't exist.
+    """
+    try:
+      return self._status(path, os.stat(path))
+    except OSError as err:
+      if err.errno == errno.ENOENT and not strict:
+        return None
+      raise HdfsError('Could not get the status of %r: %s', path, err)
+
+  def list(self, path, status=False):
+    """Names of the entries of a local directory, in name order.
+
+    :param path: Local directory path.
+    :param status: Also return their FileStatus.
+
+    Entries which are neither regular files nor directories are left out, as
+    are the broken links.
+    """
+    try:
+      names = sorted(os.listdir(path))
+    except OSError as err:
+      raise HdfsError('Could not list %r: %s', path, err)
+    entries = []
+    for name in names:
+      try:
+        entry_st = os.stat(osp.join(path, name))
+      except OSError:
+        _logger.warn('Skipping %r which can not be read.', osp.join(path, name))
+        continue
+      if stat.S_ISDIR(entry_st.st_mode) or stat.S_ISREG(entry_st.st_mode):
+        entries.append((name, self._status(osp.join(path, name), entry_st, name)))
+    if status:
+      return entries
+    return [name for name, _ in entries]
+
+  @contextmanager
+  def read(self, path, offset=0, length=None, buffer_size=None, chunk_size=None, progress=None, **kwargs):
+    """Read a local file.
+
+    :param path: Local path.
+    :param offset: Starting byte position.
+    :param length: Number of bytes to be read, `None` reads the remaining ones.
+    :param buffer_size: Unused, for compatibility with the pywhdfs clients.
+    :param chunk_size: If set to a positive number, the context manager
+      returns a generator yielding views of `chunk_size` bytes of the file
+      rather than a file-like object.
+    :param progress: Callback called with the path and the number of bytes
+      read so far after every chunk, then once with `-1`.
+    :param \*\*kwargs: Ignored pywhdfs read options.
+    """
+    if progress and not chunk_size:
+      raise ValueError('Progress callback requires a positive chunk size.')
+    view = _MappedRange(path, offset, length)
+    try:
+      if chunk_size:
+        yield view.chunks(chunk_size, progress)
+      else:
+        yield view
+    finally:
+      view.close()
+
+  def checksum(self, path, algorithm='MD5-of-0MD5-of-512CRC32C', block_size=None):
+    """Checksum of a local file as HDFS would compute it, `None` if its CRC
+    can not be computed here.
+
+    :param path: Local path.
+    :param algorithm: Algorithm of the HDFS checksum the local file is
+      compared to, which gives the number of bytes per CRC and the CRC type.
+    :param block_size: Block size of the HDFS file the local file is compared
+      to, defaults to the client one.
+    """
+    match = re.match(r'MD5-of-\d+MD5-of-(\d+)(CRC32C?)$', algorithm)
+    if match is None:
+      return None
+    bytes_per_crc, crc_type = int(match.group(1)), match.group(2)
+    if crc_type == 'CRC32C' and _crc32c is None:
+      if not _crc32c_warned:
+        _crc32c_warned.append(True)
+        _logger.warn('The crc32c module is required to compute %r checksums, local files are copied '
+                     'again instead of being compared with the cluster ones (pip install pydistcp[crc32c]).',
+                     algorithm)
+      return None
+    with self.read(path) as reader:
+      return file_checksum(reader.view, block_size or self.block_size, bytes_per_crc, crc_type)
+
+  def content(self, path):
+    """ContentSummary of a local directory, as returned by WebHDFS.
+
+    :param path: Local path.
+    """
+    summary = {'directoryCount': 0, 'fileCount': 0, 'length': 0}
+    for dir_path, _, names in os.walk(path):
+      summary['directoryCount'] += 1
+      summary['fileCount'] += len(names)
+      summary['length'] += sum(os.lstat(osp.join(dir_path, name)).st_size for name in names)
+    return summary
+
+  def makedirs(self, path, permission=None):
+    """Create a local directory and its missing parents.
+
+    :param path: Local path.
+    :param permission: Octal permission of the created directories.
+    """
+    try:
+      if permission:
+        os.makedirs(path, int(permission, 8))
+      else:
+        os.makedirs(path)
+    except OSError as err:
+      if err.errno != errno.EEXIST or not osp.isdir(path):
+        raise HdfsError('Could not create directory %r: %s', path, err)
+
+  def allocate(self, path, length, overwrite=False, permission=None):
+    """Create a local file of `length` bytes, written later at distinct
+    offsets by :meth:`write`.
+
+    :param path: Local path.
+    :param length: Length of the file.
+    :param overwrite: Replace an existing file.
+    :param permission: Octal permission of the file.
+    """
+    fd = self._open(path, os.O_CREAT | (os.O_TRUNC if overwrite else os.O_EXCL), permission)
+    try:
+      # sparse until written, without committing the disk space upfront
+      os.ftruncate(fd, length)
+    except OSError as err:
+      raise HdfsError('Could not allocate %r: %s', path, err)
+    finally:
+      os.close(fd)
+
+  def write(self, path, data, overwrite=False, permission=None, offset=None, **kwargs):
+    """Write a local file.
+
+    :param path: Local path.
+    :param data: String, buffer or memoryview, or iterable of them.
+    :param overwrite: Replace an existing file.
+    :param permission: Octal permission of the file, not subject to the
+      umask so that it does not need to be set again.
+    :param offset: Write the data at this position of a file created by
+      :meth:`allocate` rather than create the file.
+    :param \*\*kwargs: Ignored pywhdfs write options.
+    """
+    if offset is None:
+      fd = self._open(path, os.O_CREAT | (os.O_TRUNC if overwrite else os.O_EXCL), permission)
+    else:
+      fd = self._open(path, 0)
+    try:
+      if offset:
+        # every writer has its own descriptor, so seeking then writing does
+        # not move the other ones
+        os.lseek(fd, offset, os.SEEK_SET)
+      if isinstance(data, (str, buffer, bytearray, memoryview)):
+        data = [data]
+      for chunk in data:
+        _write(fd, chunk)
+    except OSError as err:
+      raise HdfsError('Could not write %r: %s', path, err)
+    finally:
+      os.close(fd)
+
+  def delete(self, path, recursive=False):
+    """Remove a local file or directory, returns `False` if it does not
+    exist.
+
+    :param path: Local path.
+    :param recursive: Remove a non empty directory and its content.
+    """
+    try:
+      if osp.isdir(path) and not osp.islink(path):
+        if recursive:
+          shutil.rmtree(path)
+        else:
+          os.rmdir(path)
+      else:
+        os.remove(path)
+    except OSError as err:
+      if err.errno == errno.ENOENT:
+        return False
+      raise HdfsError('Could not delete %r: %s', path, err)
+    return True
+
+  def rename(self, path, destination):
+    """Move a local file or directory.
+
+    :param path: Local path.
+    :param destination: New local path.
+    """
+    try:
+      os.rename(path, destination)
+    except OSError as err:
+      raise HdfsError('Could not rename %r to %r: %s', path, destination, err)
+
+  def set_owner(self, path, owner=None, group=None):
+    """Change the owner and group of a local file.
+
+    :param path: Local path.
+    :param owner: User name, unchanged if `None`.
+    :param group: Group name, unchanged if `None`.
+    """
+    try:
+      uid = pwd.getpwnam(owner).pw_uid if owner else -1
+      gid = grp.getgrnam(group).gr_gid if group else -1
+      os.chown(path, uid, gid)
+    except (KeyError, OSError) as err:
+      raise HdfsError('Could not set the owner of %r: %s', path, err)
+
+  def set_permission(self, path, permission):
+    """Change the permission of a local file.
+
+    :param path: Local path.
+    :param permission: Octal permission string.
+    """
+    try:
+      os.chmod(path, int(permission, 8))
+    except OSError as err:
+      raise HdfsError('Could not set the permission of %r: %s', path, err)
+
+  def set_times(self, path, access_time=None, modification_time=None):
+    """Change the times of a local file.
+
+    :param path: Local path.
+    :param access_time: Access time in milliseconds, unchanged if `None`.
+    :param modification_time: Modification time in milliseconds, unchanged if
+      `None`.
+    """
+    try:
+      path_st = os.stat(path)
+      os.utime(path, (
+        path_st.st_atime if access_time is None else access_time / 1000.0,
+        path_st.st_mtime if modification_time is None else modification_time / 1000.0,
+      ))
+    except OSError as err:
+      raise HdfsError('Could not set the times of %r: %s', path, err)
+
+  def _open(self, path, flags, permission=None):
+    try:
+      fd = os.open(path, os.O_WRONLY | flags, 0o666)
+    except OSError as err:
+      raise HdfsError('Could not open %r for writing: %s', path, err)
+    if permission:
+      try:
+        os.fchmod(fd, int(permission, 8))
+      except OSError as err:
+        os.close(fd)
+        raise HdfsError('Could not set the permission of %r: %s', path, err)
+    return fd
+
+  def _status(self, path, path_st, name=''):
+    is_dir = stat.S_ISDIR(path_st.st_mode)
+    return {
+      'pathSuffix'       : name,
+      'type'             : 'DIRECTORY' if is_dir else 'FILE',
+      'length'           : 0 if is_dir else path_st.st_size,
+      'blockSize'        : 0 if is_dir else self.block_size,
+      'replication'      : 0,
+      'permission'       : '%o' % (stat.S_IMODE(path_st.st_mode) & 0o1777, ),
+      'owner'            : _user_name(path_st.st_uid),
+      'group'            : _group_name(path_st.st_gid),
+      'accessTime'       : int(round(path_st.st_atime * 1000)),
+      'modificationTime' : int(round(path_st.st_mtime * 1000)),
+    }
+
+def file_checksum(data, block_size, bytes_per_crc=512, crc_type='CRC32C'):
+  """HDFS MD5 of MD5 of CRC checksum of some data, as returned by the
+  GETFILECHECKSUM operation.
+
+  :param data: Buffer of the file content.
+  :param block_size: Block size of the file.
+  :param bytes_per_crc: Number of bytes covered by every CRC.
+  :param crc_type: `CRC32` or `CRC32C`, the latter requires the `crc32c`
+    module.
+
+  Every block is summarised by the MD5 of the CRCs of its chunks, the file by
+  the MD5 of the blocks ones.
+  """
+  crc = _crc32c.crc32c if crc_type == 'CRC32C' else zlib.crc32
+  length = len(data)
+  blocks_md5 = hashlib.md5()
+  for block_start in range(0, length, block_size) or [0]:
+    block_end = min(block_start + block_size, length)
+    crcs = [
+      crc(buffer(data, offset, min(bytes_per_crc, block_end - offset))) & 0xffffffff
+      for offset in range(block_start, block_end, bytes_per_crc)
+    ]
+    blocks_md5.update(hashlib.md5(struct.pack('>%sI' % (len(crcs), ), *crcs)).digest())
+  # the number of CRCs per block is only set for files of several blocks
+  crc_per_block = block_size // bytes_per_crc if length > block_size else 0
+  return {
+    'algorithm' : 'MD5-of-%sMD5-of-%s%s' % (crc_per_block, bytes_per_crc, crc_type),
+    'bytes'     : (struct.pack('>iq', bytes_per_crc, crc_per_block) + blocks_md5.digest()).encode('hex'),
+    'length'    : 28,
+  }
+
+# Helpers
+# -------
+
+class _MappedRange(object):
+
+  """Byte range of a local file mapped in memory, empty ranges are not
+  mapped.
+
+  :param path: Local path.
+  :param offset: Starting byte position.
+  :param length: Number of bytes, `None` for the remaining ones.
+
+  """
+
+  def __init__(self, path, offset=0, length=None):
+    self.path = path
+    self.view = buffer('')
+    self._position = 0
+    with open(path, 'rb') as reader:
+      size = os.fstat(reader.fileno()).st_size
+      end = size if length is None else min(size, offset + length)
+      if end > offset:
+        # maps start at a multiple of the allocation granularity
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(reader.fileno(), end - start, access=mmap.ACCESS_READ, offset=start)
+        self.view = buffer(mapped, offset - start, end - offset)
+
+  def read(self, size=-1):
+    """Copy of the next `size` bytes, all the remaining ones by default."""
+    end = len(self.view) if size < 0 else min(self._position + size, len(self.view))
+    data = self.view[self._position:end]
+    self._position = end
+    return data
+
+  def readinto(self, target):
+    """Copy the next bytes into a writable buffer, returns their number."""
+    data = self.read(len(target))
+    target[:len(data)] = data
+    return len(data)
+
+  def chunks(self, size, progress=None):
+    """Generator of views of the next chunks of `size` bytes."""
+    while self._position < len(self.view):
+      chunk = buffer(self.view, self._position, size)
+      self._position += len(chunk)
+      yield chunk
+      if progress:
+        progress(self.path, self._position)
+    if progress:
+      progress(self.path, -1)
+
+  def close(self):
+    """Release the view, the memory is unmapped once the views of its
+    chunks are released too."""
+    self.view = buffer('')
+
+def _write(fd, data):
+  """Write all the bytes of a string, buffer or memoryview to a file
+  descriptor, the remaining bytes of partial writes are not copied."""
+  written = os.write(fd, data)
+  while written < len(data):
+    remaining = buffer(data, written) if isinstance(data, buffer) else memoryview(data)[written:]
+    written += os.write(fd, remaining)
+
+def _user_name(uid):
+  try:
+    return pwd.getpwuid(uid).pw_name
+  except KeyError:
+    return str(uid)
+
+def _group_name(gid):
+  try:
+    return grp.getgrgid(gid).gr_name
+  except KeyError:
+    return str(gid)
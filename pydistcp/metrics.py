@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from bisect import bisect_left
+from threading import Lock, local
+import logging as lg
+import os
+import re
+import time
+
+_logger = lg.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets, the last one is infinite
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class JobMetrics(object):
+
+  """Timing histograms of the phases of a copy job.
+
+  :param detailed: Also keep the time spent in every phase by every file,
+    which costs memory proportional to the number of files.
+  :param buckets: Upper bounds of the histogram buckets, in seconds.
+
+  Every thread records its durations in its own histograms, which are only
+  aggregated when reported, so that the threads never wait for each other
+  unless `detailed` is set.
+
+  """
+
+  def __init__(self, detailed=False, buckets=BUCKETS):
+    self.detailed = detailed
+    self.buckets = tuple(buckets)
+    self._lock = Lock()
+    self._local = local()
+    self._histograms = []
+    self._merged = {}
+    self._files = {}
+
+  def __repr__(self):
+    return '<%s(detailed=%r)>' % (self.__class__.__name__, self.detailed)
+
+  def _thread_histograms(self):
+    try:
+      return self._local.histograms
+    except AttributeError:
+      histograms = self._local.histograms = {}
+      with self._lock:
+        self._histograms.append(histograms)
+      return histograms
+
+  def observe(self, phase, duration, path=None):
+    """Record the duration of a phase.
+
+    :param phase: Name of the phase.
+    :param duration: Duration in seconds.
+    :param path: Path of the file the phase belongs to.
+    """
+    histograms = self._thread_histograms()
+    histogram = histograms.get(phase)
+    if histogram is None:
+      # count, sum, max and the counts of the buckets
+      histogram = histograms[phase] = [0, 0.0, 0.0] + [0] * (len(self.buckets) + 1)
+    histogram[0] += 1
+    histogram[1] += duration
+    if duration > histogram[2]:
+      histogram[2] = duration
+    histogram[3 + bisect_left(self.buckets, duration)] += 1
+    if self.detailed and path is not None:
+      with self._lock:
+        phases = self._files.setdefault(path, {})
+        phases[phase] = phases.get(phase, 0.0) + duration
+
+  def timed(self, phase, path=None):
+    """Context manager recording the duration of its block.
+
+    :param phase: Name of the phase.
+    :param path: Path of the file the phase belongs to.
+    """
+    return _Timer(self, phase, path)
+
+  def state(self):
+    """Aggregated histograms and file timings, to be merged in the metrics of
+    another process."""
+    with self._lock:
+      merged = dict((phase, list(histogram)) for phase, histogram in self._merged.items())
+      for histograms in self._histograms:
+        for phase, histogram in histograms.items():
+          _add(merged, phase, histogram)
+      return {'histograms': merged, 'files': dict(self._files)}
+
+  def merge(self, state):
+    """Add the metrics of another process.
+
+    :param state: :meth:`state` of the other process.
+    """
+    with self._lock:
+      for phase, histogram in state['histograms'].items():
+        _add(self._merged, phase, histogram)
+      self._files.update(state['files'])
+
+  def report(self):
+    """Phases section of the job status."""
+    state = self.state()
+    report = {}
+    for phase, histogram in state['histograms'].items():
+      count, total, longest = histogram[:3]
+      cumulated = 0
+      buckets = {}
+      for bound, bucket_count in zip(self.buckets + ('+Inf', ), histogram[3:]):
+        cumulated += bucket_count
+        buckets[str(bound)] = cumulated
+      report[phase] = {
+        'Count'   : count,
+        'Total'   : total,
+        'Mean'    : total / count if count else 0.0,
+        'Max'     : longest,
+        'Buckets' : buckets,
+      }
+    return report
+
+  def files(self):
+    """Seconds spent by every file in each phase, if `detailed`."""
+    with self._lock:
+      return dict(self._files)
+
+  def prometheus(self, requests, totals, labels=None):
+    """Text exposition format of the metrics.
+
+    :param requests: Number of requests per cluster and operation.
+    :param totals: Job totals, exported as gauges.
+    :param labels: Labels added to every sample.
+    """
+    def _labels(**extra):
+      pairs = sorted(dict(labels or {}, **extra).items())
+      return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) if pairs else ''
+
+    lines = [
+      '# HELP pydistcp_phase_seconds Duration of the phases of the copy job.',
+      '# TYPE pydistcp_phase_seconds histogram',
+    ]
+    for phase, histogram in sorted(self.state()['histograms'].items()):
+      name = _metric_name(phase)
+      cumulated = 0
+      for bound, bucket_count in zip(self.buckets + ('+Inf', ), histogram[3:]):
+        cumulated += bucket_count
+        lines.append('pydistcp_phase_seconds_bucket%s %s' % (_labels(phase=name, le=bound), cumulated))
+      lines.append('pydistcp_phase_seconds_sum%s %r' % (_labels(phase=name), histogram[1]))
+      lines.append('pydistcp_phase_seconds_count%s %s' % (_labels(phase=name), histogram[0]))
+    lines.extend([
+      '# HELP pydistcp_requests_total WebHDFS requests sent to the namenodes.',
+      '# TYPE pydistcp_requests_total counter',
+    ])
+    for cluster, counts in sorted(requests.items()):
+      for operation, count in sorted(counts.items()):
+        lines.append('pydistcp_requests_total%s %s' % (_labels(cluster=_metric_name(cluster), op=operation), count))
+    for name, value in sorted(totals.items()):
+      metric = 'pydistcp_%s' % (_metric_name(name), )
+      lines.extend(['# TYPE %s gauge' % (metric, ), '%s%s %r' % (metric, _labels(), value)])
+    return '\n'.join(lines) + '\n'
+
+  def write_prometheus(self, path, requests, totals, labels=None):
+    """Write the text exposition format to a file, atomically so that a
+    collector never reads a partial file.
+
+    :param path: Path of the file.
+    :param requests: Number of requests per cluster and operation.
+    :param totals: Job totals, exported as gauges.
+    :param labels: Labels added to every sample.
+    """
+    tmp_path = '%s.tmp' % (path, )
+    with open(tmp_path, 'w') as writer:
+      writer.write(self.prometheus(requests, totals, labels))
+    os.rename(tmp_path, path)
+
+class RequestCounter(object):
+
+  """Number of WebHDFS requests sent by a client, per operation."""
+
+  def __init__(self):
+    self._lock = Lock()
+    self._counts = {}
+
+  def add(self, operation):
+    """Count a request."""
+    with self._lock:
+      self._counts[operation] = self._counts.get(operation, 0) + 1
+
+  def snapshot(self):
+    """Current counts."""
+    with self._lock:
+      return dict(self._counts)
+
+def count_requests(client):
+  """Counter of the requests sent by a pywhdfs client through its
+  `_api_request` method, installed the first time.
+
+  :param client: pywhdfs client.
+  """
+  counter = getattr(client, '_request_counter', None)
+  if counter is None:
+    counter = client._request_counter = RequestCounter()
+    api_request = client._api_request
+
+    def _api_request(*args, **kwargs):
+      params = kwargs.get('params') if 'params' in kwargs else args[1] if len(args) > 1 else None
+      counter.add(str((params or {}).get('op', 'UNKNOWN')).upper())
+      return api_request(*args, **kwargs)
+
+    client._api_request = _api_request
+  return counter
+
+def count_difference(after, before):
+  """Counts added between two snapshots."""
+  return dict(
+    (operation, count - before.get(operation, 0))
+    for operation, count in after.items()
+    if count != before.get(operation, 0)
+  )
+
+class RequestTimer(object):
+
+  """Duration of the WebHDFS requests sent by a client, passed to the
+  functions listening to them."""
+
+  def __init__(self):
+    self._lock = Lock()
+    self._listeners = []
+
+  def add_listener(self, listener):
+    """Call `listener` with the duration of every request, in seconds."""
+    with self._lock:
+      self._listeners = self._listeners + [listener]
+
+  def remove_listener(self, listener):
+    """Stop calling `listener`."""
+    with self._lock:
+      self._listeners = [other for other in self._listeners if other is not listener]
+
+  def observe(self, duration):
+    """Pass the duration of a request to the listeners."""
+    for listener in self._listeners:
+      listener(duration)
+
+def time_requests(client):
+  """Timer of the requests sent by a pywhdfs client through its
+  `_api_request` method, installed the first time. Requests failing before
+  the cluster answered are not timed.
+
+  :param client: pywhdfs client.
+  """
+  timer = getattr(client, '_request_timer', None)
+  if timer is None:
+    timer = client._request_timer = RequestTimer()
+    api_request = client._api_request
+
+    def _api_request(*args, **kwargs):
+      start = time.time()
+      response = api_request(*args, **kwargs)
+      timer.observe(time.time() - start)
+      return response
+
+    client._api_request = _api_request
+  return timer
+
+# Helpers
+# -------
+
+class _Timer(object):
+
+  def __init__(self, metrics, phase, path):
+    self._metrics = metrics
+    self._phase = phase
+    self._path = path
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._metrics.observe(self._phase, time.time() - self._start, self._path)
+
+class _NullTimer(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    pass
+
+NULL_TIMER = _NullTimer()
+
+def _add(histograms, phase, histogram):
+  current = histograms.get(phase)
+  if current is None:
+    histograms[phase] = list(histogram)
+    return
+  current[0] += histogram[0]
+  current[1] += histogram[1]
+  current[2] = max(current[2], histogram[2])
+  for index in range(3, len(histogram)):
+    current[index] += histogram[index]
+
+def _metric_name(name):
+  return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+def _escape(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from itertools import chain
+from threading import Lock, local
+import logging as lg
+import requests as rq
+
+_logger = lg.getLogger(__name__)
+
+# Policies choosing the host of a nameservice every request is sent to
+SPREAD_POLICIES = ('first', 'round-robin', 'least-outstanding')
+
+# Number of hosts whose connections are kept, the reads and writes are
+# redirected to many datanodes.
+_HOST_POOLS = 256
+
+class ClientConnections(object):
+
+  """Connection pools of a pywhdfs client, sized to the number of threads
+  sending requests through it, and the hosts of its nameservices the requests
+  are spread across.
+
+  :param client: pywhdfs client.
+
+  The pools replace the ones of the client session, so that up to `size`
+  connections to every host are kept alive instead of being closed once
+  returned to a full pool. The requests sent and the connections opened by
+  every pool are counted, including the ones of the pools already closed.
+
+  """
+
+  def __init__(self, client):
+    self._client = client
+    self._lock = Lock()
+    self._adapters = []
+    # requests and connections of the closed pools
+    self._closed = [0, 0]
+    self.size = 0
+    self.hosts = HostSpreader(client.host_list)
+    client.host_list = self.hosts
+    self.hosts.track(client)
+
+  def __repr__(self):
+    return '<%s(size=%r, policy=%r)>' % (self.__class__.__name__, self.size, self.hosts.policy)
+
+  def resize(self, size):
+    """Keep up to `size` connections to every host, the pools are only
+    replaced when they grow so that their connections are not lost."""
+    if size <= self.size:
+      return
+    adapter = rq.adapters.HTTPAdapter(max_retries=5, pool_connections=max(size, _HOST_POOLS), pool_maxsize=size)
+    pools = adapter.poolmanager.pools
+    dispose = pools.dispose_func
+
+    def _dispose(pool):
+      with self._lock:
+        self._closed[0] += pool.num_requests
+        self._closed[1] += pool.num_connections
+      dispose(pool)
+
+    pools.dispose_func = _dispose
+    with self._lock:
+      self._adapters.append(adapter)
+    self._client._session.mount('http://', adapter)
+    self._client._session.mount('https://', adapter)
+    self.size = size
+    _logger.debug('Keeping up to %s connections to every host of %r.', size, self._client)
+
+  def warm_up(self, count):
+    """Open up to `count` connections to every host the requests are sent to,
+    returns the number of connections opened.
+
+    Unlike the connections opened by the requests, their TCP and TLS
+    handshakes happen before the copy starts, at the same time.
+    """
+    adapter = self._client._session.get_adapter('http://')
+    verify = getattr(self._client, '_verify', True)
+    opened = 0
+    for host in self.hosts.targets():
+      try:
+        pool = adapter.get_connection(host)
+        adapter.cert_verify(pool, host, verify, None)
+        conns = []
+        try:
+          for _ in range(min(count, self.size)):
+            conn = pool._get_conn()
+            conns.append(conn)
+            if conn.sock is None:
+              conn.connect()
+              opened += 1
+        finally:
+          for conn in conns:
+            pool._put_conn(conn)
+      except Exception as err: # pylint: disable=broad-except
+        _logger.warn('Failed to open connections to %s: %s', host, err)
+    return opened
+
+  def snapshot(self):
+    """Requests sent and connections opened by the pools, and requests sent to
+    every host of the nameservices."""
+    with self._lock:
+      n_requests, n_connections = self._closed
+      adapters = list(self._adapters)
+    for adapter in adapters:
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+          n_requests += pool.num_requests
+          n_connections += pool.num_connections
+    return {'Requests': n_requests, 'Connections': n_connections, 'Hosts': self.hosts.counts()}
+
+def configure_pools(client, size, policy='first'):
+  """Connection pools of a pywhdfs client, installed the first time.
+
+  :param client: pywhdfs client.
+  :param size: Number of connections kept alive to every host.
+  :param policy: How the requests are spread across the hosts of a
+    nameservice, see :class:`HostSpreader`.
+  """
+  connections = getattr(client, '_connections', None)
+  if connections is None:
+    connections = client._connections = ClientConnections(client)
+  connections.resize(size)
+  connections.hosts.policy = policy
+  return connections
+
+def connections_difference(after, before):
+  """Requests and connections added between two snapshots."""
+  return {
+    'Requests'    : after['Requests'] - before['Requests'],
+    'Connections' : after['Connections'] - before['Connections'],
+    'Hosts'       : dict(
+      (host, count - before['Hosts'].get(host, 0))
+      for host, count in after['Hosts'].items()
+      if count != before['Hosts'].get(host, 0)
+    ),
+  }
+
+def connections_report(connections, counts, warmed=0):
+  """Connections section of the job status.
+
+  :param connections: :class:`ClientConnections` of a client.
+  :param counts: Requests and connections of the job, see
+    :func:`connections_difference`.
+  :param warmed: Number of connections opened before the copy started.
+  """
+  n_requests = counts['Requests']
+  return {
+    'Pool Size'   : connections.size,
+    'Spread'      : connections.hosts.policy,
+    'Warmed Up'   : warmed,
+    'Requests'    : n_requests,
+    'Connections' : counts['Connections'],
+    # share of the requests sent on a connection already open
+    'Hit Rate'    : max(n_requests - counts['Connections'], 0) / float(n_requests) if n_requests else None,
+    'Hosts'       : counts['Hosts'],
+  }
+
+class HostSpreader(object):
+
+  """Hosts list of a pywhdfs client sending every request to a host of its
+  nameservice chosen by a policy.
+
+  :param host_list: `SyncHostsList` of the client.
+  :param policy: `first` sends the requests to the first host, which is only
+    switched when it is a standby namenode, `round-robin` to every host in turn
+    and `least-outstanding` to the host with the least requests in progress.
+
+  Spreading the requests is meant for nameservices whose hosts all serve them,
+  like several HttpFS gateways. The requests sent to every host are counted.
+
+  """
+
+  def __init__(self, host_list, policy='first'):
+    self.policy = policy
+    self._host_list = host_list
+    self._lock = Lock()
+    self._local = local()
+    self._turns = {}
+    self._outstanding = {}
+    self._counts = {}
+
+  def __repr__(self):
+    return repr(self._host_list)
+
+  def __getattr__(self, name):
+    # the other attributes of the hosts list, like its nameservices
+    if name == '_host_list':
+      raise AttributeError(name)
+    return getattr(self._host_list, name)
+
+  def get_host_count(self, hdfs_path):
+    return self._host_list.get_host_count(hdfs_path)
+
+  def switch_active_host(self, url, hdfs_path):
+    return self._host_list.switch_active_host(url, hdfs_path)
+
+  def resolve_hosts_from_path(self, hdfs_path):
+    return self._host_list.resolve_hosts_from_path(hdfs_path)
+
+  def get_active_host(self, hdfs_path):
+    with self._host_list.lock:
+      hosts = list(self._host_list.resolve_hosts_from_path(hdfs_path))
+    with self._lock:
+      if self.policy == 'first' or len(hosts) == 1:
+        host = hosts[0]
+      else:
+        key = tuple(sorted(hosts))
+        turn = self._turns.get(key, 0)
+        self._turns[key] = turn + 1
+        hosts = hosts[turn % len(hosts):] + hosts[:turn % len(hosts)]
+        if self.policy == 'least-outstanding':
+          # the hosts are tried in turn when as busy
+          host = min(hosts, key=lambda _host: self._outstanding.get(_host, 0))
+        else:
+          host = hosts[0]
+      self._outstanding[host] = self._outstanding.get(host, 0) + 1
+      self._counts[host] = self._counts.get(host, 0) + 1
+    taken = getattr(self._local, 'taken', None)
+    if taken is not None:
+      taken.append(host)
+    return host
+
+  def track(self, client):
+    """Count the requests in progress on every host, from the hosts taken by
+    the `_api_request` method of a client until it returns."""
+    api_request = client._api_request
+
+    def _api_request(*args, **kwargs):
+      taken = self._local.taken = []
+      try:
+        return api_request(*args, **kwargs)
+      finally:
+        self._local.taken = None
+        with self._lock:
+          for host in taken:
+            self._outstanding[host] -= 1
+
+    client._api_request = _api_request
+
+  def targets(self):
+    """Hosts the requests are sent to."""
+    nameservices = self._host_list.nameservices
+    with self._host_list.lock:
+      if self.policy == 'first':
+        return [nameservice['urls'][0] for nameservice in nameservices]
+      return list(chain.from_iterable(nameservice['urls'] for nameservice in nameservices))
+
+  def counts(self):
+    """Number of requests sent to every host."""
+    with self._lock:
+      return dict(self._counts)
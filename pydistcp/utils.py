@@ -2,11 +2,12 @@
 # encoding: utf-8
 
 from pywhdfs.utils import hglob
-from threading import Lock
+from threading import Lock, current_thread, local
 from progressbar import AnimatedMarker, Bar, FileTransferSpeed, Percentage, ProgressBar, RotatingMarker, Timer
 import os.path as osp
 import os
 import sys
+import time
 import glob
 import fnmatch
 
@@ -17,45 +18,116 @@ class _Progress(object):
   :param nbytes: Total number of bytes that will be transferred.
   :param nfiles: Total number of files that will be transferred.
     Defaults to standard error.
+  :param interval: Minimum number of seconds between two renderings of the
+    progress bar.
+
+  The cost of a callback does not depend on the number of files: every thread
+  keeps running totals which are only aggregated when the progress bar is
+  rendered, and a file is reported by a single thread at a time. The totals
+  of the threads which ended are folded into a common one when rendering.
 
   """
 
-  def __init__(self, nbytes, nfiles):
+  def __init__(self, nbytes, nfiles, interval=0.1):
     self._total_bytes = nbytes
-    self._pending_files = nfiles
-    self._transferring_files = 0
-    self._complete_files = 0
+    self._total_files = nfiles
+    self._interval = interval
+    self._next_render = 0
+    # Registers the threads counters, serializes the rendering and the
+    # growth of the totals, shared by the scans of a batch of jobs
     self._lock = Lock()
-    self._data = {}
+    self._local = local()
+    self._counters = {}
+    self._ended = [0, 0, 0]
+    # Bytes reported so far for the files being transferred
+    self._offsets = {}
+    self._offsets_lock = Lock()
 
     widgets = ['Progress: ', Percentage(), ' ', Bar(left='[',right=']'),
                ' ', Timer(format='Time: %s'), ' ', FileTransferSpeed()]
 
-    if self._total_bytes > 0:
-      self.pbar = ProgressBar(widgets=widgets, maxval=self._total_bytes).start()
-    else:
-      self.pbar = ProgressBar(widgets=widgets, maxval=nfiles).start()
+    self.pbar = ProgressBar(widgets=widgets, maxval=max(self._total_bytes or nfiles, 1)).start()
 
-  def __call__(self, hdfs_path, nbytes):
-    # TODO: Improve lock granularity.
+  def expand(self, nbytes, nfiles):
+    """Add the files found by the scan of the copy to the totals.
+
+    :param nbytes: Number of bytes found.
+    :param nfiles: Number of files found.
+    """
     with self._lock:
-      data = self._data
-      if hdfs_path not in data:
-        self._pending_files -= 1
-        self._transferring_files += 1
+      self._total_bytes += nbytes
+      self._total_files += nfiles
+
+  def _counter(self):
+    """Running totals of the current thread: bytes, files started and files
+    complete."""
+    try:
+      return self._local.counter
+    except AttributeError:
+      counter = self._local.counter = [0, 0, 0]
+      with self._lock:
+        self._counters[current_thread()] = counter
+      return counter
+
+  def __call__(self, hdfs_path, nbytes):
+    counter = self._counter()
+    with self._offsets_lock:
+      offset = self._offsets.get(hdfs_path)
       if nbytes == -1:
-        self._transferring_files -= 1
-        self._complete_files += 1
-      else:
-        data[hdfs_path] = nbytes
-      if self._total_bytes:
-        self.pbar.update(sum(data.values()))
+        self._offsets.pop(hdfs_path, None)
       else:
-        self.pbar.update(self._complete_files)
+        self._offsets[hdfs_path] = nbytes
+    if offset is None:
+      counter[1] += 1
+      offset = 0
+    if nbytes == -1:
+      counter[2] += 1
+    else:
+      counter[0] += nbytes - offset
+
+    now = time.time()
+    if now >= self._next_render and self._lock.acquire(False):
+      # other threads do not wait for the rendering
+      try:
+        self._next_render = now + self._interval
+        self._render()
+      finally:
+        self._lock.release()
+
+  def _render(self):
+    if not self.pbar:
+      # finished
+      return
+    for thread, counter in self._counters.items():
+      if not thread.is_alive():
+        del self._counters[thread]
+        for index, count in enumerate(counter):
+          self._ended[index] += count
+    index = 0 if self._total_bytes else 2
+    value = self._ended[index] + sum(counter[index] for counter in self._counters.values())
+    maxval = max(self._total_bytes or self._total_files, 1)
+    if maxval != self.pbar.maxval:
+      # the totals grow as the scan goes on
+      self.pbar.maxval = maxval
+      self.pbar.update_interval = maxval / self.pbar.num_intervals
+    self.pbar.update(min(value, maxval))
+
+  def finish(self):
+    """Render the final state of the progress bar, once."""
+    with self._lock:
+      if self.pbar:
+        self._render()
+        self.pbar.finish()
+        self.pbar = None
 
   def __del__(self):
-    if self.pbar:
-      self.pbar.finish()
+    self.finish()
+
+  @classmethod
+  def from_scan(cls):
+    """Instantiate with empty totals, grown by the scan of the copy through
+    :meth:`expand`."""
+    return cls(0, 0)
 
   @classmethod
   def from_hdfs(cls, client, hdfs_path):
@@ -53,6 +53,10 @@ setup(
     'pywhdfs>=1.0.0',
     'progressbar>=2.0'
   ],
+  extras_require={
+    # checksums of local files comparable with the HDFS default ones
+    'crc32c': ['crc32c'],
+  },
   entry_points={'console_scripts': 
      [ 'pydistcp = pydistcp.__main__:main' ]
   },
@@ -0,0 +1,683 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Test the distributed copy client, its copies run between fake clusters."""
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock, Thread
+import cPickle as pickle
+import os.path as osp
+import sys
+import time
+import unittest
+
+sys.path.insert(0, osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'benchmarks'))
+
+from fakehdfs import FakeCluster, client
+from pywhdfs.client import create_client
+from pywhdfs.utils.utils import HdfsError
+from pydistcp import distclient
+from pydistcp.distclient import (
+  WebHDFSDistClient, _Budget, _Concurrency, _DirCache, _FileStatus, _ScheduleStats, _SplitFile,
+  _WorkQueue, _file_copy, _merge_listings
+)
+from pydistcp.journal import CopyJournal
+
+def _status(length, block_size=128):
+  return _FileStatus('FILE', length, block_size, 3, '644', 'hdfs', 'supergroup', 0, 0)
+
+def _wait_until(condition, timeout=5):
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      raise AssertionError('Timed out.')
+    time.sleep(0.01)
+
+class TestMergeListings(unittest.TestCase):
+
+  def test_merge(self):
+    merged = list(_merge_listings(
+      [('b', 1), ('d', 2), ('a', 3)],
+      [('c', 4), ('b', 5), ('e', 6)],
+    ))
+    self.assertEqual(merged, [
+      ('a', 3, None), ('b', 1, 5), ('c', None, 4), ('d', 2, None), ('e', None, 6),
+    ])
+
+  def test_empty(self):
+    self.assertEqual(list(_merge_listings([], [])), [])
+    self.assertEqual(list(_merge_listings([('a', 1)], [])), [('a', 1, None)])
+    self.assertEqual(list(_merge_listings([], [('a', 1)])), [('a', None, 1)])
+
+class TestWorkQueue(unittest.TestCase):
+
+  def test_priority(self):
+    queue = _WorkQueue(10, lambda work: -work[0])
+    for work in [(1, 'a'), (3, 'b'), (1, 'c'), (2, 'd')]:
+      queue.put(work)
+    queue.close()
+    # largest first, ties in insertion order
+    self.assertEqual(list(iter(queue.get, None)), [(3, 'b'), (2, 'd'), (1, 'a'), (1, 'c')])
+    self.assertIsNone(queue.get())
+
+  def test_packed_files(self):
+    queue = _WorkQueue(10, lambda work: 1)
+    dst_status = _status(7)._replace(owner=u'h\xe9', modification_time=2 ** 40)
+    works = [
+      _file_copy('/data/a', '/copy/a', _status(3), None),
+      _file_copy(u'/data/\xe9t\xe9', u'/copy/\xe9t\xe9', _status(2 ** 40), dst_status),
+      _file_copy('/data/b', u'/copy/\xe9', _status(0), None),
+    ]
+    split = _SplitFile(works[0], 1)
+    for work in works[:2] + [(split, 0)] + works[2:]:
+      queue.put(work)
+    queue.close()
+    taken = list(iter(queue.get, None))
+    self.assertEqual(
+      [(work.src_path, work.dst_path, work.status, work.dst_status) for work in taken[:2] + taken[3:]],
+      [(work.src_path, work.dst_path, work.status, work.dst_status) for work in works],
+    )
+    self.assertIs(taken[2][0], split)
+    # the shared values are dropped once taken
+    self.assertEqual(queue._dirs._indices, {})
+    self.assertEqual(queue._attrs._indices, {})
+
+  def test_bounded(self):
+    queue = _WorkQueue(2, lambda work: work)
+    queued = []
+    def _put():
+      for work in range(4):
+        queue.put(work)
+        queued.append(work)
+      queue.close()
+    thread = Thread(target=_put)
+    thread.start()
+    _wait_until(lambda: len(queued) == 2)
+    time.sleep(0.05)
+    self.assertEqual(len(queued), 2)
+    self.assertEqual(queue.get(), 0)
+    _wait_until(lambda: len(queued) == 3)
+    self.assertEqual(list(iter(queue.get, None)), [1, 2, 3])
+    thread.join()
+
+class TestBudget(unittest.TestCase):
+
+  def test_jobs_in_turn(self):
+    budget = _Budget(1)
+    budget.acquire('a')
+    granted = []
+    def _acquire(job, name):
+      budget.acquire(job)
+      granted.append(name)
+    threads = []
+    for job, name in [('a', 'a1'), ('a', 'a2'), ('b', 'b1')]:
+      threads.append(Thread(target=_acquire, args=(job, name)))
+      threads[-1].start()
+      _wait_until(lambda: sum(len(waiters) for waiters in budget._waiters.values()) == len(threads))
+    for count in range(1, 4):
+      budget.release()
+      _wait_until(lambda: len(granted) == count)
+    for thread in threads:
+      thread.join()
+    # the jobs are granted the slot in turn, not in arrival order
+    self.assertEqual(granted, ['a1', 'b1', 'a2'])
+    report = budget.report()
+    self.assertEqual(report['Granted'], 4)
+    self.assertEqual(report['Peak Slots'], 1)
+
+class TestConcurrency(unittest.TestCase):
+
+  def _window(self, concurrency, nbytes=1000, nfiles=10, failed=False, retried=False, latency=0.01):
+    concurrency.record(nbytes, failed)
+    for _ in range(nfiles - 1):
+      concurrency.record(0, False)
+    if retried:
+      concurrency.retried('Transfer')
+    concurrency.latency(latency)
+    with concurrency._cond:
+      concurrency._adapt(concurrency._window_start + 1)
+    return concurrency.limit
+
+  def test_fixed(self):
+    concurrency = _Concurrency(4, 8, interval=0)
+    concurrency.record(1000, True)
+    concurrency.retried('Transfer')
+    self.assertEqual(concurrency.limit, 4)
+    self.assertEqual(concurrency.report(), {'Mode': 'fixed', 'Threads': 4})
+
+  def test_slow_start(self):
+    concurrency = _Concurrency(1, 6, adaptive=True, interval=3600)
+    self.assertEqual([self._window(concurrency) for _ in range(4)], [2, 4, 6, 6])
+
+  def test_failures(self):
+    concurrency = _Concurrency(1, 32, adaptive=True, interval=3600)
+    self._window(concurrency)
+    self._window(concurrency)
+    self.assertEqual(self._window(concurrency, failed=True), 2)
+    # no more slow start
+    self.assertEqual(self._window(concurrency), 3)
+    self.assertEqual(self._window(concurrency, retried=True), 1)
+    self.assertEqual(concurrency.timeline[-1]['Failures'], 1)
+
+  def test_latency(self):
+    concurrency = _Concurrency(1, 32, adaptive=True, interval=3600)
+    self._window(concurrency)
+    self._window(concurrency)
+    self.assertEqual(self._window(concurrency, latency=0.05), 3)
+    self.assertEqual(concurrency.timeline[-1]['Latency'], 0.05)
+
+  def test_rates_drop(self):
+    concurrency = _Concurrency(1, 32, adaptive=True, interval=3600)
+    self._window(concurrency)
+    self.assertEqual(self._window(concurrency, nbytes=500, nfiles=5), 1)
+    self.assertEqual(self._window(concurrency, nbytes=500, nfiles=5), 2)
+
+class TestDirCache(unittest.TestCase):
+
+  def setUp(self):
+    self.created = []
+    self.cache = _DirCache(self)
+
+  def makedirs(self, path):
+    time.sleep(0.05)
+    self.created.append(path)
+
+  def test_created_once(self):
+    threads = [Thread(target=self.cache.makedirs, args=('/a/b', )) for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.created, ['/a/b'])
+    self.assertTrue('/a' in self.cache)
+    self.cache.makedirs('/a')
+    self.assertEqual(self.created, ['/a/b'])
+
+  def test_on_create(self):
+    self.cache.add('/a')
+    created = []
+    self.cache.makedirs('/a/b/c', created.append)
+    self.assertEqual(created, ['/a/b', '/a/b/c'])
+
+class TestSplitFile(unittest.TestCase):
+
+  def setUp(self):
+    self.copy = _file_copy('/src/f', '/dst/f', _status(1000), None)
+
+  def test_parts(self):
+    split = _SplitFile(self.copy, 300)
+    # rounded up to whole blocks
+    self.assertEqual(split.parts, [(0, 384), (384, 384), (768, 232)])
+    split.tmp_path = '/dst/.f.tmp'
+    self.assertEqual(split.part_path(1), '/dst/.f.tmp.part-00001')
+    split.in_place = True
+    self.assertEqual(split.part_path(1), '/dst/.f.tmp')
+
+  def test_part_done(self):
+    split = _SplitFile(self.copy, 500)
+    self.assertFalse(split.part_done(True))
+    self.assertTrue(split.part_done(False))
+    self.assertTrue(split.failed)
+
+  def test_progress(self):
+    split = _SplitFile(self.copy, 300)
+    reported = []
+    progress = [split.progress(index, lambda path, nbytes: reported.append((path, nbytes))) for index in range(3)]
+    progress[0]('/src/f', 100)
+    progress[1]('/src/f', 50)
+    progress[0]('/src/f', 384)
+    progress[0]('/src/f', -1)
+    self.assertEqual(reported, [('/src/f', 100), ('/src/f', 150), ('/src/f', 434)])
+    self.assertIsNone(split.progress(0, None))
+
+class TestScheduleStats(unittest.TestCase):
+
+  def test_model(self):
+    stats = _ScheduleStats()
+    # one second of overhead and a millisecond per byte
+    for index, length in enumerate([1000, 3000, 2000, 2000]):
+      stats.dispatch(length)
+      stats.record(length, index, index + 1 + length / 1000.0)
+    overhead, per_byte = stats._model()
+    self.assertAlmostEqual(overhead, 1)
+    self.assertAlmostEqual(per_byte, 0.001)
+    report = stats.report('size', 2)
+    self.assertEqual(report['Work Units'], 4)
+    self.assertAlmostEqual(report['Predicted Makespan'], 7)
+    self.assertAlmostEqual(report['Ideal Makespan'], 6)
+    self.assertAlmostEqual(report['Actual Makespan'], 6)
+
+  def test_merge(self):
+    stats = _ScheduleStats()
+    stats.dispatch(1000)
+    stats.record(1000, 0, 2)
+    other = pickle.loads(pickle.dumps(stats))
+    other.dispatch(1000)
+    other.record(1000, 1, 5)
+    stats.merge(other)
+    report = stats.report('size', 1)
+    self.assertEqual(report['Work Units'], 3)
+    self.assertEqual(report['Actual Makespan'], 5)
+
+  def test_empty(self):
+    report = _ScheduleStats().report('walk', 4)
+    self.assertEqual((report['Work Units'], report['Actual Makespan']), (0, 0.0))
+
+class _ClusterTestCase(unittest.TestCase):
+
+  """Copies from a fake source cluster to a fake destination cluster."""
+
+  def setUp(self):
+    self.src = FakeCluster(latency=0.001)
+    self.dst = FakeCluster(latency=0.001)
+    self.populate(self.src)
+    self.client = WebHDFSDistClient(client(self.src.start()), client(self.dst.start()))
+
+  def tearDown(self):
+    self.src.stop()
+    self.dst.stop()
+
+  def populate(self, cluster):
+    pass
+
+  def temp_path(self, name):
+    """Path of a file in a temporary directory removed after the test."""
+    if not hasattr(self, '_tmp_dir'):
+      self._tmp_dir = mkdtemp()
+      self.addCleanup(rmtree, self._tmp_dir)
+    return osp.join(self._tmp_dir, name)
+
+  def copied(self, path='/copy'):
+    """Length and integrity of the destination files, by path."""
+    return dict((path, (length, intact)) for path, length, intact in self.dst.files(path))
+
+class TestSmallFiles(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(30):
+      cluster.add_file('/data/small/f%02d' % (index, ), 500 + index)
+    cluster.add_file('/data/big', 5 * 2 ** 16)
+    cluster.add_file('/data/empty', 0)
+
+  def setUp(self):
+    super(TestSmallFiles, self).setUp()
+    self.pipes = []
+    pipe = distclient._pipe
+    def _pipe(*args, **kwargs):
+      self.pipes.append(args[3])
+      return pipe(*args, **kwargs)
+    distclient._pipe = _pipe
+    self.addCleanup(setattr, distclient, '_pipe', pipe)
+
+  def test_copied_from_memory(self):
+    lock = Lock()
+    reported = {}
+    def _progress(path, nbytes):
+      with lock:
+        reported.setdefault(path, []).append(nbytes)
+    status = self.client.copy('/data', '/copy', n_threads=4, buffer_size=2 ** 16, progress=_progress)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 32)
+    copied = self.copied()
+    self.assertEqual(len(copied), 32)
+    self.assertEqual(copied['/copy/small/f07'], (507, True))
+    self.assertTrue(all(intact for _, intact in copied.values()))
+    # only the file bigger than a buffer is read by a separate thread
+    self.assertEqual(self.pipes, ['/data/big'])
+    self.assertEqual(reported['/data/small/f07'], [507, -1])
+
+  def test_buffer_size(self):
+    status = self.client.copy('/data', '/copy', n_threads=4, buffer_size=510)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertTrue(all(intact for _, intact in self.copied().values()))
+    self.assertEqual(len(self.pipes), 20)
+
+class TestResume(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(20):
+      cluster.add_file('/data/d%s/f%02d' % (index % 4, index), 1000 + index * 100)
+
+  def setUp(self):
+    super(TestResume, self).setUp()
+    self.journal = self.temp_path('job.db')
+
+  def test_resume(self):
+    status = self.client.copy('/data', '/copy', n_threads=4, journal=self.journal)
+    self.assertEqual(status['Files Copied'], 20)
+    # interrupted while two files were copied
+    journal = CopyJournal(self.journal)
+    journal.complete('/data/d3/f03', 'failed')
+    journal.complete('/data/d0/f08', 'failed')
+    journal.close()
+    client(self.dst.url).write('/copy/d3/f03', data='partial', overwrite=True)
+    self.dst._remove('/copy/d0/f08')
+    status = self.client.copy('/data', '/copy', n_threads=4, journal=self.journal, resume=True)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 2)
+    self.assertEqual(status['Files Previously Completed'], 18)
+    copied = self.copied()
+    self.assertEqual(len(copied), 20)
+    self.assertEqual(copied['/copy/d3/f03'], (1300, True))
+    self.assertTrue(all(intact for _, intact in copied.values()))
+
+  def test_resume_failing_delete(self):
+    self.client.copy('/data', '/copy', n_threads=4, journal=self.journal)
+    # interrupted while scanning, the source is scanned again
+    journal = CopyJournal(self.journal)
+    journal.complete('/data/d3/f03', 'failed')
+    journal._set_job('scanned', '0')
+    journal.close()
+    client(self.dst.url).write('/copy/d3/f03', data='partial', overwrite=True)
+    # the partial file is deleted before being copied again
+    self.dst.fail_rate = 0.5
+    self.dst.fail_ops = set(['DELETE'])
+    status = self.client.copy(
+      '/data', '/copy', n_threads=4, journal=self.journal, resume=True, retries=20, retry_delay=0.001,
+    )
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 1)
+    self.assertEqual(self.copied()['/copy/d3/f03'], (1300, True))
+
+  def test_resume_preserve(self):
+    self.src._nodes['/data/d3']['permission'] = '700'
+    status = self.client.copy('/data', '/copy', n_threads=4, journal=self.journal, preserve='p')
+    self.assertEqual(status['Files Copied'], 20)
+    # interrupted before the attributes of the directories were set
+    journal = CopyJournal(self.journal)
+    journal.complete('/data/d3/f03', 'failed')
+    journal.close()
+    self.dst._nodes['/copy/d3']['permission'] = '755'
+    status = self.client.copy('/data', '/copy', n_threads=4, journal=self.journal, resume=True, preserve='p')
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 1)
+    self.assertEqual(client(self.dst.url).status('/copy/d3')['permission'], '700')
+
+  def test_other_job(self):
+    self.client.copy('/data', '/copy', n_threads=4, journal=self.journal)
+    with self.assertRaises(HdfsError):
+      self.client.copy('/data', '/other', n_threads=4, journal=self.journal, resume=True)
+
+class TestDelete(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(10):
+      cluster.add_file('/data/d%s/e/f%02d' % (index % 2, index), 1000 + index)
+    cluster.add_file('/data/x', 5)
+    cluster.add_file('/data/y/z', 7)
+
+  def test_mirror(self):
+    self.populate(self.dst)
+    self.dst.add_dir('/copy')
+    for path, length in [('/d0/e/zz', 10), ('/d0/a', 20), ('/old/a/b', 30), ('/old/c', 40), ('/y', 50), ('/x/in', 60)]:
+      self.dst.add_file('/copy/data' + path, length)
+    status = self.client.copy('/data', '/copy', n_threads=4, overwrite=True, delete=True)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual((status['Files Deleted'], status['Size Deleted']), (6, 210))
+    self.assertEqual(
+      sorted((path[len('/copy'):], length) for path, length, _ in self.dst.files('/copy')),
+      sorted((path, length) for path, length, _ in self.src.files('/data')),
+    )
+
+  def test_requires_overwrite(self):
+    with self.assertRaises(ValueError):
+      self.client.copy('/data', '/copy', delete=True)
+
+class TestPreserve(_ClusterTestCase):
+
+  attributes = ['replication', 'blockSize', 'owner', 'group', 'permission', 'modificationTime']
+
+  def populate(self, cluster):
+    for index in range(20):
+      cluster.add_file(
+        '/data/d%s/e/f%02d' % (index % 4, index), (index % 3) * 30000, block_size=2 ** 16,
+        replication=1 + index % 3, permission='640' if index % 2 else '644',
+      )
+    cluster._nodes['/data/d1']['permission'] = '700'
+    cluster._nodes['/data/d2']['owner'] = 'alice'
+    cluster._nodes['/data/d3/e/f03']['owner'] = 'benchmark'
+    cluster._nodes['/data/d3/e']['modification_time'] = 12345
+
+  def _differences(self, attributes):
+    src, dst = client(self.src.url), client(self.dst.url)
+    differences = []
+    for root, dirs, files in src.walk('/data'):
+      for path in [root] + [osp.join(root, name) for name in dirs + files]:
+        src_status = src.status(path)
+        dst_status = dst.status('/copy' + path[len('/data'):])
+        for attribute in attributes:
+          if src_status['type'] == 'DIRECTORY' and attribute in ('replication', 'blockSize'):
+            continue
+          if src_status[attribute] != dst_status[attribute]:
+            differences.append((path, attribute))
+    return differences
+
+  def test_all(self):
+    status = self.client.copy('/data', '/copy', n_threads=4, preserve=True)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 20)
+    self.assertEqual(self._differences(self.attributes), [])
+
+  def test_some(self):
+    status = self.client.copy('/data', '/copy', n_threads=4, preserve='pt')
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(self._differences(['permission', 'modificationTime']), [])
+    self.assertTrue(('/data/d2', 'owner') in self._differences(['owner']))
+
+  def test_unknown(self):
+    with self.assertRaises(ValueError):
+      self.client.copy('/data', '/copy', preserve='x')
+
+class TestPools(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(20):
+      cluster.add_file('/data/d%s/f%02d' % (index % 2, index), 1000 + index * 100)
+
+  def test_cached_resync(self):
+    cache = self.temp_path('checksums.db')
+    # both copies go into the existing directory
+    self.dst.add_dir('/copy')
+    status = self.client.copy('/data', '/copy', n_threads=4, checksum_cache=cache)
+    self.assertEqual(status['Files Copied'], 20)
+    status = self.client.copy('/data', '/copy', n_threads=4, overwrite=True, checksum_cache=cache)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Skipped'], 20)
+    self.assertEqual(status['Comparison']['Cache Misses'], 40)
+
+  def test_spread(self):
+    # two gateways of the same cluster
+    port = self.src.url.rsplit(':', 1)[1]
+    src = create_client('NONE', nameservices=[
+      {'urls': [self.src.url, 'http://localhost:%s' % (port, )], 'mounts': ['/']},
+    ], user='benchmark')
+    status = WebHDFSDistClient(src, self.client.dst).copy(
+      '/data', '/copy', n_threads=4, pool_size=6, host_spread='round-robin',
+    )
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertTrue(all(intact for _, intact in self.copied().values()))
+    connections = status['Connections']['Source']
+    self.assertEqual((connections['Pool Size'], connections['Spread']), (6, 'round-robin'))
+    self.assertEqual(len(connections['Hosts']), 2)
+    # the connections are reused across requests
+    self.assertTrue(connections['Connections'] < connections['Requests'])
+    self.assertTrue(connections['Warmed Up'] > 0)
+
+  def test_no_warm_up(self):
+    status = self.client.copy('/data', '/copy', n_threads=4, warm_up=False)
+    self.assertEqual(status['Connections']['Destination']['Warmed Up'], 0)
+    self.assertEqual(status['Connections']['Destination']['Spread'], 'first')
+
+  def test_unknown_spread(self):
+    with self.assertRaises(ValueError):
+      self.client.copy('/data', '/copy', host_spread='random')
+
+class TestTieredComparison(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(8):
+      cluster.add_file('/data/f%s' % (index, ), 1000)
+      cluster._nodes['/data/f%s' % (index, )]['modification_time'] = 1000
+
+  def setUp(self):
+    super(TestTieredComparison, self).setUp()
+    self.dst.add_dir('/copy')
+    for index in range(8):
+      path = '/copy/data/f%s' % (index, )
+      self.dst.add_file(path, 1000 if index < 6 else 500)
+      # the files 0 and 1 have the source modification time, the content of
+      # the files 0, 2 and 4 differs from their source
+      self.dst._nodes[path]['modification_time'] = 1000 if index < 2 else 2000
+      self.dst._nodes[path]['intact'] = index % 2 == 1
+
+  def test_tiered(self):
+    status = self.client.copy('/data', '/copy', n_threads=2, overwrite=True, compare='tiered')
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Comparison'], {
+      'Mode': 'tiered', 'Length': 2, 'Modification Time': 2, 'Checksum': 4,
+    })
+    # trusted the modification time of the file 0
+    self.assertEqual((status['Files Copied'], status['Files Skipped']), (4, 4))
+    self.assertFalse(self.copied()['/copy/data/f0'][1])
+
+  def test_checksum(self):
+    status = self.client.copy('/data', '/copy', n_threads=2, overwrite=True)
+    self.assertEqual(status['Comparison'], {
+      'Mode': 'checksum', 'Length': 2, 'Modification Time': 0, 'Checksum': 6,
+    })
+    self.assertEqual((status['Files Copied'], status['Files Skipped']), (5, 3))
+    self.assertTrue(all(intact for _, intact in self.copied().values()))
+
+  def test_unknown(self):
+    with self.assertRaises(ValueError):
+      self.client.copy('/data', '/copy', compare='size')
+
+class TestChecksumCache(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(10):
+      cluster.add_file('/data/f%s' % (index, ), 1000 + index)
+
+  def test_across_jobs(self):
+    cache = self.temp_path('checksums.db')
+    self.dst.add_dir('/copy')
+    self.client.copy('/data', '/copy', n_threads=2)
+    cached = []
+    for _ in range(2):
+      status = self.client.copy('/data', '/copy', n_threads=2, overwrite=True, checksum_cache=cache)
+      self.assertEqual(status['Files Skipped'], 10)
+      cached.append((status['Comparison']['Cache Hits'], status['Comparison']['Cache Misses']))
+    # a changed file is checksummed again
+    self.src._nodes['/data/f3']['modification_time'] += 1000
+    status = self.client.copy('/data', '/copy', n_threads=2, overwrite=True, checksum_cache=cache)
+    cached.append((status['Comparison']['Cache Hits'], status['Comparison']['Cache Misses']))
+    self.assertEqual(cached, [(0, 20), (20, 0), (19, 1)])
+    self.assertEqual(self.src.stats()['namenode']['GETFILECHECKSUM'], 11)
+
+  def test_size(self):
+    cache = self.temp_path('checksums.db')
+    self.dst.add_dir('/copy')
+    self.client.copy('/data', '/copy', n_threads=2)
+    self.client.copy('/data', '/copy', n_threads=2, overwrite=True, checksum_cache=cache, checksum_cache_size=5)
+    status = self.client.copy('/data', '/copy', n_threads=2, overwrite=True, checksum_cache=cache)
+    self.assertEqual(status['Comparison']['Cache Hits'], 5)
+
+class TestRetries(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(10):
+      cluster.add_file('/data/d%s/f%s' % (index % 2, index), 1000 + index * 1000)
+
+  def test_transient_failures(self):
+    self.src.fail_rate = self.dst.fail_rate = 0.3
+    self.src.fail_ops = set(['OPEN', 'LISTSTATUS'])
+    self.dst.fail_ops = set(['CREATE', 'RENAME'])
+    status = self.client.copy('/data', '/copy', n_threads=4, retries=8, retry_delay=0.001)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 10)
+    self.assertTrue(all(intact for _, intact in self.copied().values()))
+    failures = self.src.stats()['failures'] + self.dst.stats()['failures']
+    self.assertTrue(failures > 0)
+    self.assertTrue(status['Retries']['Retried Operations'] > 0)
+
+  def test_outage(self):
+    self.src.fail_rate = 1.0
+    self.src.fail_ops = set(['OPEN'])
+    status = self.client.copy('/data', '/copy', n_threads=4, retries=1, retry_delay=0.001)
+    self.assertEqual(status['Outcome'], 'Failed')
+    self.assertEqual(status['Files Failed'], 10)
+    # copied again at the end of the job, after their retries
+    self.assertEqual(status['Retries']['Deferred Files'], 10)
+    self.assertEqual(status['Retries']['Attempts']['Transfer'], 40)
+
+class TestProcesses(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(30):
+      cluster.add_file('/data/d%s/f%02d' % (index % 3, index), 1000 + index * 3000, block_size=2 ** 14)
+
+  def test_copy(self):
+    lock = Lock()
+    reported = {}
+    def _progress(path, nbytes):
+      with lock:
+        reported[path] = nbytes
+    status = self.client.copy('/data', '/copy', n_threads=2, n_processes=3, split_size=2 ** 16, progress=_progress)
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 30)
+    copied = self.copied()
+    self.assertEqual(len(copied), 30)
+    self.assertTrue(all(intact for _, intact in copied.values()))
+    # relayed by the copy processes
+    self.assertEqual(len(reported), 30)
+    self.assertTrue(all(nbytes == -1 for nbytes in reported.values()))
+    # the statistics of the processes are merged
+    self.assertEqual(status['Schedule']['Work Units'], sum(
+      (length + 2 ** 16 - 1) // 2 ** 16 for _, length, _ in self.src.files('/data')
+    ))
+
+  def test_options(self):
+    with self.assertRaises(ValueError):
+      self.client.copy('/data', '/copy', n_processes=2, coordinator=('localhost', 0), authkey='secret')
+
+class TestBatch(_ClusterTestCase):
+
+  def populate(self, cluster):
+    for index in range(24):
+      cluster.add_file('/data/d%s/f%02d' % (index % 3, index), 1000 + index)
+
+  def setUp(self):
+    super(TestBatch, self).setUp()
+    self.dst.add_dir('/copy')
+
+  def test_batch(self):
+    pairs = [('/data/d%s' % (index, ), '/copy/d%s' % (index, )) for index in range(3)]
+    status = self.client.copy_batch(pairs + [('/missing', '/copy/missing')], n_threads=4, max_jobs=2)
+    jobs, aggregate = status['Jobs'], status['Aggregate']
+    self.assertEqual([job['Outcome'] for job in jobs], ['Successful'] * 3 + ['Failed'])
+    self.assertTrue('Error' in jobs[3])
+    self.assertEqual(aggregate['Outcome'], 'Failed')
+    self.assertEqual(aggregate['Files Copied'], 24)
+    self.assertEqual(aggregate['Budget']['Slots'], 4)
+    self.assertEqual(aggregate['Budget']['Granted'], 24)
+    self.assertTrue(aggregate['Budget']['Peak Slots'] <= 4)
+    # the requests are only reported for the whole batch
+    self.assertFalse(any('Requests' in job.get('Metrics', {}) or 'Connections' in job for job in jobs))
+    self.assertTrue(aggregate['Requests']['Destination'])
+    self.assertEqual(len(self.copied()), 24)
+
+  def test_journals(self):
+    journal = self.temp_path('batch')
+    pairs = [('/data/d0', '/copy/d0'), ('/data/d1', '/copy/d1')]
+    self.client.copy_batch(pairs, n_threads=2, journal=journal)
+    status = self.client.copy_batch(pairs, n_threads=2, journal=journal, resume=True)
+    self.assertEqual([job['Files Previously Completed'] for job in status['Jobs']], [8, 8])
+    self.assertEqual(status['Aggregate']['Files Copied'], 0)
+
+  def test_metrics_file(self):
+    with self.assertRaises(ValueError):
+      self.client.copy_batch([('/data/d0', '/copy/d0')], metrics_file=self.temp_path('metrics.json'))
+
+if __name__ == '__main__':
+  unittest.main()
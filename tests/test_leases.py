@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Test the leases of the coordinator and workers mode."""
+
+from threading import Thread
+import os.path as osp
+import socket
+import sys
+import time
+import unittest
+
+sys.path.insert(0, osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'benchmarks'))
+
+from fakehdfs import FakeCluster, _pattern, client
+from pydistcp.distclient import WebHDFSDistClient
+from pydistcp.leases import LeaseClient, LeaseQueue
+
+_AUTHKEY = 'secret'
+
+def _free_address():
+  sock = socket.socket()
+  try:
+    sock.bind(('localhost', 0))
+    return sock.getsockname()
+  finally:
+    sock.close()
+
+class TestLeaseQueue(unittest.TestCase):
+
+  def test_take_in_order(self):
+    leases = LeaseQueue(60, 4)
+    leases.put('a')
+    leases.put('b')
+    self.assertEqual(leases.take(0)[1:], ('a', False))
+    self.assertEqual(leases.take(1)[1:], ('b', False))
+    self.assertIsNone(leases.take(0, timeout=0.01))
+
+  def test_complete(self):
+    leases = LeaseQueue(60, 4)
+    leases.put('a')
+    leases.close()
+    lease, _, _ = leases.take(0)
+    self.assertFalse(leases.finished())
+    self.assertFalse(leases.complete(1, lease))
+    self.assertTrue(leases.complete(0, lease))
+    self.assertTrue(leases.finished())
+    self.assertIs(leases.take(0, timeout=0.01), False)
+
+  def test_expire_reassigns(self):
+    leases = LeaseQueue(0.05, 4)
+    leases.put('a')
+    leases.put('b')
+    lease, _, _ = leases.take(0)
+    leases.renew(1)
+    time.sleep(0.1)
+    leases.renew(1)
+    self.assertEqual(leases.expire(), set([0]))
+    self.assertEqual(leases.expired, 1)
+    # handed again first, flagged as partially copied
+    self.assertEqual(leases.take(1)[1:], ('a', True))
+    self.assertEqual(leases.take(1)[1:], ('b', False))
+    # the results of the expired worker are rejected
+    self.assertFalse(leases.complete(0, lease))
+
+  def test_drained_by_own_leases(self):
+    leases = LeaseQueue(60, 4)
+    leases.put('a')
+    leases.put('b')
+    leases.close()
+    lease, _, _ = leases.take(0)
+    leases.take(1)
+    # the leases of worker 1 may still be handed again
+    self.assertIsNone(leases.take(0, timeout=0.01))
+    leases.complete(0, lease)
+    self.assertIs(leases.take(1, timeout=0.01), False)
+    self.assertFalse(leases.finished())
+
+class _LeaseTestCase(unittest.TestCase):
+
+  """Copies leased to workers, from a fake source cluster to a fake
+  destination cluster."""
+
+  def setUp(self):
+    self.src = FakeCluster(latency=0.001)
+    self.dst = FakeCluster(latency=0.001)
+    for index in range(20):
+      self.src.add_file('/data/d%s/f%02d' % (index % 2, index), 1000 + index * 20000)
+    self.src_url = self.src.start()
+    self.dst_url = self.dst.start()
+
+  def tearDown(self):
+    self.src.stop()
+    self.dst.stop()
+
+  def _client(self):
+    return WebHDFSDistClient(client(self.src_url), client(self.dst_url))
+
+  def _coordinate(self, address, **kwargs):
+    """Start a coordinator thread, returns it and its future status."""
+    results = {}
+    def _coordinate():
+      results['status'] = self._client().copy(
+        '/data', '/copy', n_threads=2, coordinator=address, authkey=_AUTHKEY, **kwargs
+      )
+    coordinator = Thread(target=_coordinate)
+    coordinator.start()
+    return coordinator, results
+
+class TestCoordinator(_LeaseTestCase):
+
+  def test_not_warmed_up(self):
+    address = _free_address()
+    coordinator, results = self._coordinate(address)
+    while True:
+      try:
+        self._client().work(address, _AUTHKEY, n_threads=2, warm_up=False)
+        break
+      except socket.error:
+        # the coordinator is not listening yet
+        time.sleep(0.05)
+    coordinator.join()
+    status = results['status']
+    self.assertEqual(status['Files Copied'], 20)
+    # only the workers copy files, the coordinator opens no connections ahead
+    for report in status['Connections'].values():
+      self.assertEqual(report['Warmed Up'], 0)
+
+class TestKilledWorker(_LeaseTestCase):
+
+  def test_partial_file_copied_again(self):
+    address = _free_address()
+    coordinator, results = self._coordinate(address, lease_timeout=1.0)
+
+    # a worker dying while it writes a file
+    dead = LeaseClient(address, _AUTHKEY)
+    while True:
+      try:
+        dead.hello()
+        break
+      except socket.error:
+        # the coordinator is not listening yet
+        time.sleep(0.05)
+    lease = None
+    while not lease:
+      lease = dead.take()
+    work = lease[1]
+    client(self.dst_url).write(work.dst_path, data=_pattern(0, work.status.length // 2))
+    dead.close()
+
+    worker = self._client().work(address, _AUTHKEY, n_threads=2)
+    coordinator.join()
+    status = results['status']
+    self.assertEqual(status['Outcome'], 'Successful')
+    self.assertEqual(status['Files Copied'], 20)
+    self.assertEqual(status['Leases']['Expired'], 1)
+    self.assertEqual(worker['Files'], 20)
+    copied = dict((path, (length, intact)) for path, length, intact in self.dst.files('/copy'))
+    self.assertEqual(copied[work.dst_path], (work.status.length, True))
+    self.assertTrue(all(intact for _, intact in copied.values()))
+    self.assertEqual(len(copied), 20)
+
+if __name__ == '__main__':
+  unittest.main()
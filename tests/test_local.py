@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Test the local file system client."""
+
+import hashlib
+import struct
+import unittest
+import zlib
+
+from pydistcp.local import file_checksum
+
+try:
+  import crc32c
+except ImportError:
+  crc32c = None
+
+def _md5_of_crcs(data, bytes_per_crc):
+  crcs = [
+    zlib.crc32(data[offset:offset + bytes_per_crc]) & 0xffffffff
+    for offset in range(0, len(data), bytes_per_crc)
+  ]
+  return hashlib.md5(struct.pack('>%sI' % (len(crcs), ), *crcs)).digest()
+
+class TestFileChecksum(unittest.TestCase):
+
+  def setUp(self):
+    self.data = ''.join(chr(index % 251) for index in range(1300))
+
+  def test_single_block(self):
+    checksum = file_checksum(self.data, 4096, crc_type='CRC32')
+    self.assertEqual(checksum['algorithm'], 'MD5-of-0MD5-of-512CRC32')
+    self.assertEqual(checksum['length'], 28)
+    expected = struct.pack('>iq', 512, 0) + hashlib.md5(_md5_of_crcs(self.data, 512)).digest()
+    self.assertEqual(checksum['bytes'], expected.encode('hex'))
+
+  def test_several_blocks(self):
+    checksum = file_checksum(self.data, 1024, bytes_per_crc=256, crc_type='CRC32')
+    self.assertEqual(checksum['algorithm'], 'MD5-of-4MD5-of-256CRC32')
+    blocks = _md5_of_crcs(self.data[:1024], 256) + _md5_of_crcs(self.data[1024:], 256)
+    expected = struct.pack('>iq', 256, 4) + hashlib.md5(blocks).digest()
+    self.assertEqual(checksum['bytes'], expected.encode('hex'))
+
+  def test_empty(self):
+    checksum = file_checksum('', 1024, crc_type='CRC32')
+    expected = struct.pack('>iq', 512, 0) + hashlib.md5(hashlib.md5('').digest()).digest()
+    self.assertEqual(checksum['bytes'], expected.encode('hex'))
+
+  def test_buffer(self):
+    self.assertEqual(
+      file_checksum(buffer(self.data), 1024, crc_type='CRC32'),
+      file_checksum(self.data, 1024, crc_type='CRC32'),
+    )
+
+  @unittest.skipIf(crc32c is None, 'crc32c is not installed')
+  def test_crc32c(self):
+    checksum = file_checksum(self.data, 4096)
+    self.assertEqual(checksum['algorithm'], 'MD5-of-0MD5-of-512CRC32C')
+    self.assertNotEqual(checksum['bytes'], file_checksum(self.data, 4096, crc_type='CRC32')['bytes'])
+
+if __name__ == '__main__':
+  unittest.main()